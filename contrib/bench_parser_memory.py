@@ -0,0 +1,80 @@
+"""Compares the peak memory (RSS) of the sales parser in full and streaming mode
+
+Usage:
+    python contrib/bench_parser_memory.py [rows ...]
+
+Each measure runs in a fresh python process, so the peak RSS isn't shared between them.
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ROWS = (1000, 10000, 50000, 100000)
+
+
+def setup_django():
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'salesmanagement.settings')
+    import django
+    django.setup()
+
+
+def make_sheet(path, rows):
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(['Produto', 'Categoria', 'Vendidos', 'Custo', 'Total'])
+    for i in range(rows):
+        ws.append([f'Product {i % 500}', f'Category {i % 20}', str(i % 10 + 1), 'R$ 4,70', 'R$ 47,30'])
+    wb.save(path)
+
+
+def parse_full(path):
+    from openpyxl import load_workbook
+    from salesmanagement.importer.parser import ParserSalesXlsx
+
+    parser = ParserSalesXlsx(path)
+    ws = load_workbook(filename=path).active
+    return len([parser.get_row(tuple(c.value for c in row)) for row in list(ws.rows)[1:]])
+
+
+def parse_streaming(path):
+    from salesmanagement.importer.parser import ParserSalesXlsx
+
+    return sum(1 for _ in ParserSalesXlsx(path).iter_rows())
+
+
+def child(mode, path):
+    setup_django()
+    count = {'full': parse_full, 'streaming': parse_streaming}[mode](path)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(count, peak_kb)
+
+
+def measure(mode, path):
+    out = subprocess.check_output([sys.executable, __file__, '--child', mode, path])
+    count, peak_kb = out.split()
+    return int(count), int(peak_kb)
+
+
+def main(rows_list):
+    setup_django()
+    print(f'{"rows":>10} {"full (MB)":>12} {"streaming (MB)":>16}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in rows_list:
+            path = os.path.join(tmp, f'sales_{rows}.xlsx')
+            make_sheet(path, rows)
+            _, full_kb = measure('full', path)
+            _, streaming_kb = measure('streaming', path)
+            print(f'{rows:>10} {full_kb / 1024:>12.1f} {streaming_kb / 1024:>16.1f}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        child(sys.argv[2], sys.argv[3])
+    else:
+        main([int(n) for n in sys.argv[1:]] or DEFAULT_ROWS)
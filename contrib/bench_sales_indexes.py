@@ -0,0 +1,103 @@
+"""Shows the query plans of the products sale access paths before and after the composite indexes
+
+Usage:
+    python contrib/bench_sales_indexes.py [rows]
+
+It needs the PostgreSQL database of the settings (DATABASE_URL). A scratch table shaped like
+manager_productssale is filled with `rows` sales (10 million by default) and indexed like the
+foreign keys only. Each query is explained, the composite indexes are created and they are
+explained again. The scratch table is dropped at the end.
+"""
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ROWS = 10 ** 7
+TABLE = 'bench_productssale'
+COMPANIES = 50
+PRODUCTS = 5000
+
+# a unique (company, product, month) for every row, like the products sale constraint; % is escaped as %%
+CREATE_TABLE = f'''
+CREATE UNLOGGED TABLE {TABLE} AS
+SELECT i AS id, i %% {COMPANIES} + 1 AS company_id, i / {COMPANIES} %% {PRODUCTS} + 1 AS product_id,
+       (date '2015-01-01' + (i / ({COMPANIES} * {PRODUCTS})) * interval '1 month')::date AS sale_month,
+       i %% 10 + 1 AS sold, 4.70::numeric(14, 2) AS cost, ((i %% 10 + 1) * 4.70)::numeric(14, 2) AS total
+FROM generate_series(0, %(rows)s - 1) AS i'''
+
+FK_INDEXES = (
+    f'CREATE INDEX {TABLE}_company_id ON {TABLE} (company_id)',
+    f'CREATE INDEX {TABLE}_product_id ON {TABLE} (product_id)',
+)
+
+COMPOSITE_INDEXES = (
+    f'CREATE INDEX {TABLE}_company_month_idx ON {TABLE} (company_id, sale_month)',
+    f'CREATE INDEX {TABLE}_product_comp_idx ON {TABLE} (product_id, company_id)',
+)
+
+QUERIES = (
+    ('month of a company (admin filters, imports)',
+     f'SELECT * FROM {TABLE} WHERE company_id = 7 AND sale_month = %(month)s'),
+    ('last sale of a product of a company (ProductAdmin current cost)',
+     f'SELECT * FROM {TABLE} WHERE product_id = 42 AND company_id = 42 ORDER BY id DESC LIMIT 1'),
+    ('month extracted, the lookup SalesImportForm used',
+     f'SELECT * FROM {TABLE} WHERE company_id = 7 AND EXTRACT(month FROM sale_month) = %(month_number)s '
+     f'AND EXTRACT(year FROM sale_month) = %(year)s LIMIT 1'),
+    ('month range, the lookup SalesImportForm uses',
+     f'SELECT * FROM {TABLE} WHERE company_id = 7 AND sale_month >= %(month)s '
+     f'AND sale_month < %(month)s::date + interval \'1 month\' LIMIT 1'),
+)
+
+
+def setup_django():
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'salesmanagement.settings')
+    import django
+    django.setup()
+
+
+def execute(cursor, sql, params=None):
+    started = time.monotonic()
+    cursor.execute(sql, params)
+    return time.monotonic() - started
+
+
+def explain_queries(cursor, params):
+    for title, sql in QUERIES:
+        cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {sql}', params)
+        print(f'\n-- {title}')
+        print('\n'.join(line for line, in cursor.fetchall()))
+
+
+def main(rows):
+    setup_django()
+    from django.db import connection
+
+    if connection.vendor != 'postgresql':
+        sys.exit('The query plans need PostgreSQL, set DATABASE_URL to a PostgreSQL database')
+
+    params = {'rows': rows, 'month': '2016-03-01', 'month_number': 3, 'year': 2016}
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+        print(f'filling {TABLE} with {rows} rows: {execute(cursor, CREATE_TABLE, params):.1f}s')
+        try:
+            for sql in FK_INDEXES:
+                execute(cursor, sql)
+            execute(cursor, f'ANALYZE {TABLE}')
+
+            print('\n==== foreign key indexes only ====')
+            explain_queries(cursor, params)
+
+            for sql in COMPOSITE_INDEXES:
+                print(f'\n{sql}: {execute(cursor, sql):.1f}s')
+            execute(cursor, f'ANALYZE {TABLE}')
+
+            print('\n==== composite indexes ====')
+            explain_queries(cursor, params)
+        finally:
+            cursor.execute(f'DROP TABLE {TABLE}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS)
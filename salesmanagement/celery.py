@@ -10,6 +10,16 @@ app = Celery('salesmanagement')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
 
+# Small imports go to the express queue and big ones to the bulk queue (see SalesImportFile.get_import_queue),
+# each queue has its own workers so a huge import doesn't delay the small ones:
+#   express: many processes, they finish in seconds
+#   bulk: few processes taking one task at a time, they run for minutes
+app.conf.task_default_queue = 'express'
+app.conf.task_routes = {
+    'salesmanagement.importer.tasks.aggregate_sales_chunk_task': {'queue': 'bulk'},
+    'salesmanagement.importer.tasks.merge_sales_chunks_task': {'queue': 'bulk'},
+}
+
 
 @app.task(bind=True)
 def debug_task(self):
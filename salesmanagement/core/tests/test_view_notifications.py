@@ -25,6 +25,23 @@ class NotificationInAnyViewLoggedUserTest(TestCase):
                 self.assertContains(self.response, text, count)
 
 
+class NotificationDescriptionTest(TestCase):
+    def setUp(self):
+        self.user = RandomUserFactory(password='pass')
+        self.client.login(username=self.user.username, password='pass')
+
+    def test_description(self):
+        """Must show the description lines, e.g. the invalid rows of an imported file"""
+        description = 'Linha 3: tem 2 colunas, deveria ter 5\nLinha 7: tem 2 colunas, deveria ter 5\n'
+        Notification.objects.create(actor=self.user, recipient=self.user, description=description)
+        response = self.client.get('/')
+        self.assertContains(response, 'Linha 3: tem 2 colunas, deveria ter 5<br />Linha 7')
+
+    def test_without_description(self):
+        Notification.objects.create(actor=self.user, recipient=self.user)
+        self.assertNotContains(self.client.get('/'), 'notification-description')
+
+
 class NotificationAnyViewAnonymousUserTest(TestCase):
     def setUp(self):
         self.response = self.client.get('/')
@@ -8,10 +8,14 @@ from salesmanagement.importer.models import SalesImportFile
 
 
 class SalesFileAdmin(admin.ModelAdmin):
-    fields = ('user', 'company', 'month_year', 'status', 'file')
-    list_display = ('filename', 'company', 'month_year', 'status', 'imported')
+    stats_fields = ('upload_time', 'queue_time', 'open_time', 'parse_time', 'lookup_time', 'write_time',
+                    'notify_time', 'rows_per_second', 'peak_memory')
+    fields = ('user', 'company', 'month_year', 'status', 'file', 'sheets', 'skip_invalid_rows',
+              'import_errors') + stats_fields
+    list_display = ('filename', 'company', 'month_year', 'status', 'imported') + stats_fields
     list_filter = ('company', 'user')
-    readonly_fields = ('filename', 'user', 'company', 'month_year', 'status', 'imported')
+    readonly_fields = ('filename', 'user', 'company', 'month_year', 'status', 'imported',
+                       'import_errors') + stats_fields
     list_select_related = ('company', 'user')
 
     def filename(self, obj):
@@ -0,0 +1,422 @@
+from collections import OrderedDict
+from decimal import Decimal
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DateField, DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from djmoney.money import Money
+
+from salesmanagement.importer.parser import ColumnBatch, SaleRow
+from salesmanagement.importer.stats import ImportStats
+from salesmanagement.manager.models import MonthlySales, Product, ProductCategory, ProductCurrentSale, ProductsSale
+
+
+def aggregate_sales(sales, aggregated=None):
+    """Groups the sales by (category, product), summing sold and total and keeping the first cost"""
+    aggregated = aggregated if aggregated is not None else OrderedDict()
+    for sale in sales:
+        key = (sale.category, sale.product)
+        item = aggregated.get(key)
+        if item is None:
+            aggregated[key] = {'sold': sale.sold, 'cost': sale.cost, 'total': sale.total}
+        else:
+            item['sold'] += sale.sold
+            item['total'] += sale.total
+
+    return aggregated
+
+
+def aggregate_columns(columns, aggregated=None):
+    """Same as aggregate_sales for a ColumnBatch, zipping the columns instead of reading row objects"""
+    aggregated = aggregated if aggregated is not None else OrderedDict()
+    keys = zip(columns['category'], columns['product'])
+    for key, sold, cost, total in zip(keys, columns['sold'], columns['cost'], columns['total']):
+        item = aggregated.get(key)
+        if item is None:
+            aggregated[key] = {'sold': sold, 'cost': cost, 'total': total}
+        else:
+            item['sold'] += sold
+            item['total'] += total
+
+    return aggregated
+
+
+def aggregate_batch(batch, aggregated=None):
+    """Aggregates a batch of parsed sales, either a list of rows or a ColumnBatch"""
+    if isinstance(batch, ColumnBatch):
+        return aggregate_columns(batch, aggregated)
+    return aggregate_sales(batch, aggregated)
+
+
+def dump_aggregated(aggregated):
+    """Converts aggregated sales to a JSON serializable list, used to send them between tasks"""
+    return [[category, product, item['sold'], str(item['cost']), str(item['total'])]
+            for (category, product), item in aggregated.items()]
+
+
+def merge_aggregated(dumps):
+    """Merges dumped aggregated sales in the given order, like they were aggregated at once"""
+    aggregated = OrderedDict()
+    for dump in dumps:
+        sales = (SaleRow(product, category, sold, Decimal(cost), Decimal(total))
+                 for category, product, sold, cost, total in dump)
+        aggregate_sales(sales, aggregated)
+
+    return aggregated
+
+
+def new_products_sale(company, month, product_id, sale):
+    """Builds the ProductsSale of an aggregated sale, its amounts become Money only here"""
+    return ProductsSale(company=company, product_id=product_id, sale_month=month, sold=sale['sold'],
+                        cost=Money(sale['cost'], 'BRL'), total=Money(sale['total'], 'BRL'))
+
+
+def cents(amount):
+    """Rounds an amount like it's saved by the money fields"""
+    return Decimal(amount).quantize(Decimal('0.01'))
+
+
+def refresh_monthly_sales(company, month):
+    """Sums the MonthlySales of a company month again from its products sale"""
+    MonthlySales.objects.filter(company=company, sale_month=month).delete()
+    q = (ProductsSale.objects.filter(company=company, sale_month=month).values('product__category_id')
+         .annotate(products=Count('pk'), sold=Sum('sold'), costs=Sum('cost'), total=Sum('total')).order_by())
+    MonthlySales.objects.bulk_create(
+        MonthlySales(company=company, sale_month=month, category_id=row['product__category_id'],
+                     products=row['products'], sold=row['sold'], costs=Money(row['costs'], 'BRL'),
+                     total=Money(row['total'], 'BRL'))
+        for row in q
+    )
+
+
+def unique(items):
+    """Returns a list without the repeated items, keeping the order"""
+    return list(OrderedDict.fromkeys(items))
+
+
+def create_missing(keys, create, fetch):
+    """Creates the rows of the keys, returning the ones not created meanwhile by concurrent imports"""
+    # sorted, concurrent imports lock the same rows in the same order instead of deadlocking on PostgreSQL
+    keys = sorted(keys)
+    while keys:
+        try:
+            with transaction.atomic():
+                create(keys)
+            return keys
+        except IntegrityError:
+            saved = fetch(keys)
+            missing = [key for key in keys if key not in saved]
+            if len(missing) == len(keys):
+                # it isn't a conflict with another import
+                raise
+            keys = missing
+
+    return keys
+
+
+def create_new(keys, existing, create, fetch):
+    """Creates the rows of the keys not in `existing`, fetching there the ones created meanwhile"""
+    new = [key for key in keys if key not in existing]
+    created = create_missing(new, create, fetch)
+    if len(created) < len(new):
+        existing.update(fetch(set(new) - set(created)))
+
+    return created
+
+
+def update_by_pk(queryset, values, fields, add=False):
+    """Updates with a single query the rows of `values`, a dict of pk -> {field: value}"""
+    # djmoney leaves Case expressions untouched, so the money fields are updated as plain amounts
+    updates = {}
+    for field, output_field in fields.items():
+        whens = [When(pk=pk, then=F(field) + Value(row[field]) if add else Value(row[field]))
+                 for pk, row in values.items()]
+        updates[field] = Case(*whens, output_field=output_field)
+    queryset.filter(pk__in=values).update(**updates)
+
+
+def refresh_current_sales(company, products_ids=None):
+    """Stores the cost and price of the latest products sale of the given products, or all of them"""
+    latest = (ProductsSale.objects.filter(company=company, product=OuterRef('product'))
+              .order_by('-sale_month', '-pk').values('pk')[:1])
+    q = ProductsSale.objects.filter(company=company, pk=Subquery(latest))
+    current = ProductCurrentSale.objects.filter(company=company)
+    if products_ids is not None:
+        products_ids = set(products_ids)
+        q = q.filter(product_id__in=products_ids)
+        current = current.filter(product_id__in=products_ids)
+
+    rows = q.values_list('product_id', 'sale_month', 'cost', 'sold', 'total')
+    sales = {product_id: {'sale_month': month, 'cost': cents(cost), 'price': cents(total / sold) if sold else cents(0)}
+             for product_id, month, cost, sold, total in rows}
+    if products_ids is None or len(sales) < len(products_ids):
+        current.exclude(product_id__in=ProductsSale.objects.filter(company=company).values('product_id')).delete()
+
+    def create(new):
+        ProductCurrentSale.objects.bulk_create(
+            ProductCurrentSale(company=company, product_id=product_id, sale_month=sales[product_id]['sale_month'],
+                               cost=Money(sales[product_id]['cost'], 'BRL'),
+                               price=Money(sales[product_id]['price'], 'BRL'))
+            for product_id in new
+        )
+
+    def fetch(keys):
+        return dict(current.filter(product_id__in=keys).values_list('product_id', 'pk'))
+
+    existing = dict(current.values_list('product_id', 'pk'))
+    create_new(sales, existing, create, fetch)
+
+    changed = {pk: sales[product_id] for product_id, pk in existing.items() if product_id in sales}
+    if changed:
+        update_by_pk(ProductCurrentSale.objects, changed,
+                     {'sale_month': DateField(), 'cost': DecimalField(), 'price': DecimalField()})
+
+
+class ImportLookupCache:
+    """In-memory identity map of the categories, products and company links used by an import"""
+
+    def __init__(self, company):
+        self.company = company
+        self.categories = {}
+        self.products = {}
+        self.company_products = set()
+
+    def load(self):
+        for name, pk in ProductCategory.objects.order_by('pk').values_list('name', 'pk'):
+            self.categories.setdefault(name, pk)
+
+        for name, category_id, pk in Product.objects.order_by('pk').values_list('name', 'category_id', 'pk'):
+            self.products.setdefault((name, category_id), pk)
+
+        through = Product.company.through
+        self.company_products.update(through.objects.filter(company=self.company)
+                                     .values_list('product_id', flat=True))
+        return self
+
+
+class BulkSalesImporter:
+    """Saves batches of parsed sales of a company month with a fixed number of queries per batch"""
+
+    def __init__(self, company, month, cache=None, stats=None):
+        self.company = company
+        self.month = month
+        self.stats = stats if stats is not None else ImportStats()
+        with self.stats.measure('lookup'):
+            self.cache = cache if cache is not None else ImportLookupCache(company).load()
+
+    def import_batch(self, sales):
+        """Saves a batch of parsed sales, rows or a ColumnBatch, returns how many rows were imported"""
+        if not isinstance(sales, ColumnBatch):
+            sales = list(sales)
+        self.save_aggregated(aggregate_batch(sales))
+        return len(sales)
+
+    @transaction.atomic
+    def save_aggregated(self, aggregated):
+        """Saves sales already aggregated by (category, product)"""
+        if not aggregated:
+            return
+
+        products_ids = self.get_products_ids(aggregated)
+        with self.stats.measure('write'):
+            created = self.save_products_sale(zip(products_ids, aggregated.values()))
+            self.add_monthly_sales(aggregated, products_ids, created)
+            refresh_current_sales(self.company, products_ids)
+
+    @transaction.atomic
+    def replace_aggregated(self, aggregated, batch_size=1000):
+        """Makes the company month sales equal to the aggregated ones, writing only what changed"""
+        with self.stats.measure('lookup'):
+            existing = self.get_month_sales()
+
+        items = iter(aggregated.items())
+        batch = OrderedDict(islice(items, batch_size))
+        changed, written = False, []
+        while batch:
+            products_ids = self.get_products_ids(batch)
+            with self.stats.measure('write'):
+                changed |= self.replace_products_sale(zip(products_ids, batch.values()), existing)
+            written.extend(products_ids)
+            for product_id in products_ids:
+                existing.pop(product_id, None)
+            batch = OrderedDict(islice(items, batch_size))
+
+        deleted = [pk for pk, sold, cost, total in existing.values()]
+        with self.stats.measure('write'):
+            for start in range(0, len(deleted), batch_size):
+                ProductsSale.objects.filter(pk__in=deleted[start:start + batch_size]).delete()
+            if changed or deleted:
+                refresh_monthly_sales(self.company, self.month)
+                products_ids = written + list(existing)
+                for start in range(0, len(products_ids), batch_size):
+                    refresh_current_sales(self.company, products_ids[start:start + batch_size])
+
+    def get_products_ids(self, aggregated):
+        """Returns the ids of the aggregated products, creating them and linking them to the company"""
+        with self.stats.measure('lookup'):
+            categories = self.get_or_create_categories(unique(category for category, product in aggregated))
+            keys = [(product, categories[category]) for category, product in aggregated]
+            products = self.get_or_create_products(keys)
+            products_ids = [products[key] for key in keys]
+            self.add_company_to_products(products_ids)
+
+        return products_ids
+
+    def get_or_create_categories(self, names):
+        """Returns the cached dict of category name -> id, creating the missing ones"""
+        categories = self.cache.categories
+        missing = [name for name in names if name not in categories]
+        if missing:
+            create_missing(missing, self.create_categories, self.get_categories)
+            categories.update(self.get_categories(missing))
+
+        return categories
+
+    def get_or_create_products(self, keys):
+        """Returns the cached dict of (product name, category id) -> id, creating the missing ones"""
+        products = self.cache.products
+        missing = unique(key for key in keys if key not in products)
+        if missing:
+            create_missing(missing, self.create_products, self.get_products)
+            products.update(self.get_products(missing))
+
+        return products
+
+    def add_company_to_products(self, products_ids):
+        linked = self.cache.company_products
+        missing = unique(product_id for product_id in products_ids if product_id not in linked)
+        if missing:
+            create_missing(missing, self.create_company_products, self.get_company_products)
+            linked.update(missing)
+
+    def create_categories(self, names):
+        ProductCategory.objects.bulk_create(ProductCategory(name=name) for name in names)
+
+    def create_products(self, keys):
+        Product.objects.bulk_create(Product(name=name, category_id=category_id) for name, category_id in keys)
+
+    def create_company_products(self, products_ids):
+        through = Product.company.through
+        through.objects.bulk_create(through(company=self.company, product_id=product_id) for product_id in products_ids)
+
+    def create_products_sale(self, sales):
+        """Returns a function that inserts the products sale of the given products ids, for create_missing"""
+        def create(products_ids):
+            ProductsSale.objects.bulk_create(new_products_sale(self.company, self.month, product_id, sales[product_id])
+                                             for product_id in products_ids)
+        return create
+
+    def create_monthly_sales(self, sums):
+        """Returns a function that inserts the MonthlySales of the given categories ids, for create_missing"""
+        def create(categories_ids):
+            MonthlySales.objects.bulk_create(
+                MonthlySales(company=self.company, sale_month=self.month, category_id=category_id,
+                             products=sums[category_id]['products'], sold=sums[category_id]['sold'],
+                             costs=Money(sums[category_id]['costs'], 'BRL'),
+                             total=Money(sums[category_id]['total'], 'BRL'))
+                for category_id in categories_ids
+            )
+        return create
+
+    def save_products_sale(self, sales):
+        """Inserts the new products sale and adds to the existing ones, returns the created ones"""
+        sales = OrderedDict(sales)
+        existing = self.get_products_sale(sales.keys())
+        created = create_new(sales, existing, self.create_products_sale(sales), self.get_products_sale)
+
+        if existing:
+            update_by_pk(ProductsSale.objects, {pk: sales[product_id] for product_id, pk in existing.items()},
+                         {'sold': IntegerField(), 'total': DecimalField()}, add=True)
+
+        return created
+
+    def add_monthly_sales(self, aggregated, products_ids, created):
+        """Adds the aggregated sales to the MonthlySales of their categories"""
+        created = set(created)
+        sums = OrderedDict()
+        for ((category, product), sale), product_id in zip(aggregated.items(), products_ids):
+            item = sums.setdefault(self.cache.categories[category], {'products': 0, 'sold': 0, 'costs': 0, 'total': 0})
+            item['sold'] += sale['sold']
+            item['total'] += sale['total']
+            if product_id in created:
+                item['products'] += 1
+                item['costs'] += cents(sale['cost'])
+
+        existing = self.get_monthly_sales(sums.keys())
+        create_new(sums, existing, self.create_monthly_sales(sums), self.get_monthly_sales)
+
+        if existing:
+            fields = {'products': IntegerField(), 'sold': IntegerField(), 'costs': DecimalField(),
+                      'total': DecimalField()}
+            update_by_pk(MonthlySales.objects, {pk: sums[category_id] for category_id, pk in existing.items()},
+                         fields, add=True)
+
+    def replace_products_sale(self, sales, existing):
+        """Inserts the new products sale and overwrites the changed ones, returns if any was written"""
+        sales = OrderedDict(sales)
+        new = [product_id for product_id in sales if product_id not in existing]
+        create_new(sales, existing, self.create_products_sale(sales), self.get_month_sales)
+
+        changed = OrderedDict()
+        for product_id, sale in sales.items():
+            if product_id not in existing:
+                continue
+            pk, *values = existing[product_id]
+            new_values = [sale['sold'], cents(sale['cost']), cents(sale['total'])]
+            if values != new_values:
+                changed[pk] = dict(zip(('sold', 'cost', 'total'), new_values))
+
+        if changed:
+            update_by_pk(ProductsSale.objects, changed,
+                         {'sold': IntegerField(), 'cost': DecimalField(), 'total': DecimalField()})
+
+        return bool(new or changed)
+
+    def get_categories(self, names):
+        categories = {}
+        for name, pk in ProductCategory.objects.filter(name__in=names).order_by('pk').values_list('name', 'pk'):
+            categories.setdefault(name, pk)
+
+        return categories
+
+    def get_products(self, keys):
+        keys = set(keys)
+        names = {name for name, category_id in keys}
+        categories_ids = {category_id for name, category_id in keys}
+        q = Product.objects.filter(name__in=names, category_id__in=categories_ids).order_by('pk')
+
+        products = {}
+        for name, category_id, pk in q.values_list('name', 'category_id', 'pk'):
+            if (name, category_id) in keys:
+                products.setdefault((name, category_id), pk)
+
+        return products
+
+    def get_company_products(self, products_ids):
+        through = Product.company.through
+        q = through.objects.filter(company=self.company, product_id__in=products_ids)
+        return dict.fromkeys(q.values_list('product_id', flat=True))
+
+    def get_products_sale(self, products_ids):
+        """Returns a dict of product id -> ProductsSale id of the company month"""
+        q = ProductsSale.objects.filter(company=self.company, sale_month=self.month, product_id__in=products_ids)
+
+        products_sale = {}
+        for product_id, pk in q.order_by('pk').values_list('product_id', 'pk'):
+            products_sale.setdefault(product_id, pk)
+
+        return products_sale
+
+    def get_monthly_sales(self, categories_ids):
+        """Returns a dict of category id -> MonthlySales id of the company month"""
+        q = MonthlySales.objects.filter(company=self.company, sale_month=self.month, category_id__in=categories_ids)
+        return dict(q.values_list('category_id', 'pk'))
+
+    def get_month_sales(self, products_ids=None):
+        """Returns a dict of product id -> [id, sold, cost, total] of the company month products sale"""
+        q = ProductsSale.objects.filter(company=self.company, sale_month=self.month).order_by('pk')
+        if products_ids is not None:
+            q = q.filter(product_id__in=products_ids)
+
+        return {product_id: [pk, sold, cents(cost), cents(total)]
+                for product_id, pk, sold, cost, total in q.values_list('product_id', 'pk', 'sold', 'cost', 'total')}
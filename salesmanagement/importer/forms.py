@@ -1,3 +1,7 @@
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.forms import ModelForm, CharField, HiddenInput
 from django.forms.widgets import DateInput
@@ -5,6 +9,8 @@ from django.utils import formats
 from django.utils.translation import ugettext_lazy as _
 
 from salesmanagement.importer.models import SalesImportFile
+from salesmanagement.importer.parser import PARSERS, ParserError, get_parser
+from salesmanagement.importer.uploadhandler import file_sha256
 from salesmanagement.manager.models import Company
 
 
@@ -13,12 +19,17 @@ class SalesImportForm(ModelForm):
 
     class Meta:
         model = SalesImportFile
-        fields = ('user', 'month', 'file')
+        fields = ('user', 'month', 'file', 'sheets', 'skip_invalid_rows')
         widgets = {
             'month': DateInput(attrs={'type': 'date'}),
             'user': HiddenInput()
         }
 
+    def __init__(self, *args, upload_errors=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # files rejected by the upload handlers while they were received
+        self.upload_errors = upload_errors or {}
+
     def clean_company(self):
         name = self.cleaned_data['company']
         company = Company.objects.filter(name=name).first()
@@ -27,21 +38,69 @@ class SalesImportForm(ModelForm):
 
         return company
 
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        duplicated = SalesImportFile.objects.filter(file_hash=file_sha256(file)).first()
+        if duplicated:
+            raise ValidationError(_(f'Este arquivo já foi enviado: {duplicated}'))
+
+        return file
+
     def clean(self):
         cleaned_data = super(SalesImportForm, self).clean()
+        for field, message in self.upload_errors.items():
+            # the rejected file was skipped, the reason replaces the required field error
+            self._errors.pop(field, None)
+            self.add_error(field, message)
+
+        file = cleaned_data.get('file')
+        if file:
+            self.check_layout(file, cleaned_data.get('sheets', ''), cleaned_data.get('skip_invalid_rows', False))
 
         company = cleaned_data.get('company')
         if not company or company.pk is None:
             return
 
         month = cleaned_data['month']
-        files = SalesImportFile.objects.filter(month__month=month.month, month__year=month.year, company=company)
+        # a range of the month's days uses the (company, month) index, extracting month and year doesn't
+        first_day = month.replace(day=1)
+        next_month = (first_day + timedelta(days=31)).replace(day=1)
+        files = SalesImportFile.objects.filter(company=company, month__gte=first_day, month__lt=next_month)
         if files.exists():
             date = formats.date_format(month, format="YEAR_MONTH_FORMAT", use_l10n=True)
             raise ValidationError(_(f'O arquivo do mês de {date} já foi importado para {company}'))
 
         return cleaned_data
 
+    def check_layout(self, file, sheets, skip_invalid=False):
+        """Reads the header and the first IMPORT_CHECK_ROWS rows of the sheets to import"""
+        if Path(file.name).suffix.lower() not in PARSERS:
+            # rejected by the file extension validator
+            return
+
+        names = [name.strip() for name in sheets.split(',') if name.strip()]
+        if file.name.lower().endswith('.xlsx') and names and names != ['*']:
+            parsers = [get_parser(file, sheet=name, max_errors=1, skip_invalid=skip_invalid) for name in names]
+        else:
+            parsers = [get_parser(file, max_errors=1, skip_invalid=skip_invalid)]
+
+        for parser in parsers:
+            try:
+                parser.check_layout(settings.IMPORT_CHECK_ROWS)
+            except ParserError as e:
+                if parser.errors:
+                    message = _(f'O arquivo não tem o formato esperado: {parser.errors[0]}')
+                elif parser.sheet and 'not found' in str(e):
+                    message = _(f'A planilha {parser.sheet} não existe no arquivo')
+                elif 'no sales' in str(e):
+                    message = _('O arquivo não tem vendas')
+                else:
+                    message = _('O arquivo não pôde ser lido')
+                self.add_error('file', message)
+                break
+
+        file.seek(0)
+
     def save(self, commit=True):
         company = self.cleaned_data['company']
         if company.pk is None:
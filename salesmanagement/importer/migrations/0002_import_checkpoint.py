@@ -0,0 +1,23 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='import_batch_id',
+            field=models.UUIDField(editable=False, null=True, verbose_name='lote de importação'),
+        ),
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='imported_rows',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='linhas importadas'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importer', '0002_import_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='parsed_rows',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='linhas lidas'),
+        ),
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='total_rows',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='total de linhas'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importer', '0003_import_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='lookup_time',
+            field=models.FloatField(default=0, editable=False, verbose_name='busca de registros (s)'),
+        ),
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='notify_time',
+            field=models.FloatField(default=0, editable=False, verbose_name='notificação (s)'),
+        ),
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='open_time',
+            field=models.FloatField(default=0, editable=False, verbose_name='abertura do arquivo (s)'),
+        ),
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='parse_time',
+            field=models.FloatField(default=0, editable=False, verbose_name='leitura (s)'),
+        ),
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='peak_memory',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='pico de memória (KB)'),
+        ),
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='queue_time',
+            field=models.FloatField(default=0, editable=False, verbose_name='espera na fila (s)'),
+        ),
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='queued_at',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='enviado para a fila em'),
+        ),
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='rows_per_second',
+            field=models.FloatField(default=0, editable=False, verbose_name='linhas por segundo'),
+        ),
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='upload_time',
+            field=models.FloatField(default=0, editable=False, verbose_name='envio (s)'),
+        ),
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='write_time',
+            field=models.FloatField(default=0, editable=False, verbose_name='gravação (s)'),
+        ),
+    ]
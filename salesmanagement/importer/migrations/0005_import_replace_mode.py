@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importer', '0004_import_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='replace_mode',
+            field=models.BooleanField(default=False, editable=False, verbose_name='substitui o arquivo anterior'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importer', '0005_import_replace_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='file_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, verbose_name='hash do arquivo'),
+        ),
+    ]
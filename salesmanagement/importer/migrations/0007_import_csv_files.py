@@ -0,0 +1,19 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:46
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importer', '0006_import_file_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='salesimportfile',
+            name='file',
+            field=models.FileField(upload_to='sales_imported_files', validators=[django.core.validators.FileExtensionValidator(['xlsx', 'csv', 'tsv'])], verbose_name='arquivo'),
+        ),
+    ]
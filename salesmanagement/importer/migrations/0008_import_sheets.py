@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importer', '0007_import_csv_files'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='sheets',
+            field=models.CharField(blank=True, help_text='Nomes das planilhas a importar separados por vírgula, * para todas. Se vazio importa a planilha ativa.', max_length=255, verbose_name='planilhas'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importer', '0008_import_sheets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='import_errors',
+            field=models.TextField(blank=True, editable=False, verbose_name='erros da importação'),
+        ),
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='skip_invalid_rows',
+            field=models.BooleanField(default=False, help_text='As linhas com erro são ignoradas e informadas na notificação.', verbose_name='importar somente as linhas válidas'),
+        ),
+    ]
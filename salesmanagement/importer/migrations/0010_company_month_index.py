@@ -0,0 +1,17 @@
+# Generated by Django 2.0.13 on 2026-10-18 07:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importer', '0009_import_errors'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='salesimportfile',
+            index=models.Index(fields=['company', 'month'], name='importfile_company_month_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('importer', '0010_company_month_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesimportfile',
+            name='resume_row',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='continua da linha'),
+        ),
+    ]
@@ -1,19 +1,29 @@
+import uuid
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.validators import FileExtensionValidator
-from django.db import models
-from django.utils import formats
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Greatest
+from django.utils import formats, timezone
 from django.utils.translation import gettext as _
 from django.utils.translation import gettext_lazy as _l
 from django_extensions.db.models import TimeStampedModel
 from notifications.signals import notify
 
 from salesmanagement.importer import tasks
+from salesmanagement.importer.uploadhandler import file_sha256
 from salesmanagement.manager.models import Company
 
 
 User = get_user_model()
 
 
+class ImportReplaced(Exception):
+    """Raised when the file was replaced while an import run of the previous one was still going on"""
+
+
 class SalesImportFile(TimeStampedModel):
     IMPORTED = 'IMPORTED'
     ERROR = 'ERROR'
@@ -28,8 +38,32 @@ class SalesImportFile(TimeStampedModel):
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
     month = models.DateField(_l('mês'))
     file = models.FileField(_l('arquivo'), upload_to='sales_imported_files',
-                            validators=[FileExtensionValidator(['xlsx'])])
+                            validators=[FileExtensionValidator(['xlsx', 'csv', 'tsv'])])
+    sheets = models.CharField(_l('planilhas'), max_length=255, blank=True,
+                              help_text=_l('Nomes das planilhas a importar separados por vírgula, * para todas. '
+                                           'Se vazio importa a planilha ativa.'))
+    skip_invalid_rows = models.BooleanField(_l('importar somente as linhas válidas'), default=False,
+                                            help_text=_l('As linhas com erro são ignoradas e informadas na notificação.'))
+    file_hash = models.CharField(_l('hash do arquivo'), max_length=64, blank=True, db_index=True, editable=False)
     status = models.CharField(_('status'), max_length=15, choices=STATUS, default=PROCESSING)
+    import_batch_id = models.UUIDField(_l('lote de importação'), null=True, editable=False)
+    imported_rows = models.PositiveIntegerField(_l('linhas importadas'), default=0, editable=False)
+    # sales rows of the file read by the committed batches, valid or not, a retried import goes on from there
+    resume_row = models.PositiveIntegerField(_l('continua da linha'), default=0, editable=False)
+    parsed_rows = models.PositiveIntegerField(_l('linhas lidas'), default=0, editable=False)
+    total_rows = models.PositiveIntegerField(_l('total de linhas'), null=True, editable=False)
+    replace_mode = models.BooleanField(_l('substitui o arquivo anterior'), default=False, editable=False)
+    import_errors = models.TextField(_l('erros da importação'), blank=True, editable=False)
+    queued_at = models.DateTimeField(_l('enviado para a fila em'), null=True, editable=False)
+    upload_time = models.FloatField(_l('envio (s)'), default=0, editable=False)
+    queue_time = models.FloatField(_l('espera na fila (s)'), default=0, editable=False)
+    open_time = models.FloatField(_l('abertura do arquivo (s)'), default=0, editable=False)
+    parse_time = models.FloatField(_l('leitura (s)'), default=0, editable=False)
+    lookup_time = models.FloatField(_l('busca de registros (s)'), default=0, editable=False)
+    write_time = models.FloatField(_l('gravação (s)'), default=0, editable=False)
+    notify_time = models.FloatField(_l('notificação (s)'), default=0, editable=False)
+    rows_per_second = models.FloatField(_l('linhas por segundo'), default=0, editable=False)
+    peak_memory = models.PositiveIntegerField(_l('pico de memória (KB)'), default=0, editable=False)
 
     __old_status = None
     __old_file = None
@@ -37,6 +71,7 @@ class SalesImportFile(TimeStampedModel):
     class Meta:
         verbose_name = _l('arquivo Importado')
         verbose_name_plural = _l('arquivos Importados')
+        indexes = [models.Index(fields=['company', 'month'], name='importfile_company_month_idx')]
 
     def __str__(self):
         month_year = formats.date_format(self.month, format="YEAR_MONTH_FORMAT", use_l10n=True)
@@ -49,23 +84,127 @@ class SalesImportFile(TimeStampedModel):
             self.__old_status = self.status
 
     def save(self, **kwargs):
+        file_changed = self.file != self.__old_file
+        if file_changed:
+            # a new file starts a new import from its first row, replacing the sales of the previous file
+            self.replace_mode = bool(self.__old_file)
+            self.import_batch_id = uuid.uuid4()
+            self.imported_rows = 0
+            self.resume_row = 0
+            self.parsed_rows = 0
+            self.total_rows = None
+            self.import_errors = ''
+            self.queued_at = timezone.now()
+            if not self.file._committed:
+                # a file just uploaded, its content is at hand
+                self.file_hash = file_sha256(self.file.file)
+            # the size must be read before saving, when it's still known without reaching the storage
+            queue = self.get_import_queue()
+
         super().save(**kwargs)
-        if self.file != self.__old_file:
-            tasks.import_sales_task.delay(self.pk)
+        if file_changed:
+            tasks.import_sales_task.apply_async((self.pk, str(self.import_batch_id)), queue=queue)
 
         if self.__old_status != self.status:
+            # the invalid rows are listed in the notification so they can be fixed at once
+            extra = {'description': self.import_errors} if self.import_errors else {}
             if self.status == self.IMPORTED:
-                notify.send(self, recipient=self.user, verb=_('foi importado'))
+                notify.send(self, recipient=self.user, verb=_('foi importado'), **extra)
             elif self.status == self.ERROR:
-                notify.send(self, recipient=self.user, verb=_('falhou ao ser importado'))
+                notify.send(self, recipient=self.user, verb=_('falhou ao ser importado'), **extra)
 
         self.__old_file = self.file
         self.__old_status = self.status
 
+    def get_sheets(self):
+        """Returns the names of the workbook sheets to import, an empty list means the active sheet"""
+        if not self.file.name.lower().endswith('.xlsx'):
+            return []
+        return [name.strip() for name in self.sheets.split(',') if name.strip()]
+
+    def get_import_queue(self):
+        """Returns the Celery queue of the file import, big files have their own queue to not delay the small ones"""
+        try:
+            size = self.file.size
+        except OSError:
+            # a missing file fails the import right away
+            return 'express'
+
+        return 'bulk' if size > settings.IMPORT_EXPRESS_MAX_SIZE else 'express'
+
+    def is_import_run(self, import_batch_id):
+        """Returns if the import run of `import_batch_id` is the current one, any run when it's None"""
+        return import_batch_id is None or str(self.import_batch_id) == str(import_batch_id)
+
+    def get_import_run(self):
+        """Returns a queryset with this file only while its import run is the one loaded"""
+        return SalesImportFile.objects.filter(pk=self.pk, import_batch_id=self.import_batch_id)
+
     def imported(self):
-        self.status = self.IMPORTED
-        self.save()
+        self.set_import_status(self.IMPORTED)
 
     def imported_fail(self):
-        self.status = self.ERROR
-        self.save()
+        self.set_import_status(self.ERROR)
+
+    def set_import_status(self, status):
+        """Saves the status of the import run, raising ImportReplaced if the file was replaced meanwhile"""
+        with transaction.atomic():
+            # the lock waits for a replacement being saved
+            if not self.get_import_run().select_for_update().exists():
+                raise ImportReplaced(f'The file {self.pk} was replaced')
+            self.status = status
+            self.save(update_fields=('status', 'modified'))
+
+    @property
+    def progress(self):
+        """Percent of the file rows already parsed and imported, each counts for half of the work"""
+        if self.status == self.IMPORTED:
+            return 100
+        if not self.total_rows:
+            return 0
+        # the chunked files are parsed in full before their sales are written at once
+        return min(100, int((self.parsed_rows + self.imported_rows) * 50 / self.total_rows))
+
+    def set_total_rows(self, rows):
+        self.total_rows = rows
+        self.get_import_run().update(total_rows=rows)
+
+    def add_parsed_rows(self, rows):
+        """Records that more `rows` of the file were parsed"""
+        self.parsed_rows += rows
+        self.get_import_run().update(parsed_rows=F('parsed_rows') + rows)
+
+    def add_stats(self, stats):
+        """Adds the stage durations measured by an import run and updates the throughput"""
+        values = {f'{stage}_time': F(f'{stage}_time') + seconds for stage, seconds in stats.durations.items()}
+        peak_memory = stats.peak_memory()
+        if peak_memory is not None:
+            values['peak_memory'] = Greatest('peak_memory', Value(peak_memory))
+        q = self.get_import_run()
+        if not q.update(**values):
+            return
+
+        for field, value in q.values(*values, 'imported_rows').get().items():
+            setattr(self, field, value)
+
+        busy = self.open_time + self.parse_time + self.lookup_time + self.write_time
+        self.rows_per_second = self.imported_rows / busy if busy else 0
+        q.update(rows_per_second=self.rows_per_second)
+
+    def add_import_errors(self, errors):
+        """Appends the invalid rows found by the parser, one per line"""
+        if not errors:
+            return
+
+        text = ''.join(f'{error}\n' for error in errors)
+        self.import_errors += text
+        self.get_import_run().update(import_errors=Concat('import_errors', Value(text)))
+
+    def checkpoint(self, rows, resume_row=None):
+        """Records that more `rows` of the file were committed, raising ImportReplaced if it was replaced"""
+        self.imported_rows += rows
+        values = {'imported_rows': F('imported_rows') + rows}
+        if resume_row is not None:
+            self.resume_row = values['resume_row'] = resume_row
+        if not self.get_import_run().update(**values):
+            raise ImportReplaced(f'The file {self.pk} was replaced')
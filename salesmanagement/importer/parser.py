@@ -1,46 +1,290 @@
-import locale
+import codecs
+import csv
+import io
+import re
+import shutil
+import tempfile
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from decimal import Decimal
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
 
-from djmoney.money import Money
 from openpyxl import load_workbook
 
 
-class ParserSalesXlsx:
-    def __init__(self, file_path, header=None):
+HEADER = ('product', 'category', 'sold', 'cost', 'total')
+
+# other names accepted in the header cells, the spreadsheets of the companies are in Portuguese
+HEADER_ALIASES = {
+    'product': ('produto',),
+    'category': ('categoria',),
+    'sold': ('vendidos', 'quantidade'),
+    'cost': ('custo',),
+}
+
+# "R$ 1.234,56" -> "1.234,56"
+CURRENCY_TRANSLATION = str.maketrans({'R': None, '$': None, ' ': None, '\xa0': None})
+
+# the cents of a value exported without the Brazilian format, e.g. 4.70, a dot before 3 digits separates thousands
+DECIMAL_POINT = re.compile(r'\.\d{1,2}$')
+
+# parsed sales row, a tuple with its values also reachable by the header names
+SaleRow = namedtuple('SaleRow', HEADER)
+
+
+class ColumnBatch:
+    """Parsed rows kept by column, each column is a list reachable by its header name"""
+    __slots__ = ('columns',)
+
+    def __init__(self, header, columns):
+        self.columns = dict(zip(header, columns))
+
+    def __len__(self):
+        """Rows count"""
+        return len(next(iter(self.columns.values()), ()))
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+
+class ParserError(Exception):
+    """Raised when the sales file doesn't match the expected layout"""
+
+
+class RowError(namedtuple('RowError', ('row', 'column', 'message'))):
+    """Invalid row found by a parser that collects the errors, column is None when the whole row is invalid"""
+    __slots__ = ()
+
+    def __str__(self):
+        if self.column is None:
+            return f'Linha {self.row}: {self.message}'
+        return f'Linha {self.row}, coluna {self.column}: {self.message}'
+
+
+class ParserSales:
+    """Base of the sales files parsers, subclasses read the file rows as tuples of values"""
+    # files that can't seek are copied to memory up to this size, to a temporary file when bigger
+    spool_max_size = 5 * 1024 * 1024
+
+    def __init__(self, file_path, header=None, sheet=None, max_errors=0, skip_invalid=False):
+        # a path or a binary file object, e.g. a file just uploaded or a file of a Django storage
         self.file_path = file_path
-        self.header = header if header else ['product', 'category', 'sold', 'cost', 'total']
+        self.spooled = None
+        # name of the workbook sheet to read, the active one when None, text files have no sheets
+        self.sheet = sheet
+        self.header = list(header if header else HEADER)
         self.max_columns = len(self.header)
+        # the converter of each column is looked up once, not for every cell
+        self.converters = tuple(getattr(self, 'parse_'+h, self.default_parse) for h in self.header)
+        self.row_class = SaleRow if tuple(self.header) == HEADER else namedtuple('Row', self.header)
+        # seconds spent opening the file
+        self.open_time = 0.0
+        self.max_errors = max_errors
+        self.skip_invalid = skip_invalid
+        # errors not taken by pop_errors yet and how many were found, the limit counts all of them
+        self.errors = []
+        self.errors_count = 0
 
     def as_data(self):
-        """Returns a list with the xlsx rows, each row is a dict with cells value"""
-        wb = load_workbook(filename=self.file_path)
-        ws = wb.active
-        data = []
+        """Returns a list with the file rows, each row is a SaleRow with the cells value"""
+        try:
+            return list(self.iter_rows())
+        except ParserError:
+            return []
+
+    def iter_rows(self, start=0, stop=None):
+        """Yields the parsed rows from start to stop, indexes of the sales rows without the header"""
+        rows = self.iter_sales_values(start, stop)
+        try:
+            for i, values in rows:
+                try:
+                    row = self.get_row(values)
+                except Exception as e:
+                    self.add_error(i, values, e)
+                    continue
 
-        for i, row in enumerate(ws.rows):
-            if len(row) != self.max_columns:
-                print(len(row))
-                return []
+                yield row
+        finally:
+            rows.close()
 
-            if i == 0:
-                # skip file header
-                continue
+    def check_layout(self, rows=20):
+        """Reads only the header and the first `rows` sales rows, raising ParserError if they are invalid"""
+        try:
+            # every row of the range is read, an invalid row after a valid one must raise too
+            if not sum(1 for row in self.iter_rows(stop=rows)):
+                raise ParserError('The file has no sales')
+        except ParserError:
+            raise
+        except Exception as e:
+            raise ParserError('The file can not be read') from e
 
+    def iter_column_batches(self, size=1000, start=0, stop=None):
+        """Yields ColumnBatch with at most `size` parsed rows, the values are converted column by column"""
+        rows = self.iter_sales_values(start, stop)
+        try:
+            batch = list(islice(rows, size))
+            while batch:
+                yield self.get_columns(batch)
+                batch = list(islice(rows, size))
+        finally:
+            rows.close()
+
+    def iter_sales_values(self, start, stop):
+        """Yields (row number, values) of the sales rows, checking their columns count"""
+        # the header is the first file row, sales start at the second one
+        first_row = 1 if start == 0 else start + 2
+        last_row = stop + 1 if stop is not None else None
+
+        rows = self.iter_values(first_row, last_row)
+        try:
+            for i, values in enumerate(rows, first_row):
+                if i == 1:
+                    self.check_header(values)
+                elif len(values) != self.max_columns:
+                    self.add_error(i, values)
+                else:
+                    yield i, values
+        finally:
+            # closes the file even when the rows aren't read until the end
+            rows.close()
+
+    def iter_values(self, first_row, last_row):
+        """Yields tuples with the values of the file rows from first_row to last_row, counted from 1"""
+        raise NotImplementedError
+
+    def count_rows(self):
+        """Returns how many sales rows the file has, or None if it's unknown"""
+        raise NotImplementedError
+
+    def iter_batches(self, size=1000, start=0, stop=None):
+        """Yields lists with at most `size` parsed rows, reading the file in streaming mode"""
+        rows = self.iter_rows(start, stop)
+        try:
+            batch = list(islice(rows, size))
+            while batch:
+                yield batch
+                batch = list(islice(rows, size))
+        finally:
+            rows.close()
+
+    def get_columns(self, batch):
+        """Converts a list of (row number, values) to a ColumnBatch"""
+        columns = list(zip(*(values for i, values in batch)))
+        try:
+            return ColumnBatch(self.header, [list(map(convert, column))
+                                             for convert, column in zip(self.converters, columns)])
+        except Exception:
+            pass
+
+        # converts row by row to find out which ones are invalid
+        valid = []
+        for i, values in batch:
             try:
-                d = self.get_row_dict(row)
-            except Exception:
-                return []
+                self.get_row(values)
+            except Exception as e:
+                self.add_error(i, values, e)
+            else:
+                valid.append((i, values))
+
+        if not valid:
+            return ColumnBatch(self.header, [[] for h in self.header])
+        return self.get_columns(valid)
+
+    def is_path(self):
+        return isinstance(self.file_path, (str, Path))
+
+    def get_binary(self):
+        """Returns the file object rewound, spooled to a temporary file when it can't seek"""
+        if self.spooled is None:
+            f = self.file_path
+            if getattr(f, 'closed', False) and hasattr(f, 'open'):
+                f.open('rb')
+            # Django files keep the file object in their `file` attribute
+            while hasattr(f, 'file'):
+                f = f.file
+
+            if f.seekable():
+                f.seek(0)
+                return f
+            self.spooled = self.spool(f)
+
+        self.spooled.seek(0)
+        return self.spooled
+
+    def spool(self, f):
+        spooled = io.BytesIO()
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            if isinstance(spooled, io.BytesIO) and spooled.tell() + len(chunk) > self.spool_max_size:
+                # rolls over to disk, like tempfile.SpooledTemporaryFile, which can't be wrapped by io
+                spooled.seek(0)
+                disk = tempfile.TemporaryFile()
+                shutil.copyfileobj(spooled, disk)
+                spooled = disk
+            spooled.write(chunk)
+
+        return spooled
+
+    def close(self):
+        """Deletes the spooled copy of the file, the file object itself is left open for its owner"""
+        if self.spooled is not None:
+            self.spooled.close()
+            self.spooled = None
+
+    def get_row(self, values):
+        return self.row_class._make([convert(v) for convert, v in zip(self.converters, values)])
 
-            data.append(d)
+    def add_error(self, i, values, error=None):
+        """Handles the invalid row `i`, raising ParserError unless the errors are collected or skipped"""
+        if len(values) != self.max_columns:
+            if not self.max_errors:
+                raise ParserError(f'Row {i} has {len(values)} columns, expected {self.max_columns}')
+            row_error = RowError(i, None, f'tem {len(values)} colunas, deveria ter {self.max_columns}')
+        else:
+            if not self.max_errors:
+                raise ParserError(f'Row {i} has invalid values') from error
+            row_error = RowError(i, *self.find_invalid_value(values))
 
-        return data
+        if self.errors_count < self.max_errors:
+            self.errors.append(row_error)
+        self.errors_count += 1
+        if self.errors_count >= self.max_errors and not self.skip_invalid:
+            raise ParserError(f'The file has at least {self.errors_count} invalid rows')
 
-    def get_row_dict(self, row):
-        d = {}
-        for i, h in enumerate(self.header):
-            parser = getattr(self, 'parse_'+h, self.default_parse)
-            d[h] = parser(row[i].value)
+    def check_header(self, values):
+        """Checks the header names the expected columns in their order, ignoring the case and spaces"""
+        if len(values) != self.max_columns:
+            self.add_header_error(RowError(1, None, f'tem {len(values)} colunas, deveria ter {self.max_columns}'),
+                                  f'Row 1 has {len(values)} columns, expected {self.max_columns}')
 
-        return d
+        for column, (name, value) in enumerate(zip(self.header, values), 1):
+            cell = '' if value is None else str(value).strip().lower()
+            if cell != name and cell not in HEADER_ALIASES.get(name, ()):
+                self.add_header_error(RowError(1, column, f'cabeçalho {value!r}, deveria ser {name}'),
+                                      f'Header column {column} is {value!r}, expected {name}')
+
+    def add_header_error(self, row_error, message):
+        if self.max_errors:
+            self.errors.append(row_error)
+            self.errors_count += 1
+        raise ParserError(message)
+
+    def find_invalid_value(self, values):
+        """Returns the number, counted from 1, and the error message of the first invalid column"""
+        for column, (name, convert, v) in enumerate(zip(self.header, self.converters, values), 1):
+            try:
+                convert(v)
+            except Exception:
+                return column, f'valor inválido {v!r} em {name}'
+
+        return None, 'valores inválidos'
+
+    def pop_errors(self):
+        """Returns the errors collected since the last call"""
+        errors, self.errors = self.errors, []
+        return errors
 
     def default_parse(self, v):
         return v
@@ -61,9 +305,167 @@ class ParserSalesXlsx:
         return self.parse_currency(total_string)
 
     @staticmethod
+    @lru_cache(maxsize=4096)
     def parse_currency(currency):
+        """Returns the Decimal amount of a currency cell, memoized since prices repeat a lot"""
         if isinstance(currency, float):
-            return Money(currency, 'BRL')
+            return Decimal(repr(currency))
+        if isinstance(currency, int):
+            return Decimal(currency)
+
+        value = currency.translate(CURRENCY_TRANSLATION)
+        if ',' in value:
+            value = value.replace('.', '').replace(',', '.')
+        elif not DECIMAL_POINT.search(value):
+            value = value.replace('.', '')
+        return Decimal(value)
+
+
+class ParserSalesXlsx(ParserSales):
+    def iter_values(self, first_row, last_row):
+        """Reads the rows of the sheet, the workbook is opened in read-only mode"""
+        wb = self.open_workbook()
+        try:
+            # the sheet XML is streamed from its start, the rows before first_row are still read
+            for row in self.get_sheet(wb).iter_rows(min_row=first_row, max_row=last_row):
+                yield tuple(cell.value for cell in row)
+        finally:
+            wb.close()
+
+    def get_sheet(self, wb):
+        if self.sheet is None:
+            return wb.active
+
+        try:
+            return wb[self.sheet]
+        except KeyError:
+            raise ParserError(f'Sheet {self.sheet} not found')
+
+    def sheet_names(self):
+        wb = self.open_workbook()
+        try:
+            return wb.sheetnames
+        finally:
+            wb.close()
+
+    def open_workbook(self):
+        started = time.perf_counter()
+        wb = load_workbook(filename=self.file_path if self.is_path() else self.get_binary(), read_only=True)
+        self.open_time += time.perf_counter() - started
+        return wb
+
+    def count_rows(self):
+        """Returns how many sales rows the file declares, without reading them, or None if it's unknown"""
+        wb = self.open_workbook()
+        try:
+            max_row = self.get_sheet(wb).max_row
+        except ParserError:
+            max_row = None
+        finally:
+            wb.close()
+
+        return max_row - 1 if max_row else None
+
+
+class ParserSalesCsv(ParserSales):
+    """Parses delimited text files, the values have the format of the xlsx text cells"""
+    delimiter = None
+    delimiters = ',;\t'
+    # the first one that decodes the whole file is used, Excel exports csv files as cp1252
+    encodings = ('utf-8-sig', 'cp1252')
+    encoding = None
+
+    def iter_values(self, first_row, last_row):
+        with self.open_file() as f:
+            try:
+                for row in islice(self.reader(f), first_row - 1, last_row):
+                    yield tuple(row)
+            except UnicodeDecodeError as e:
+                raise ParserError('The file text encoding is unknown') from e
+
+    def count_rows(self):
+        try:
+            with self.open_file() as f:
+                rows = sum(1 for row in self.reader(f))
+        except UnicodeDecodeError:
+            return None
+
+        return rows - 1 if rows else None
+
+    def get_encoding(self):
+        """Returns the first of the encodings that decodes the whole file"""
+        if self.encoding is None:
+            with self.open_binary() as f:
+                for encoding in self.encodings[:-1]:
+                    decoder = codecs.getincrementaldecoder(encoding)()
+                    try:
+                        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                            decoder.decode(chunk)
+                        decoder.decode(b'', final=True)
+                    except UnicodeDecodeError:
+                        f.seek(0)
+                        continue
+                    self.encoding = encoding
+                    break
+                else:
+                    self.encoding = self.encodings[-1]
+
+        return self.encoding
+
+    @contextmanager
+    def open_binary(self):
+        if not self.is_path():
+            # the file object is left open for its owner
+            yield self.get_binary()
+            return
+
+        with open(self.file_path, 'rb') as f:
+            yield f
+
+    @contextmanager
+    def open_file(self):
+        started = time.perf_counter()
+        encoding = self.get_encoding()
+        is_path = self.is_path()
+        if is_path:
+            f = open(self.file_path, newline='', encoding=encoding)
+        else:
+            f = io.TextIOWrapper(self.get_binary(), newline='', encoding=encoding)
+        self.open_time += time.perf_counter() - started
+
+        try:
+            yield f
+        finally:
+            if is_path:
+                f.close()
+            else:
+                # the file object is left open for its owner
+                f.detach()
+
+    def reader(self, f):
+        delimiter = self.delimiter
+        if delimiter is None:
+            try:
+                delimiter = csv.Sniffer().sniff(f.readline(), self.delimiters).delimiter
+            except csv.Error:
+                delimiter = ','
+            f.seek(0)
+
+        return csv.reader(f, delimiter=delimiter)
+
+
+class ParserSalesTsv(ParserSalesCsv):
+    delimiter = '\t'
+
+
+PARSERS = {
+    '.xlsx': ParserSalesXlsx,
+    '.csv': ParserSalesCsv,
+    '.tsv': ParserSalesTsv,
+}
+
 
-        n = str(currency).replace('R$', '').replace('.', '').replace(',', '.').strip()
-        return Money(n, 'BRL')
+def get_parser(file_path, header=None, sheet=None, max_errors=0, skip_invalid=False):
+    """Returns the parser of the file, chosen by its extension, file_path can be a file object with a name"""
+    name = file_path if isinstance(file_path, (str, Path)) else file_path.name
+    return PARSERS[Path(name).suffix.lower()](file_path, header, sheet, max_errors, skip_invalid)
@@ -0,0 +1,126 @@
+import csv
+from io import StringIO
+
+from django.conf import settings
+from django.db import connection
+
+from salesmanagement.importer.bulk import refresh_current_sales, refresh_monthly_sales
+from salesmanagement.importer.parser import HEADER, ColumnBatch
+from salesmanagement.importer.stats import ImportStats
+from salesmanagement.manager.models import Product, ProductCategory, ProductsSale
+
+
+STAGING = 'import_sales_staging'
+
+# a temporary table isn't written to the WAL, like an unlogged one, and it's private to the
+# connection, so concurrent imports don't see each other rows
+CREATE_STAGING = f'''
+CREATE TEMPORARY TABLE {STAGING} (
+    position bigserial, product text NOT NULL, category text NOT NULL, sold bigint NOT NULL,
+    cost numeric NOT NULL, total numeric NOT NULL, product_id integer
+) ON COMMIT DROP'''
+
+DROP_STAGING = f'DROP TABLE {STAGING}'
+
+COPY_STAGING = f'COPY {STAGING} ({", ".join(HEADER)}) FROM STDIN WITH (FORMAT csv)'
+
+# the unique constraints make concurrent imports wait for each other rows instead of inserting them again,
+# the rows are inserted sorted by their keys so the imports lock them in the same order without deadlocks
+INSERT_CATEGORIES = f'''
+INSERT INTO {{category}} (created, modified, name)
+SELECT now(), now(), s.category FROM {STAGING} s
+GROUP BY s.category ORDER BY s.category
+ON CONFLICT (name) DO NOTHING'''
+
+INSERT_PRODUCTS = f'''
+INSERT INTO {{product}} (created, modified, name, category_id)
+SELECT now(), now(), s.product, c.id FROM {STAGING} s JOIN {{category}} c ON c.name = s.category
+GROUP BY s.product, c.id ORDER BY s.product, c.id
+ON CONFLICT (name, category_id) DO NOTHING'''
+
+SET_PRODUCTS_IDS = f'''
+UPDATE {STAGING} s SET product_id = p.id FROM {{category}} c, {{product}} p
+WHERE c.name = s.category AND p.category_id = c.id AND p.name = s.product'''
+
+INSERT_COMPANY_PRODUCTS = f'''
+INSERT INTO {{link}} (product_id, company_id)
+SELECT DISTINCT s.product_id, %(company)s FROM {STAGING} s ORDER BY s.product_id
+ON CONFLICT (product_id, company_id) DO NOTHING'''
+
+# the sales aggregated by product keep the cost of the first row, like aggregate_sales
+UPSERT_SALES = f'''
+INSERT INTO {{sale}} AS ps (created, modified, company_id, product_id, sale_month, sold, cost, {{cost_currency}},
+                          total, {{total_currency}})
+SELECT now(), now(), %(company)s, product_id, %(month)s, SUM(sold), (array_agg(cost ORDER BY position))[1],
+       %(currency)s, SUM(total), %(currency)s
+FROM {STAGING} GROUP BY product_id ORDER BY product_id
+ON CONFLICT (company_id, product_id, sale_month) DO UPDATE'''
+
+ADD_SALES = f'''{UPSERT_SALES}
+SET sold = ps.sold + EXCLUDED.sold, total = ps.total + EXCLUDED.total'''
+
+DELETE_OTHER_SALES = f'''
+DELETE FROM {{sale}} ps WHERE ps.company_id = %(company)s AND ps.sale_month = %(month)s
+AND NOT EXISTS (SELECT 1 FROM {STAGING} s WHERE s.product_id = ps.product_id)'''
+
+REPLACE_SALES = f'''{UPSERT_SALES}
+SET sold = EXCLUDED.sold, cost = EXCLUDED.cost, total = EXCLUDED.total
+WHERE (ps.sold, ps.cost, ps.total) IS DISTINCT FROM (EXCLUDED.sold, EXCLUDED.cost, EXCLUDED.total)'''
+
+
+def can_copy_sales(rows):
+    """Returns if a file with `rows` sales rows is loaded with COPY, only PostgreSQL has it"""
+    min_rows = settings.IMPORT_COPY_MIN_ROWS
+    return bool(connection.vendor == 'postgresql' and min_rows and rows and rows >= min_rows)
+
+
+class CopySalesImporter:
+    """Saves the sales of a company month through a staging table loaded with COPY, PostgreSQL only"""
+
+    def __init__(self, company, month, stats=None):
+        self.company = company
+        self.month = month
+        self.stats = stats if stats is not None else ImportStats()
+        sale = ProductsSale._meta
+        self.tables = {
+            'category': ProductCategory._meta.db_table,
+            'product': Product._meta.db_table,
+            'link': Product.company.through._meta.db_table,
+            'sale': sale.db_table,
+            'cost_currency': sale.get_field('cost_currency').column,
+            'total_currency': sale.get_field('total_currency').column,
+        }
+
+    def create_staging(self):
+        with connection.cursor() as cursor:
+            cursor.execute(CREATE_STAGING)
+
+    def copy_batch(self, sales):
+        """Streams a batch of parsed sales, rows or a ColumnBatch, to the staging table"""
+        if isinstance(sales, ColumnBatch):
+            sales = zip(*(sales[name] for name in HEADER))
+
+        buffer = StringIO()
+        csv.writer(buffer).writerows(sales)
+        buffer.seek(0)
+        with self.stats.measure('write'), connection.cursor() as cursor:
+            cursor.copy_expert(COPY_STAGING, buffer)
+
+    def merge(self, replace=False):
+        """Merges the staging table, adding its sales to the month ones or replacing them"""
+        params = {'company': self.company.pk, 'month': self.month, 'currency': 'BRL'}
+        with connection.cursor() as cursor:
+            with self.stats.measure('lookup'):
+                for statement in (INSERT_CATEGORIES, INSERT_PRODUCTS, SET_PRODUCTS_IDS, INSERT_COMPANY_PRODUCTS):
+                    cursor.execute(statement.format(**self.tables), params)
+
+            with self.stats.measure('write'):
+                if replace:
+                    cursor.execute(DELETE_OTHER_SALES.format(**self.tables), params)
+                    cursor.execute(REPLACE_SALES.format(**self.tables), params)
+                else:
+                    cursor.execute(ADD_SALES.format(**self.tables), params)
+                refresh_monthly_sales(self.company, self.month)
+                refresh_current_sales(self.company)
+            # dropped now, not at the commit, so another file can be merged in the same transaction
+            cursor.execute(DROP_STAGING)
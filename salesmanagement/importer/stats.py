@@ -0,0 +1,66 @@
+import time
+from contextlib import contextmanager
+
+PROC_STATUS = '/proc/self/status'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+
+
+def read_memory_status(field):
+    """Returns a memory field of the current process status in KB, e.g. VmRSS, or None if it's unknown"""
+    try:
+        with open(PROC_STATUS) as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_memory():
+    """Resets the peak resident memory of the current process to its current size, returns if it could"""
+    try:
+        with open(PROC_CLEAR_REFS, 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+class ImportStats:
+    """Durations in seconds of the stages of a sales import, and its peak memory with `memory`"""
+    STAGES = ('upload', 'queue', 'open', 'parse', 'lookup', 'write', 'notify')
+
+    def __init__(self, memory=False):
+        self.durations = dict.fromkeys(self.STAGES, 0.0)
+        # resident memory in KB when the measure started, the peak is reset to it
+        self.start_memory = read_memory_status('VmRSS') if memory and reset_peak_memory() else None
+
+    def add(self, stage, seconds):
+        self.durations[stage] += seconds
+
+    @contextmanager
+    def measure(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def iterate(self, stage, iterable):
+        """Yields the items of iterable, adding the time spent producing them to stage"""
+        iterator = iter(iterable)
+        while True:
+            with self.measure(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def peak_memory(self):
+        """Growth in KB of the resident memory peak since the stats were created, None if it isn't measured"""
+        peak = read_memory_status('VmHWM') if self.start_memory is not None else None
+        if peak is None:
+            return None
+        return max(0, peak - self.start_memory)
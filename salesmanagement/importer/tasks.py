@@ -1,38 +1,308 @@
-from celery import shared_task
+import time
+from collections import OrderedDict
+from contextlib import closing
+from itertools import islice
+
+from celery import chord, shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 
 from salesmanagement.importer import models
-from salesmanagement.importer.parser import ParserSalesXlsx
-from salesmanagement.manager.models import ProductsSale, Product, ProductCategory
+from salesmanagement.importer.bulk import (BulkSalesImporter, aggregate_batch, dump_aggregated, merge_aggregated,
+                                           refresh_current_sales)
+from salesmanagement.importer.parser import ParserError, SaleRow, get_parser
+from salesmanagement.importer.pgcopy import CopySalesImporter, can_copy_sales
+from salesmanagement.importer.stats import ImportStats
+from salesmanagement.manager.models import MonthlySales, ProductsSale
 
 
-@shared_task(ignore_results=True, default_retry_delay=5*60)
-def import_sales_task(sale_file_pk):
+@shared_task(bind=True, ignore_results=True, default_retry_delay=5*60, acks_late=True, reject_on_worker_lost=True)
+def import_sales_task(self, sale_file_pk, import_batch_id=None):
+    """Imports the file batch by batch, retrying itself after IMPORT_SLICE_TIME to go on from the checkpoint"""
     sale_file = models.SalesImportFile.objects.get(pk=sale_file_pk)
-    company = sale_file.company
-    sales = ParserSalesXlsx(sale_file.file.path).as_data()
+    if not sale_file.is_import_run(import_batch_id):
+        return
+
+    try:
+        import_sales(self, sale_file)
+    except models.ImportReplaced:
+        # the batch being written was rolled back, the import of the new file goes on
+        pass
+
+
+def import_sales(task, sale_file):
+    """Runs import_sales_task for the file, ImportReplaced stops it when the file is replaced meanwhile"""
+    stats = ImportStats(memory=True)
+    parsers = get_sheets_parsers(sale_file)
+    parser = parsers[0]
+
+    if not task.request.retries and sale_file.queued_at:
+        stats.add('queue', (timezone.now() - sale_file.queued_at).total_seconds())
+
+    if sale_file.imported_rows and is_saved_at_once(sale_file, parsers):
+        # a redelivered task of a file already saved, only its status may be missing
+        close_sales_file(sale_file, parsers)
+        sale_file.imported()
+        return
+
+    if not (sale_file.imported_rows or sale_file.resume_row):
+        rows = [sheet_parser.count_rows() for sheet_parser in parsers]
+        sale_file.set_total_rows(None if None in rows else sum(rows))
+
+        if is_chunked(sale_file, parsers):
+            # sheets and big files are parsed in parallel by the worker processes
+            import_batch_id = sale_file.import_batch_id and str(sale_file.import_batch_id)
+            chunks = [aggregate_sales_chunk_task.s(sale_file.pk, start, stop, sheet=sheet_parser.sheet,
+                                                   import_batch_id=import_batch_id)
+                      for sheet_parser, sheet_rows in zip(parsers, rows)
+                      for start, stop in get_chunks(sheet_rows, settings.IMPORT_CHUNK_SIZE)]
+            close_sales_file(sale_file, parsers)
+            chord(chunks)(merge_sales_chunks_task.s(sale_file.pk, import_batch_id=import_batch_id))
+            stats.add('open', sum(sheet_parser.open_time for sheet_parser in parsers))
+            sale_file.add_stats(stats)
+            return
+    else:
+        # rows parsed after the checkpoint are parsed again
+        sale_file.add_parsed_rows(sale_file.imported_rows - sale_file.parsed_rows)
+
+    started, opened = time.monotonic(), get_open_time(parsers)
+    try:
+        if sale_file.replace_mode:
+            importer = BulkSalesImporter(sale_file.company, sale_file.month, stats=stats)
+            replace_sales(sale_file, parser, importer, stats)
+        else:
+            importer = BulkSalesImporter(sale_file.company, sale_file.month, stats=stats)
+            resume_row, errors_count = sale_file.resume_row, parser.errors_count
+            # the batches are closed before the file, also when the loop is left by an error or a retry
+            with closing(iter_parsed_batches(parser, start=resume_row)) as batches:
+                for batch in stats.iterate('parse', batches):
+                    # the invalid rows skipped by the batch are read too, the retried task must not read them again
+                    resume_row += len(batch) + parser.errors_count - errors_count
+                    errors_count = parser.errors_count
+                    sale_file.add_parsed_rows(len(batch))
+                    if has_invalid_rows(sale_file, parsers):
+                        continue
+
+                    with transaction.atomic():
+                        importer.import_batch(batch)
+                        sale_file.checkpoint(len(batch), resume_row)
+                        sale_file.add_import_errors(pop_errors(parsers))
+
+                    if time.monotonic() - started > settings.IMPORT_SLICE_TIME:
+                        raise task.retry(countdown=0, max_retries=None)
+
+        if has_invalid_rows(sale_file, parsers):
+            raise ParserError('The file has invalid rows')
+        if not sale_file.imported_rows:
+            raise ParserError('The file has no sales')
+    except ParserError:
+        discard_imported_sales(sale_file)
+        sale_file.add_import_errors(pop_errors(parsers))
+        with stats.measure('notify'):
+            sale_file.imported_fail()
+    else:
+        sale_file.add_import_errors(pop_errors(parsers))
+        with stats.measure('notify'):
+            sale_file.imported()
+    finally:
+        close_sales_file(sale_file, parsers)
+        add_open_and_parse_stats(sale_file, stats, parsers, opened)
+
+
+def get_sheets_parsers(sale_file):
+    """Returns a parser for each sheet to import, files without sheets have a single parser"""
+    # the file is read through its storage, the workers don't need the filesystem of the web servers
+    file = sale_file.file
+    sheets = sale_file.get_sheets()
+    if sheets == ['*']:
+        sheets = get_parser(file).sheet_names()
+
+    options = get_parser_options(sale_file)
+    return [get_parser(file, sheet=sheet, **options) for sheet in sheets] or [get_parser(file, **options)]
+
+
+def get_parser_options(sale_file):
+    """Returns the errors handling of the file parsers, skipped files are read until the end whatever the errors"""
+    return {'max_errors': settings.IMPORT_MAX_ERRORS, 'skip_invalid': sale_file.skip_invalid_rows}
+
+
+def close_sales_file(sale_file, parsers):
+    """Closes the file opened by the parsers and their spooled copies"""
+    for parser in parsers:
+        parser.close()
+    sale_file.file.close()
+
+
+def is_chunked(sale_file, parsers):
+    """Returns if the file is parsed in chunks by aggregate_sales_chunk_task"""
+    rows = sale_file.total_rows
+    return len(parsers) > 1 or bool(rows and rows > settings.IMPORT_CHUNK_SIZE)
+
+
+def is_saved_at_once(sale_file, parsers):
+    """Returns if the sales of the whole file are saved by a single checkpoint, not batch by batch"""
+    return sale_file.replace_mode or is_chunked(sale_file, parsers)
+
+
+def get_chunks(rows, size):
+    """Returns the (start, stop) rows ranges of the chunks of a file, a single chunk when rows is unknown"""
+    if not rows:
+        return [(0, None)]
+    return [(start, start + size) for start in range(0, rows, size)]
+
+
+def iter_parsed_batches(parser, start=0, stop=None):
+    """Yields the parsed batches of the file, by column when IMPORT_COLUMNAR is set"""
+    if settings.IMPORT_COLUMNAR:
+        return parser.iter_column_batches(settings.IMPORT_BATCH_SIZE, start, stop)
+    return parser.iter_batches(settings.IMPORT_BATCH_SIZE, start, stop)
+
+
+def has_invalid_rows(sale_file, parsers):
+    """Returns if the parsers found invalid rows that make the import fail"""
+    return not sale_file.skip_invalid_rows and any(parser.errors_count for parser in parsers)
+
 
-    if not sales:
+def pop_errors(parsers):
+    return [error for parser in parsers for error in parser.pop_errors()]
+
+
+def get_open_time(parsers):
+    return sum(parser.open_time for parser in parsers)
+
+
+def add_open_and_parse_stats(sale_file, stats, parsers, opened):
+    """Saves the stats of an import run, moving the workbooks opening time from parse to open"""
+    open_time = get_open_time(parsers)
+    stats.add('parse', opened - open_time)
+    stats.add('open', open_time)
+    sale_file.add_stats(stats)
+
+
+def replace_sales(sale_file, parser, importer, stats):
+    """Replaces the sales of the month with the sales of the whole file, in a single transaction"""
+    aggregated, rows = OrderedDict(), 0
+    with closing(iter_parsed_batches(parser)) as batches:
+        for batch in stats.iterate('parse', batches):
+            aggregate_batch(batch, aggregated)
+            rows += len(batch)
+            sale_file.add_parsed_rows(len(batch))
+
+    if not rows or has_invalid_rows(sale_file, [parser]):
+        return
+
+    with transaction.atomic():
+        importer.replace_aggregated(aggregated, settings.IMPORT_BATCH_SIZE)
+        sale_file.checkpoint(rows)
+
+
+def discard_imported_sales(sale_file):
+    """Deletes the sales already committed by a file import that failed"""
+    if not sale_file.imported_rows:
+        return
+
+    with transaction.atomic():
+        ProductsSale.objects.filter(company=sale_file.company, sale_month=sale_file.month).delete()
+        MonthlySales.objects.filter(company=sale_file.company, sale_month=sale_file.month).delete()
+        refresh_current_sales(sale_file.company)
+        sale_file.checkpoint(-sale_file.imported_rows, resume_row=0)
+
+
+@shared_task
+def aggregate_sales_chunk_task(sale_file_pk, start, stop, sheet=None, import_batch_id=None):
+    """Returns the sales of a range of the file rows aggregated by product, None if they can't be read"""
+    stats = ImportStats(memory=True)
+    sale_file = models.SalesImportFile.objects.get(pk=sale_file_pk)
+    if not sale_file.is_import_run(import_batch_id):
+        return None
+
+    parser = get_parser(sale_file.file, sheet=sheet, **get_parser_options(sale_file))
+
+    aggregated, rows = OrderedDict(), 0
+    try:
+        with closing(iter_parsed_batches(parser, start, stop)) as batches:
+            for batch in stats.iterate('parse', batches):
+                aggregate_batch(batch, aggregated)
+                rows += len(batch)
+                sale_file.add_parsed_rows(len(batch))
+    except ParserError:
+        return None
+    finally:
+        close_sales_file(sale_file, [parser])
+        sale_file.add_import_errors(parser.pop_errors())
+        add_open_and_parse_stats(sale_file, stats, [parser], 0)
+
+    if has_invalid_rows(sale_file, [parser]):
+        # the import fails, the sales aren't needed
+        aggregated.clear()
+    return {'rows': rows, 'sales': dump_aggregated(aggregated), 'errors': parser.errors_count}
+
+
+@shared_task(ignore_results=True, acks_late=True, reject_on_worker_lost=True)
+def merge_sales_chunks_task(chunks, sale_file_pk, import_batch_id=None):
+    """Saves the sales aggregated by the chunks of a file, chord callback of import_sales_task"""
+    sale_file = models.SalesImportFile.objects.get(pk=sale_file_pk)
+    if not sale_file.is_import_run(import_batch_id):
+        return
+
+    try:
+        merge_sales_chunks(chunks, sale_file)
+    except models.ImportReplaced:
+        pass
+
+
+def merge_sales_chunks(chunks, sale_file):
+    stats = ImportStats(memory=True)
+    if sale_file.imported_rows:
+        # the chunks were already saved by a previous run of this callback
+        sale_file.imported()
+        return
+
+    rows = sum(chunk['rows'] for chunk in chunks) if None not in chunks else 0
+    invalid = any(chunk.get('errors') for chunk in chunks) if None not in chunks else True
+    if not rows or (invalid and not sale_file.skip_invalid_rows):
         sale_file.imported_fail()
         return
 
-    for sale in sales:
-        category, result = ProductCategory.objects.get_or_create(name=sale['category'])
-        product, result = Product.objects.get_or_create(name=sale['product'], category=category)
+    aggregated = merge_aggregated(chunk['sales'] for chunk in chunks)
+    if can_copy_sales(rows):
+        copy_aggregated(sale_file, aggregated, rows, stats)
+    else:
+        save_aggregated(sale_file, aggregated, rows, stats)
+
+    with stats.measure('notify'):
+        sale_file.imported()
+    sale_file.add_stats(stats)
+
+
+def save_aggregated(sale_file, aggregated, rows, stats):
+    """Saves the merged sales of the chunks with the ORM, in a single transaction"""
+    importer = BulkSalesImporter(sale_file.company, sale_file.month, stats=stats)
+    with transaction.atomic():
+        if sale_file.replace_mode:
+            importer.replace_aggregated(aggregated, settings.IMPORT_BATCH_SIZE)
+        else:
+            items = iter(aggregated.items())
+            batch = OrderedDict(islice(items, settings.IMPORT_BATCH_SIZE))
+            while batch:
+                importer.save_aggregated(batch)
+                batch = OrderedDict(islice(items, settings.IMPORT_BATCH_SIZE))
 
-        if company not in product.company.all():
-            product.company.add(company)
+        sale_file.checkpoint(rows)
 
-        sold, cost, total = sale['sold'], sale['cost'], sale['total']
-        product_sale, result = ProductsSale.objects.get_or_create(
-            company=company,
-            product=product,
-            sale_month=sale_file.month,
-            defaults={'sold': sold, 'cost': cost, 'total': total}
-        )
 
-        if not result:
-            product_sale.sold += sold
-            product_sale.total += total
-            product_sale.save()
+def copy_aggregated(sale_file, aggregated, rows, stats):
+    """Saves the merged sales of the chunks with COPY, in a single transaction"""
+    importer = CopySalesImporter(sale_file.company, sale_file.month, stats=stats)
+    sales = (SaleRow(product, category, sale['sold'], sale['cost'], sale['total'])
+             for (category, product), sale in aggregated.items())
+    with transaction.atomic():
+        importer.create_staging()
+        batch = list(islice(sales, settings.IMPORT_BATCH_SIZE))
+        while batch:
+            importer.copy_batch(batch)
+            batch = list(islice(sales, settings.IMPORT_BATCH_SIZE))
 
-    sale_file.imported()
+        importer.merge(replace=sale_file.replace_mode)
+        sale_file.checkpoint(rows)
@@ -1,22 +1,84 @@
+import io
 import os
-from io import StringIO
+from io import BytesIO, StringIO
 from unittest import mock
 
-from django.core.files.storage import FileSystemStorage
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage, Storage
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from openpyxl import Workbook
+
+SALES_ROWS = [
+    ['Product', 'Category', 'Sold', 'Cost', 'Total'],
+    ['Product Low', 'Category A', 9, 'R$ 4,70', 'R$ 47,30'],
+    ['Product High', 'Category B', 5, 'R$ 3,20', 'R$ 107,50'],
+]
 
 
 def get_temporary_text_file(file_name, content='File Content'):
-    io = StringIO()
-    io.write(content)
-    io.seek(0, os.SEEK_END)
-    text_file = InMemoryUploadedFile(io, None, file_name, 'text', io.tell(), None)
+    buffer = StringIO()
+    buffer.write(content)
+    buffer.seek(0, os.SEEK_END)
+    text_file = InMemoryUploadedFile(buffer, None, file_name, 'text', buffer.tell(), None)
     text_file.seek(0)
     return text_file
 
 
+def get_temporary_xlsx_file(file_name, rows=None, sheets=None):
+    """Returns an uploaded workbook with the rows in its active sheet, or in each of the named sheets"""
+    rows = SALES_ROWS if rows is None else rows
+    wb = Workbook()
+    for i, title in enumerate(sheets or [None]):
+        ws = wb.active if i == 0 else wb.create_sheet()
+        if title:
+            ws.title = title
+        for row in rows:
+            ws.append(row)
+
+    buffer = BytesIO()
+    wb.save(buffer)
+    size = buffer.tell()
+    buffer.seek(0)
+    return InMemoryUploadedFile(buffer, None, file_name, 'application/vnd.ms-excel', size, None)
+
+
 def mock_storage(file_path):
     mock_save = mock.MagicMock(return_value=file_path)
     storage_mock = mock.patch.object(FileSystemStorage, '_save', mock_save)
 
     return storage_mock
+
+
+class StreamStorage(Storage):
+    """Local stand-in for an object storage: files are kept in memory, have no path and are read as streams"""
+
+    def __init__(self):
+        self.files = {}
+
+    def _open(self, name, mode='rb'):
+        return File(io.BufferedReader(Stream(self.files[name])), name)
+
+    def _save(self, name, content):
+        self.files[name] = b''.join(content.chunks())
+        return name
+
+    def exists(self, name):
+        return name in self.files
+
+    def size(self, name):
+        return len(self.files[name])
+
+
+class Stream(io.RawIOBase):
+    """Bytes that can only be read forward, like a HTTP response body"""
+
+    def __init__(self, content):
+        self.content = BytesIO(content)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.content.read(len(b))
+        b[:len(data)] = data
+        return len(data)
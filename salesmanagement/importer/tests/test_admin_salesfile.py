@@ -11,7 +11,7 @@ from salesmanagement.importer.tests import mock_storage
 
 class SalesFileAdminTest(TestCase):
     def setUp(self):
-        self.task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.delay')
+        self.task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
         self.storage_patcher = mock_storage('sales_imported_files/FileName.xlsx')
         self.notify_patcher = patch("salesmanagement.importer.models.notify", return_value=MagicMock(send=MagicMock()))
         with self.task_patcher as task_mock, self.storage_patcher, self.notify_patcher as notify_mock:
@@ -47,3 +47,12 @@ class SalesFileAdminTest(TestCase):
     def test_imported_result(self):
         """Must return if status is IMPORTED"""
         self.assertTrue(self.admin.imported(self.obj))
+
+    def test_stats_fields(self):
+        """Stats must be installed as sortable read-only columns"""
+        stats = ('upload_time', 'queue_time', 'open_time', 'parse_time', 'lookup_time', 'write_time',
+                 'notify_time', 'rows_per_second', 'peak_memory')
+        for field in stats:
+            with self.subTest(field=field):
+                self.assertIn(field, self.admin.list_display)
+                self.assertIn(field, self.admin.readonly_fields)
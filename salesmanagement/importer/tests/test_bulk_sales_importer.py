@@ -0,0 +1,328 @@
+from datetime import date
+from decimal import Decimal
+
+from unittest.mock import patch
+
+from django.db import IntegrityError
+from django.test import TestCase
+from djmoney.money import Money
+
+from salesmanagement.importer.bulk import (BulkSalesImporter, ImportLookupCache, aggregate_columns, aggregate_sales,
+                                            refresh_current_sales, refresh_monthly_sales)
+from salesmanagement.importer.parser import HEADER, ColumnBatch, SaleRow
+from salesmanagement.manager.factories import CompanyFactory, ProductFactory, ProductCategoryFactory
+from salesmanagement.manager.models import MonthlySales, Product, ProductCategory, ProductCurrentSale, ProductsSale
+
+
+def make_sales(count, products=None, prefix=''):
+    products = products or count
+    return [SaleRow(product=f'{prefix}Product {i % products}', category=f'{prefix}Category {i % 3}', sold=2,
+                    cost=Decimal('4.7'), total=Decimal('9.4')) for i in range(count)]
+
+
+class AggregateSalesTest(TestCase):
+    def setUp(self):
+        sales = [
+            SaleRow(product='Product Low', category='Category A', sold=9, cost=Decimal('4.7'),
+                    total=Decimal('47.3')),
+            SaleRow(product='Product High', category='Category B', sold=5, cost=Decimal('3.2'),
+                    total=Decimal('107.5')),
+            SaleRow(product='Product Low', category='Category A', sold=7, cost=Decimal('5.70'),
+                    total=Decimal('90.30')),
+        ]
+        self.aggregated = aggregate_sales(sales)
+
+    def test_keys(self):
+        """Must group by (category, product) keeping the file order"""
+        expected = [('Category A', 'Product Low'), ('Category B', 'Product High')]
+        self.assertEqual(expected, list(self.aggregated))
+
+    def test_sum_sold_and_total(self):
+        item = self.aggregated[('Category A', 'Product Low')]
+        self.assertEqual(16, item['sold'])
+        self.assertEqual(Decimal('137.6'), item['total'])
+
+    def test_keep_first_cost(self):
+        self.assertEqual(Decimal('4.7'), self.aggregated[('Category A', 'Product Low')]['cost'])
+
+
+class AggregateColumnsTest(TestCase):
+    def test_same_as_rows(self):
+        """Must aggregate the columns like the rows"""
+        sales = make_sales(10, products=4)
+        columns = ColumnBatch(HEADER, [list(column) for column in zip(*sales)])
+        self.assertEqual(aggregate_sales(sales), aggregate_columns(columns))
+
+
+class ImportLookupCacheTest(TestCase):
+    def setUp(self):
+        self.company = CompanyFactory.create()
+        self.category = ProductCategoryFactory.create(name='Category A')
+        self.product = ProductFactory.create(name='Product Low', category=self.category, companies=[self.company])
+        self.other = ProductFactory.create(name='Product High', category=self.category)
+        self.cache = ImportLookupCache(self.company).load()
+
+    def test_categories(self):
+        self.assertEqual({'Category A': self.category.pk}, self.cache.categories)
+
+    def test_products(self):
+        expected = {('Product Low', self.category.pk): self.product.pk,
+                    ('Product High', self.category.pk): self.other.pk}
+        self.assertEqual(expected, self.cache.products)
+
+    def test_company_products(self):
+        """Must hold only the products linked to the company"""
+        self.assertEqual({self.product.pk}, self.cache.company_products)
+
+    def test_updated_by_import(self):
+        """Must keep the records created by the import"""
+        importer = BulkSalesImporter(self.company, date(day=1, month=7, year=2018), cache=self.cache)
+        importer.import_batch(make_sales(1))
+        product = Product.objects.get(name='Product 0')
+        self.assertEqual(product.category_id, self.cache.categories['Category 0'])
+        self.assertEqual(product.pk, self.cache.products[('Product 0', product.category_id)])
+        self.assertIn(product.pk, self.cache.company_products)
+
+    def test_no_lookups_for_known_records(self):
+        """Must not query categories, products or company links already in the cache"""
+        importer = BulkSalesImporter(self.company, date(day=1, month=7, year=2018), cache=self.cache)
+        sale = SaleRow(product='Product Low', category='Category A', sold=2, cost=Decimal('4.7'),
+                       total=Decimal('9.4'))
+        # the select and the insert of the products sale, the monthly sales and the current sale,
+        # the inserts in savepoints, and the select of the latest products sale
+        with self.assertNumQueries(15):
+            importer.import_batch([sale])
+
+
+class BulkSalesImporterTest(TestCase):
+    def setUp(self):
+        self.company = CompanyFactory.create()
+        self.month = date(day=1, month=7, year=2018)
+        self.importer = BulkSalesImporter(self.company, self.month)
+
+    def test_import_batch_count(self):
+        """Must return how many rows were imported"""
+        self.assertEqual(10, self.importer.import_batch(make_sales(10, products=4)))
+
+    def test_import_column_batch(self):
+        sales = make_sales(10, products=4)
+        self.assertEqual(10, self.importer.import_batch(ColumnBatch(HEADER, [list(c) for c in zip(*sales)])))
+        self.assertEqual(20, sum(ProductsSale.objects.values_list('sold', flat=True)))
+
+    def test_reuse_existing_category_and_product(self):
+        """Must not duplicate categories and products that already exist"""
+        category = ProductCategoryFactory.create(name='Category 0')
+        ProductFactory.create(name='Product 0', category=category)
+        BulkSalesImporter(self.company, self.month).import_batch(make_sales(3))
+        self.assertEqual(3, ProductCategory.objects.count())
+        self.assertEqual(3, Product.objects.count())
+
+    def test_link_company(self):
+        """Must link every imported product to the company once"""
+        self.importer.import_batch(make_sales(3))
+        self.importer.import_batch(make_sales(3))
+        self.assertEqual(3, Product.company.through.objects.filter(company=self.company).count())
+
+    def test_update_existing_products_sale(self):
+        """Must add sold and total to the products sale saved by a previous batch"""
+        self.importer.import_batch(make_sales(2))
+        self.importer.import_batch(make_sales(3))
+        sales = [(s.product.name, s.sold, s.total) for s in ProductsSale.objects.order_by('pk')]
+        expected = [('Product 0', 4, Money(18.8, 'BRL')), ('Product 1', 4, Money(18.8, 'BRL')),
+                    ('Product 2', 2, Money(9.4, 'BRL'))]
+        self.assertEqual(expected, sales)
+
+    def test_constant_queries_for_new_rows(self):
+        """Must run the same number of queries whatever the batch size"""
+        with self.assertNumQueries(26):
+            self.importer.import_batch(make_sales(10, prefix='A '))
+
+        with self.assertNumQueries(26):
+            self.importer.import_batch(make_sales(90, prefix='B '))
+
+    def test_constant_queries_for_existing_rows(self):
+        """Must run the same number of queries whatever the batch size"""
+        self.importer.import_batch(make_sales(90))
+        with self.assertNumQueries(9):
+            self.importer.import_batch(make_sales(10))
+
+        with self.assertNumQueries(9):
+            self.importer.import_batch(make_sales(90))
+
+
+class ReplaceAggregatedTest(TestCase):
+    def setUp(self):
+        self.company = CompanyFactory.create()
+        self.month = date(day=1, month=7, year=2018)
+        self.importer = BulkSalesImporter(self.company, self.month)
+        self.importer.import_batch(make_sales(3))
+
+    def month_sales(self):
+        q = ProductsSale.objects.filter(company=self.company, sale_month=self.month).order_by('product__name')
+        return list(q.values_list('product__name', 'sold', 'total'))
+
+    def test_replace(self):
+        """Must update the changed products sale, insert the new ones and delete the missing ones"""
+        sales = make_sales(2)
+        sales[1] = sales[1]._replace(sold=5)
+        sales.append(SaleRow(product='Product 3', category='Category 0', sold=1, cost=Decimal('4.7'),
+                             total=Decimal('4.7')))
+        self.importer.replace_aggregated(aggregate_sales(sales), batch_size=2)
+
+        expected = [('Product 0', 2, Decimal('9.40')), ('Product 1', 5, Decimal('9.40')),
+                    ('Product 3', 1, Decimal('4.70'))]
+        self.assertEqual(expected, self.month_sales())
+
+    def test_write_only_changes(self):
+        """Must not write anything when the sales didn't change"""
+        with self.assertNumQueries(3):
+            self.importer.replace_aggregated(aggregate_sales(make_sales(3)))
+
+    def test_products_sale_created_meanwhile(self):
+        """Must overwrite the products sale created by another import after the lookup"""
+        importer = BulkSalesImporter(self.company, self.month)
+        with patch.object(importer, 'get_month_sales', side_effect=[{}] + [importer.get_month_sales()] * 2):
+            importer.replace_aggregated(aggregate_sales(make_sales(3)[:2] * 2))
+
+        expected = [('Product 0', 4, Decimal('18.80')), ('Product 1', 4, Decimal('18.80'))]
+        self.assertEqual(expected, self.month_sales()[:2])
+
+    def test_other_months(self):
+        """Must not change the sales of other months"""
+        BulkSalesImporter(self.company, date(day=1, month=8, year=2018)).import_batch(make_sales(3))
+        self.importer.replace_aggregated(aggregate_sales(make_sales(1)))
+        self.assertEqual(4, ProductsSale.objects.count())
+
+
+class MonthlySalesTest(TestCase):
+    def setUp(self):
+        self.company = CompanyFactory.create()
+        self.month = date(day=1, month=7, year=2018)
+        self.importer = BulkSalesImporter(self.company, self.month)
+
+    def summed(self):
+        q = MonthlySales.objects.filter(company=self.company, sale_month=self.month).order_by('category__name')
+        return [(m.category.name, m.products, m.sold, m.costs, m.total) for m in q]
+
+    def assertSummedFromProductsSale(self):
+        """The sums kept by the import must be the ones summed again from the products sale"""
+        summed = self.summed()
+        refresh_monthly_sales(self.company, self.month)
+        self.assertEqual(self.summed(), summed)
+
+    def test_add(self):
+        self.importer.import_batch(make_sales(10, products=4))
+        self.importer.import_batch(make_sales(5, products=2))
+        self.assertSummedFromProductsSale()
+
+    def test_existing_products_sale(self):
+        """Must count the products and their cost only once"""
+        self.importer.import_batch(make_sales(3))
+        self.importer.import_batch(make_sales(3))
+        expected = [(f'Category {i}', 1, 4, Money(4.7, 'BRL'), Money(18.8, 'BRL')) for i in range(3)]
+        self.assertEqual(expected, self.summed())
+
+    def test_replace(self):
+        self.importer.import_batch(make_sales(10, products=4))
+        self.importer.replace_aggregated(aggregate_sales(make_sales(2)))
+        self.assertSummedFromProductsSale()
+        self.assertEqual(2, len(self.summed()))
+
+    def test_other_months(self):
+        """Must not change the sums of other months"""
+        BulkSalesImporter(self.company, date(day=1, month=8, year=2018)).import_batch(make_sales(3))
+        self.importer.import_batch(make_sales(3))
+        self.assertEqual(6, MonthlySales.objects.count())
+
+
+class CurrentSaleTest(TestCase):
+    def setUp(self):
+        self.company = CompanyFactory.create()
+        self.july = date(day=1, month=7, year=2018)
+        BulkSalesImporter(self.company, self.july).import_batch(make_sales(2))
+
+    def import_month(self, month, cost):
+        sales = [sale._replace(cost=cost) for sale in make_sales(1)]
+        BulkSalesImporter(self.company, month).import_batch(sales * 2)
+
+    def current(self):
+        q = ProductCurrentSale.objects.filter(company=self.company).order_by('product__name')
+        return [(c.product.name, c.sale_month, c.cost, c.price) for c in q]
+
+    def test_import(self):
+        """Must store the cost and the sale price of the imported products"""
+        expected = [(f'Product {i}', self.july, Money(4.7, 'BRL'), Money(4.7, 'BRL')) for i in range(2)]
+        self.assertEqual(expected, self.current())
+
+    def test_later_month(self):
+        self.import_month(date(day=1, month=8, year=2018), Decimal('5.2'))
+        expected = (date(day=1, month=8, year=2018), Money(5.2, 'BRL'), Money(4.7, 'BRL'))
+        self.assertEqual(expected, self.current()[0][1:])
+
+    def test_earlier_month(self):
+        """Must keep the sale of the latest month when an earlier one is imported"""
+        self.import_month(date(day=1, month=6, year=2018), Decimal('5.2'))
+        self.assertEqual((self.july, Money(4.7, 'BRL'), Money(4.7, 'BRL')), self.current()[0][1:])
+
+    def test_replace(self):
+        """Must remove the current sale of the products that aren't sold anymore"""
+        BulkSalesImporter(self.company, self.july).replace_aggregated(aggregate_sales(make_sales(1)))
+        self.assertEqual(['Product 0'], [name for name, *current in self.current()])
+
+    def test_refresh_all(self):
+        ProductCurrentSale.objects.all().delete()
+        refresh_current_sales(self.company)
+        self.assertEqual(2, len(self.current()))
+
+
+class ConcurrentImportTest(TestCase):
+    """Another import of the company inserts the same rows between the lookups and the inserts"""
+
+    def setUp(self):
+        self.company = CompanyFactory.create()
+        self.month = date(day=1, month=7, year=2018)
+        BulkSalesImporter(self.company, self.month).import_batch(make_sales(3))
+        self.importer = BulkSalesImporter(self.company, self.month)
+
+    def stale(self, method):
+        """Patches a lookup of the importer to miss the rows on its first call"""
+        real = getattr(self.importer, method)
+        calls = []
+
+        def lookup(keys):
+            calls.append(keys)
+            return real(keys) if len(calls) > 1 else {}
+
+        return patch.object(self.importer, method, side_effect=lookup)
+
+    def test_categories(self):
+        with self.stale('get_categories'):
+            self.importer.import_batch(make_sales(3))
+        self.assertEqual(3, ProductCategory.objects.count())
+
+    def test_products(self):
+        with self.stale('get_products'):
+            self.importer.import_batch(make_sales(3))
+        self.assertEqual(3, Product.objects.count())
+        self.assertEqual(3, self.company.product_set.count())
+
+    def test_products_sale(self):
+        """Must add the sales to the products sale created by the other import"""
+        with self.stale('get_products_sale'):
+            self.importer.import_batch(make_sales(4))
+
+        q = ProductsSale.objects.filter(company=self.company, sale_month=self.month).order_by('product__name')
+        self.assertEqual([4, 4, 4, 2], [sale.sold for sale in q])
+
+    def test_insert_order(self):
+        """Must insert the rows sorted by their keys, so the imports lock them in the same order"""
+        self.importer.import_batch(make_sales(3, prefix='New ')[::-1])
+        categories = ProductCategory.objects.filter(name__startswith='New ').order_by('pk')
+        products = Product.objects.filter(name__startswith='New ').order_by('pk')
+        self.assertEqual(['New Category 0', 'New Category 1', 'New Category 2'], [c.name for c in categories])
+        self.assertEqual(['New Product 0', 'New Product 1', 'New Product 2'], [p.name for p in products])
+
+    def test_other_integrity_errors(self):
+        """Must raise the errors that aren't a conflict with another import"""
+        with patch.object(self.importer, 'get_products_sale', return_value={}), self.assertRaises(IntegrityError):
+            self.importer.import_batch(make_sales(3))
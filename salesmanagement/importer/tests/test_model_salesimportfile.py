@@ -1,9 +1,10 @@
+import hashlib
 from datetime import date, datetime
 from unittest.mock import patch, MagicMock
 
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext as _
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from salesmanagement.importer.factories import SalesImportFileFactory
 from salesmanagement.importer.models import SalesImportFile
@@ -12,7 +13,7 @@ from salesmanagement.importer.tests import mock_storage
 
 class SalesImportFileModelTest(TestCase):
     def setUp(self):
-        self.task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.delay')
+        self.task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
         self.storage_patcher = mock_storage('sales_imported_files/FileName.xlsx')
         self.notify_patcher = patch("salesmanagement.importer.models.notify", return_value=MagicMock(send=MagicMock()))
         with self.task_patcher as task_mock, self.storage_patcher, self.notify_patcher as notify_mock:
@@ -76,14 +77,29 @@ class SalesImportFileModelTest(TestCase):
 
     def test_call_importer_on_create_file(self):
         """Must call task to import data file on create"""
-        self.task_mock.assert_called_once_with(self.obj.pk)
+        self.task_mock.assert_called_once_with((self.obj.pk, str(self.obj.import_batch_id)), queue='express')
 
     def test_call_importer_on_change_file(self):
         """Must call task to import data file on change"""
         with self.task_patcher as task_mock, self.storage_patcher:
             self.obj.file = 'FileNameDiff.xlsx'
             self.obj.save()
-            task_mock.assert_called_once_with(self.obj.pk)
+            task_mock.assert_called_once_with((self.obj.pk, str(self.obj.import_batch_id)), queue='express')
+
+    @override_settings(IMPORT_EXPRESS_MAX_SIZE=3)
+    def test_call_importer_on_bulk_queue(self):
+        """Must send the import of big files to the bulk queue"""
+        with self.task_patcher as task_mock, self.storage_patcher:
+            obj = SalesImportFileFactory.create()
+            task_mock.assert_called_once_with((obj.pk, str(obj.import_batch_id)), queue='bulk')
+
+    def test_import_queue(self):
+        """Must choose the queue by the file size"""
+        obj = SalesImportFileFactory.build()
+        with self.settings(IMPORT_EXPRESS_MAX_SIZE=4):
+            self.assertEqual('express', obj.get_import_queue())
+        with self.settings(IMPORT_EXPRESS_MAX_SIZE=3):
+            self.assertEqual('bulk', obj.get_import_queue())
 
     def test_not_call_importer_on_changed_but_not_file_field(self):
         """Must not call task import on change when file field won't was changed"""
@@ -92,6 +108,66 @@ class SalesImportFileModelTest(TestCase):
             self.obj.save()
             task_mock.assert_not_called()
 
+    def test_new_import_on_change_file(self):
+        """Must start a new import batch from the first row when the file changes"""
+        old_batch_id = self.obj.import_batch_id
+        self.obj.checkpoint(10)
+        with self.task_patcher, self.storage_patcher:
+            self.obj.file = 'FileNameDiff.xlsx'
+            self.obj.save()
+
+        self.obj.refresh_from_db()
+        self.assertNotEqual(old_batch_id, self.obj.import_batch_id)
+        self.assertEqual(0, self.obj.imported_rows)
+
+    def test_replace_mode(self):
+        """Must replace the sales of the previous file when the file changes"""
+        self.assertFalse(self.obj.replace_mode)
+        with self.task_patcher, self.storage_patcher:
+            self.obj.file = 'FileNameDiff.xlsx'
+            self.obj.save()
+
+        self.assertTrue(SalesImportFile.objects.get(pk=self.obj.pk).replace_mode)
+
+    def test_file_hash(self):
+        """Must save the sha256 of the uploaded file"""
+        self.assertEqual(hashlib.sha256(b'data').hexdigest(), self.obj.file_hash)
+
+    def test_get_sheets(self):
+        """Must split the sheets names"""
+        self.assertEqual([], self.obj.get_sheets())
+        self.obj.sheets = 'Store A, Store B,'
+        self.assertEqual(['Store A', 'Store B'], self.obj.get_sheets())
+
+    def test_get_sheets_text_file(self):
+        """Must ignore the sheets of text files"""
+        self.obj.sheets = 'Store A'
+        self.obj.file.name = 'sales_imported_files/FileName.csv'
+        self.assertEqual([], self.obj.get_sheets())
+
+    def test_checkpoint(self):
+        """Must save the imported rows"""
+        self.obj.checkpoint(10)
+        self.obj.checkpoint(5)
+        self.assertEqual(15, self.obj.imported_rows)
+        self.assertEqual(15, SalesImportFile.objects.get(pk=self.obj.pk).imported_rows)
+
+    def test_add_import_errors(self):
+        """Must append the errors one per line"""
+        self.obj.add_import_errors(['Linha 3: tem 2 colunas, deveria ter 5'])
+        self.obj.add_import_errors(["Linha 7, coluna 3: valor inválido 'a' em sold"])
+        expected = "Linha 3: tem 2 colunas, deveria ter 5\nLinha 7, coluna 3: valor inválido 'a' em sold\n"
+        self.assertEqual(expected, self.obj.import_errors)
+        self.assertEqual(expected, SalesImportFile.objects.get(pk=self.obj.pk).import_errors)
+
+    def test_notify_errors(self):
+        """Must send the import errors as the notification description"""
+        self.obj.add_import_errors(['Linha 3: tem 2 colunas, deveria ter 5'])
+        with self.notify_patcher as mock:
+            self.obj.imported_fail()
+            mock.send.assert_called_once_with(self.obj, recipient=self.obj.user, verb=_('falhou ao ser importado'),
+                                              description='Linha 3: tem 2 colunas, deveria ter 5\n')
+
     def test_notify_on_status_imported(self):
         """Must send notification when status changed to IMPORTED"""
         with self.notify_patcher as mock:
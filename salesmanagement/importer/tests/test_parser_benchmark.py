@@ -0,0 +1,86 @@
+import os
+import time
+from unittest import skipUnless
+
+from django.test import SimpleTestCase
+from djmoney.money import Money
+
+from salesmanagement.importer.bulk import aggregate_columns, aggregate_sales
+from salesmanagement.importer.parser import ParserSalesXlsx
+
+ROWS = int(os.environ.get('IMPORT_BENCHMARK_ROWS', 1000000))
+
+
+def get_row_dict(parser, values):
+    """Row conversion before the converters were compiled, kept as the benchmark baseline"""
+    d = {}
+    for i, h in enumerate(parser.header):
+        convert = getattr(parser, 'parse_'+h, parser.default_parse)
+        d[h] = convert(values[i])
+
+    return d
+
+
+def parse_currency_money(currency):
+    """Currency parsing before the Decimal fast path, kept as the benchmark baseline"""
+    if isinstance(currency, float):
+        return Money(currency, 'BRL')
+
+    n = str(currency).replace('R$', '').replace('.', '').replace(',', '.').strip()
+    return Money(n, 'BRL')
+
+
+@skipUnless(os.environ.get('IMPORT_BENCHMARK'), 'set IMPORT_BENCHMARK=1 to run the parser benchmarks')
+class RowConversionBenchmark(SimpleTestCase):
+    """Per row cost of converting the cell values of a synthetic sheet"""
+
+    def setUp(self):
+        self.parser = ParserSalesXlsx('FileName.xlsx')
+        self.sheet = [(f'Product {i % 500}', f'Category {i % 20}', str(i % 10 + 1), 'R$ 4,70', 'R$ 47,30')
+                      for i in range(ROWS)]
+
+    def measure(self, convert):
+        started = time.perf_counter()
+        for values in self.sheet:
+            convert(values)
+        return (time.perf_counter() - started) / ROWS
+
+    def test_compiled_converters(self):
+        before = self.measure(lambda values: get_row_dict(self.parser, values))
+        after = self.measure(self.parser.get_row)
+        print(f'\n{ROWS} rows, per row: getattr dispatch {before * 1e6:.2f}us, '
+              f'compiled converters {after * 1e6:.2f}us')
+        self.assertLess(after, before)
+
+    def test_currency(self):
+        cells = [values[3] for values in self.sheet]
+        started = time.perf_counter()
+        for cell in cells:
+            parse_currency_money(cell)
+        before = (time.perf_counter() - started) / ROWS
+
+        started = time.perf_counter()
+        for cell in cells:
+            self.parser.parse_currency(cell)
+        after = (time.perf_counter() - started) / ROWS
+
+        print(f'\n{ROWS} cells, per cell: Money {before * 1e6:.2f}us, memoized Decimal {after * 1e6:.2f}us')
+        self.assertLess(after, before)
+
+    def test_columnar(self):
+        """Parsing plus aggregation of 1000 rows batches by row and by column"""
+        batches = [list(enumerate(self.sheet[start:start + 1000], start + 2)) for start in range(0, ROWS, 1000)]
+
+        started = time.perf_counter()
+        for batch in batches:
+            aggregate_sales([self.parser.get_row(values) for i, values in batch])
+        by_row = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for batch in batches:
+            aggregate_columns(self.parser.get_columns(batch))
+        by_column = time.perf_counter() - started
+
+        print(f'\n{ROWS} rows parsed and aggregated per second: by row {ROWS / by_row:.0f}, '
+              f'by column {ROWS / by_column:.0f}')
+        self.assertLess(by_column, by_row)
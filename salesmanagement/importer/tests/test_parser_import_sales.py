@@ -1,9 +1,16 @@
+from decimal import Decimal, InvalidOperation
+from io import BufferedReader, BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest.mock import patch
 
+from django.core.files.base import File
 from django.test import TestCase
-from djmoney.money import Money
+from openpyxl import Workbook
 
-from salesmanagement.importer.parser import ParserSalesXlsx
+from salesmanagement.importer.parser import (ParserSalesCsv, ParserSalesTsv, ParserSalesXlsx, ParserError, RowError,
+                                             SaleRow, get_parser)
+from salesmanagement.importer.tests import Stream
 
 
 class Cell:
@@ -20,7 +27,7 @@ class ParserSalesXlsxTestValid(TestCase):
         ]
 
         with patch('salesmanagement.importer.parser.load_workbook') as mock:
-            mock.return_value.active.rows = rows
+            mock.return_value.active.iter_rows.return_value = rows
             self.parser = ParserSalesXlsx('FileName.xlsx')
             self.data = self.parser.as_data()
 
@@ -44,25 +51,62 @@ class ParserSalesXlsxTestValid(TestCase):
 
     def test_parse_currency_str(self):
         currency_float = self.parser.parse_currency('R$ 45,30')
-        expected = Money(45.3, 'BRL')
+        expected = Decimal('45.30')
         self.assertEqual(expected, currency_float)
 
     def test_parse_currency_int(self):
         currency_float = self.parser.parse_currency(45)
-        expected = Money(45, 'BRL')
+        expected = Decimal('45')
         self.assertEqual(expected, currency_float)
 
     def test_parse_currency_float(self):
         currency_float = self.parser.parse_currency(45.3)
-        expected = Money(45.3, 'BRL')
+        expected = Decimal('45.30')
         self.assertEqual(expected, currency_float)
 
+    def test_parse_currency_thousands(self):
+        self.assertEqual(Decimal('1234.56'), self.parser.parse_currency('R$ 1.234,56'))
+        self.assertEqual(Decimal('1234'), self.parser.parse_currency('R$ 1.234'))
+
+    def test_parse_currency_decimal_point(self):
+        """Must parse the values exported with a decimal point instead of the Brazilian format"""
+        self.assertEqual(Decimal('4.70'), self.parser.parse_currency('4.70'))
+        self.assertEqual(Decimal('4.7'), self.parser.parse_currency('4.7'))
+
+    def test_parse_currency_invalid_separators(self):
+        with self.assertRaises(InvalidOperation):
+            self.parser.parse_currency('1.234.56')
+
+    def test_parse_currency_memoized(self):
+        """Must parse each repeated currency string once"""
+        self.parser.parse_currency.cache_clear()
+        for _ in range(3):
+            self.parser.parse_currency('R$ 9,99')
+        self.assertEqual(1, self.parser.parse_currency.cache_info().misses)
+
+    def test_converters(self):
+        """Must resolve the converter of each column once"""
+        expected = (self.parser.parse_product, self.parser.parse_category, self.parser.parse_sold,
+                    self.parser.parse_cost, self.parser.parse_total)
+        self.assertEqual(expected, self.parser.converters)
+
+    def test_row_class(self):
+        """Must create compact rows with the values reachable by the header names"""
+        row = self.data[0]
+        self.assertIsInstance(row, SaleRow)
+        self.assertEqual(('Product Low', 9), (row.product, row.sold))
+
+    def test_custom_header(self):
+        parser = ParserSalesXlsx('FileName.xlsx', header=['product', 'notes'])
+        row = parser.get_row(('Product Low', 'Some notes'))
+        self.assertEqual(('Product Low', 'Some notes'), (row.product, row.notes))
+
     def test_output_list(self):
         expected = [
-            {'product': 'Product Low', 'category': 'Category A', 'sold': 9, 'cost': Money(4.7, 'BRL'),
-             'total': Money(47.3, 'BRL')},
-            {'product': 'Product High', 'category': 'Category B', 'sold': 5, 'cost': Money(3.2, 'BRL'),
-             'total': Money(107.5, 'BRL')}
+            SaleRow(product='Product Low', category='Category A', sold=9, cost=Decimal('4.7'),
+                    total=Decimal('47.3')),
+            SaleRow(product='Product High', category='Category B', sold=5, cost=Decimal('3.2'),
+                    total=Decimal('107.5'))
         ]
         self.assertEqual(expected, self.data)
 
@@ -94,7 +138,401 @@ class ParserSalesXlsxTestInvalid(TestCase):
         expected = 45.3
         self.assertNotEqual(expected, currency_float)
 
+    def test_iter_rows_raises_parser_error(self):
+        """Must raise ParserError on the first invalid row"""
+        rows = [(Cell('Product High'), Cell('Category B'), Cell('5'))]
+        with patch('salesmanagement.importer.parser.load_workbook') as mock:
+            mock.return_value.active.iter_rows.return_value = rows
+            with self.assertRaises(ParserError):
+                list(self.parser.iter_rows())
+
     def get_parse_as_data(self, rows):
         with patch('salesmanagement.importer.parser.load_workbook') as mock:
-            mock.return_value.active.rows = rows
+            mock.return_value.active.iter_rows.return_value = rows
             return self.parser.as_data()
+
+
+class ParserSalesXlsxTestStreaming(TestCase):
+    def setUp(self):
+        rows = [
+            (Cell('Product'), Cell('Category'), Cell('Sold'), Cell('Cost'), Cell('Total')),
+            (Cell('Product Low'), Cell('Category A'), Cell('9'), Cell('R$ 4,70'), Cell('R$ 47,30')),
+        ]
+        self.load_patcher = patch('salesmanagement.importer.parser.load_workbook')
+        self.load_mock = self.load_patcher.start()
+        self.load_mock.return_value.active.iter_rows.return_value = iter(rows)
+        self.parser = ParserSalesXlsx('FileName.xlsx')
+
+    def tearDown(self):
+        self.load_patcher.stop()
+
+    def test_iter_rows_is_generator(self):
+        """Must not read the workbook before iterating"""
+        self.parser.iter_rows()
+        self.load_mock.assert_not_called()
+
+    def test_read_only_mode(self):
+        """Must open the workbook in read-only mode"""
+        list(self.parser.iter_rows())
+        self.load_mock.assert_called_once_with(filename='FileName.xlsx', read_only=True)
+
+    def test_read_from_header(self):
+        """Must read the whole sheet by default"""
+        list(self.parser.iter_rows())
+        self.load_mock.return_value.active.iter_rows.assert_called_once_with(min_row=1, max_row=None)
+
+    def test_read_range(self):
+        """Must read only the sheet rows of the sales range, skipping the header"""
+        self.load_mock.return_value.active.iter_rows.return_value = iter([])
+        list(self.parser.iter_rows(start=10, stop=20))
+        self.load_mock.return_value.active.iter_rows.assert_called_once_with(min_row=12, max_row=21)
+
+    def test_count_rows(self):
+        """Must count the sales rows from the sheet dimension"""
+        self.load_mock.return_value.active.max_row = 101
+        self.assertEqual(100, self.parser.count_rows())
+
+    def test_count_rows_unknown(self):
+        self.load_mock.return_value.active.max_row = None
+        self.assertIsNone(self.parser.count_rows())
+
+    def test_close_workbook(self):
+        """Must close the workbook after reading it"""
+        list(self.parser.iter_rows())
+        self.load_mock.return_value.close.assert_called_once_with()
+
+    def test_rows(self):
+        expected = [SaleRow(product='Product Low', category='Category A', sold=9, cost=Decimal('4.7'),
+                            total=Decimal('47.3'))]
+        self.assertEqual(expected, list(self.parser.iter_rows()))
+
+
+class ParserSalesXlsxTestBatches(TestCase):
+    def setUp(self):
+        header = [(Cell('Product'), Cell('Category'), Cell('Sold'), Cell('Cost'), Cell('Total'))]
+        self.rows = header + [
+            (Cell(f'Product {i}'), Cell('Category A'), Cell('9'), Cell('R$ 4,70'), Cell('R$ 47,30')) for i in range(5)
+        ]
+
+        with patch('salesmanagement.importer.parser.load_workbook') as mock:
+            mock.return_value.active.iter_rows.return_value = self.rows
+            self.batches = list(ParserSalesXlsx('FileName.xlsx').iter_batches(size=2))
+
+    def test_batches_count(self):
+        """Must split 5 rows in 3 batches"""
+        self.assertEqual(3, len(self.batches))
+
+    def test_batches_size(self):
+        """Must fill each batch up to size, the last one takes the remaining rows"""
+        self.assertEqual([2, 2, 1], [len(batch) for batch in self.batches])
+
+    def test_batches_rows_order(self):
+        """Must keep the file rows order"""
+        products = [row.product for batch in self.batches for row in batch]
+        self.assertEqual([f'Product {i}' for i in range(5)], products)
+
+    def test_close_workbook_when_left(self):
+        """Must close the workbook when the batches are closed before the end"""
+        with patch('salesmanagement.importer.parser.load_workbook') as mock:
+            mock.return_value.active.iter_rows.return_value = self.rows
+            batches = ParserSalesXlsx('FileName.xlsx').iter_batches(size=2)
+            next(batches)
+            batches.close()
+        mock.return_value.close.assert_called_once_with()
+
+
+class ParserSalesCsvTest(TestCase):
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.content = ('Product;Category;Sold;Cost;Total\n'
+                        'Product Low;Category A;9;R$ 4,70;R$ 47,30\n'
+                        'Product High;Category B;5;R$ 3,20;R$ 107,50\n'
+                        '"Product; Mid";Category B;1;R$ 1,00;R$ 1,00\n')
+        self.parser = ParserSalesCsv(self.write('FileName.csv', self.content))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, content):
+        path = Path(self.dir.name) / name
+        path.write_text(content, encoding='utf-8')
+        return str(path)
+
+    def test_rows(self):
+        """Must parse the rows with the same contract of the xlsx parser"""
+        expected = [
+            SaleRow(product='Product Low', category='Category A', sold=9, cost=Decimal('4.7'),
+                    total=Decimal('47.3')),
+            SaleRow(product='Product High', category='Category B', sold=5, cost=Decimal('3.2'),
+                    total=Decimal('107.5')),
+            SaleRow(product='Product; Mid', category='Category B', sold=1, cost=Decimal('1'),
+                    total=Decimal('1')),
+        ]
+        self.assertEqual(expected, self.parser.as_data())
+
+    def test_read_range(self):
+        """Must read only the rows of the sales range"""
+        products = [row.product for row in self.parser.iter_rows(start=1, stop=2)]
+        self.assertEqual(['Product High'], products)
+
+    def test_count_rows(self):
+        self.assertEqual(3, self.parser.count_rows())
+
+    def test_comma_delimiter(self):
+        path = self.write('Comma.csv', 'Product,Category,Sold,Cost,Total\nProduct Low,Category A,9,"R$ 4,70",10\n')
+        self.assertEqual(Decimal('4.70'), ParserSalesCsv(path).as_data()[0].cost)
+
+    def test_tsv(self):
+        path = self.write('FileName.tsv', self.content.replace(';', '\t'))
+        self.assertEqual(3, len(ParserSalesTsv(path).as_data()))
+
+    def test_cp1252(self):
+        """Must read the files exported by Excel as cp1252, also when the accents are far from the start"""
+        content = self.content + 'Product Low;Category A;1;R$ 1,00;R$ 1,00\n' * 500 + 'Açúcar;Category A;1;4.70;4.70\n'
+        path = Path(self.dir.name) / 'Excel.csv'
+        path.write_bytes(content.encode('cp1252'))
+        rows = ParserSalesCsv(str(path)).as_data()
+        self.assertEqual(('Açúcar', Decimal('4.70')), (rows[-1].product, rows[-1].cost))
+
+    def test_unknown_encoding(self):
+        """Must raise ParserError when the text can't be decoded"""
+        path = Path(self.dir.name) / 'Binary.csv'
+        path.write_bytes(self.content.encode() + b'\x81\x8d;Category A;1;1;1\n')
+        with self.assertRaisesMessage(ParserError, 'The file text encoding is unknown'):
+            list(ParserSalesCsv(str(path)).iter_rows())
+
+    def test_inconsistent_columns(self):
+        """Must raise ParserError on the first invalid row"""
+        path = self.write('Invalid.csv', 'Product;Category;Sold;Cost;Total\nProduct Low;Category A;9\n')
+        with self.assertRaisesMessage(ParserError, 'Row 2 has 3 columns, expected 5'):
+            list(ParserSalesCsv(path).iter_rows())
+
+    def test_header_columns_order(self):
+        """Must raise ParserError naming the first header column that isn't the expected one"""
+        path = self.write('Swapped.csv', 'category;product;total;sold;cost\nCategory A;Product Low;1;9;R$ 4,70\n')
+        with self.assertRaisesMessage(ParserError, "Header column 1 is 'category', expected product"):
+            list(ParserSalesCsv(path).iter_rows())
+
+    def test_header_names(self):
+        """Must accept the header names in any case, surrounded by spaces or in Portuguese"""
+        path = self.write('Names.csv', ' PRODUTO ;Categoria;Vendidos;custo;Total\nProduct Low;Category A;9;1;9\n')
+        self.assertEqual(['Product Low'], [row.product for row in ParserSalesCsv(path).iter_rows()])
+
+
+class ParserSalesCollectErrorsTest(TestCase):
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.path = Path(self.dir.name) / 'FileName.csv'
+        self.path.write_text('Product;Category;Sold;Cost;Total\n'
+                             'Product Low;Category A;9;R$ 4,70;R$ 47,30\n'
+                             'Product Bad;Category A;a;R$ 4,70;R$ 47,30\n'
+                             'Product Short;Category A\n'
+                             'Product High;Category B;5;R$ 3,20;R$ 107,50\n'
+                             'Product Cost;Category B;5;abc;R$ 107,50\n', encoding='utf-8')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_skip_invalid_rows(self):
+        """Must yield only the valid rows"""
+        parser = ParserSalesCsv(str(self.path), max_errors=10)
+        self.assertEqual(['Product Low', 'Product High'], [row.product for row in parser.iter_rows()])
+
+    def test_errors(self):
+        """Must collect every invalid row with its row and column numbers"""
+        parser = ParserSalesCsv(str(self.path), max_errors=10)
+        list(parser.iter_rows())
+        expected = [RowError(3, 3, "valor inválido 'a' em sold"),
+                    RowError(4, None, 'tem 2 colunas, deveria ter 5'),
+                    RowError(6, 4, "valor inválido 'abc' em cost")]
+        self.assertEqual(expected, parser.errors)
+
+    def test_error_message(self):
+        self.assertEqual("Linha 3, coluna 3: valor inválido 'a' em sold", str(RowError(3, 3, "valor inválido 'a' em sold")))
+        self.assertEqual('Linha 4: tem 2 colunas, deveria ter 5', str(RowError(4, None, 'tem 2 colunas, deveria ter 5')))
+
+    def test_column_batches(self):
+        """Must leave the invalid rows out of the column batches"""
+        parser = ParserSalesCsv(str(self.path), max_errors=10)
+        batches = list(parser.iter_column_batches(size=2))
+        self.assertEqual(['Product Low', 'Product High'], [p for batch in batches for p in batch['product']])
+        self.assertEqual([3, 4, 6], [error.row for error in parser.errors])
+
+    def test_max_errors(self):
+        """Must raise ParserError when the limit of errors is reached"""
+        parser = ParserSalesCsv(str(self.path), max_errors=2)
+        with self.assertRaisesMessage(ParserError, 'The file has at least 2 invalid rows'):
+            list(parser.iter_rows())
+        self.assertEqual([3, 4], [error.row for error in parser.errors])
+
+    def test_max_errors_skip_invalid(self):
+        """Must go on reading after the limit of errors when skipping, only counting the errors after it"""
+        parser = ParserSalesCsv(str(self.path), max_errors=2, skip_invalid=True)
+        self.assertEqual(['Product Low', 'Product High'], [row.product for row in parser.iter_rows()])
+        self.assertEqual([3, 4], [error.row for error in parser.errors])
+        self.assertEqual(3, parser.errors_count)
+
+    def test_header_error(self):
+        """Must record the header error and raise ParserError, the invalid header isn't skipped like a row"""
+        self.path.write_text('Product;Category;Total;Sold;Cost\nProduct Low;Category A;1;9;R$ 4,70\n', encoding='utf-8')
+        parser = ParserSalesCsv(str(self.path), max_errors=10)
+        with self.assertRaises(ParserError):
+            list(parser.iter_rows())
+        self.assertEqual([RowError(1, 3, "cabeçalho 'Total', deveria ser sold")], parser.errors)
+
+    def test_pop_errors(self):
+        """Must return the errors once, keeping their count"""
+        parser = ParserSalesCsv(str(self.path), max_errors=10)
+        list(parser.iter_rows())
+        self.assertEqual(3, len(parser.pop_errors()))
+        self.assertEqual([], parser.pop_errors())
+        self.assertEqual(3, parser.errors_count)
+
+
+class ParserSalesCheckLayoutTest(TestCase):
+    def get_parser(self, content):
+        file = BytesIO(content.encode())
+        file.name = 'FileName.csv'
+        return get_parser(file)
+
+    def test_valid(self):
+        parser = self.get_parser('Product;Category;Sold;Cost;Total\nProduct Low;Category A;9;R$ 4,70;R$ 47,30\n')
+        parser.check_layout()
+
+    def test_first_rows_only(self):
+        """Must not read the rows after the first ones"""
+        parser = self.get_parser('Product;Category;Sold;Cost;Total\nProduct Low;Category A;9;R$ 4,70;R$ 47,30\n'
+                                 'Product Bad;Category A;a;R$ 4,70;R$ 47,30\n')
+        parser.check_layout(rows=1)
+
+    def test_invalid_row(self):
+        parser = self.get_parser('Product;Category;Sold;Cost;Total\nProduct Bad;Category A;a;R$ 4,70;R$ 47,30\n')
+        with self.assertRaisesMessage(ParserError, 'Row 2 has invalid values'):
+            parser.check_layout()
+
+    def test_invalid_row_after_valid_row(self):
+        """Must check every row of the range, not only the ones before the first valid row"""
+        parser = self.get_parser('Product;Category;Sold;Cost;Total\nProduct Low;Category A;9;R$ 4,70;R$ 47,30\n'
+                                 'Product Bad;Category A;x;R$ 4,70;R$ 47,30\n')
+        with self.assertRaisesMessage(ParserError, 'Row 3 has invalid values'):
+            parser.check_layout()
+
+    def test_no_sales(self):
+        with self.assertRaisesMessage(ParserError, 'The file has no sales'):
+            self.get_parser('Product;Category;Sold;Cost;Total\n').check_layout()
+
+    def test_unreadable(self):
+        file = BytesIO(b'not a workbook')
+        file.name = 'FileName.xlsx'
+        with self.assertRaisesMessage(ParserError, 'The file can not be read'):
+            get_parser(file).check_layout()
+
+    def test_file_left_open(self):
+        """Must not close a file object owned by the caller"""
+        parser = self.get_parser('Product;Category;Sold;Cost;Total\nProduct Low;Category A;9;R$ 4,70;R$ 47,30\n')
+        parser.check_layout()
+        self.assertFalse(parser.file_path.closed)
+
+
+class ParserSalesStreamTest(TestCase):
+    def setUp(self):
+        content = b'Product;Category;Sold;Cost;Total\nProduct Low;Category A;9;R$ 4,70;R$ 47,30\n'
+        self.file = File(BufferedReader(Stream(content)), 'FileName.csv')
+        self.parser = get_parser(self.file)
+
+    def test_spool(self):
+        """Must copy a file that can't seek once and read the copy as many times as needed"""
+        self.assertEqual(1, self.parser.count_rows())
+        self.assertEqual(['Product Low'], [row.product for row in self.parser.iter_rows()])
+        self.assertIsInstance(self.parser.spooled, BytesIO)
+
+    def test_spool_to_disk(self):
+        """Must spool a file bigger than spool_max_size to disk"""
+        self.parser.spool_max_size = 10
+        self.assertEqual(1, self.parser.count_rows())
+        self.assertNotIsInstance(self.parser.spooled, BytesIO)
+
+    def test_close(self):
+        self.parser.count_rows()
+        spooled = self.parser.spooled
+        self.parser.close()
+        self.assertTrue(spooled.closed)
+        self.assertIsNone(self.parser.spooled)
+
+
+class GetParserTest(TestCase):
+    def test_parser_by_extension(self):
+        parsers = (('FileName.xlsx', ParserSalesXlsx), ('FileName.csv', ParserSalesCsv),
+                   ('FileName.TSV', ParserSalesTsv))
+        for path, parser in parsers:
+            with self.subTest(path=path):
+                self.assertIsInstance(get_parser(path), parser)
+
+
+class ParserSalesXlsxTestColumnBatches(TestCase):
+    def setUp(self):
+        header = [(Cell('Product'), Cell('Category'), Cell('Sold'), Cell('Cost'), Cell('Total'))]
+        self.rows = header + [
+            (Cell(f'Product {i}'), Cell('Category A'), Cell('9'), Cell('R$ 4,70'), Cell('R$ 47,30')) for i in range(5)
+        ]
+
+    def get_batches(self, rows, size=2):
+        with patch('salesmanagement.importer.parser.load_workbook') as mock:
+            mock.return_value.active.iter_rows.return_value = rows
+            return list(ParserSalesXlsx('FileName.xlsx').iter_column_batches(size=size))
+
+    def test_batches_size(self):
+        """Must fill each batch up to size, the last one takes the remaining rows"""
+        self.assertEqual([2, 2, 1], [len(batch) for batch in self.get_batches(self.rows)])
+
+    def test_columns(self):
+        """Must convert the values column by column"""
+        batch = self.get_batches(self.rows, size=10)[0]
+        self.assertEqual([f'Product {i}' for i in range(5)], batch['product'])
+        self.assertEqual([9] * 5, batch['sold'])
+        self.assertEqual([Decimal('4.70')] * 5, batch['cost'])
+
+    def test_invalid_row(self):
+        """Must raise ParserError with the number of the invalid row"""
+        self.rows[4] = (Cell('Product 3'), Cell('Category A'), Cell('a'), Cell('R$ 4,70'), Cell('R$ 47,30'))
+        with self.assertRaisesMessage(ParserError, 'Row 5 has invalid values'):
+            self.get_batches(self.rows)
+
+    def test_inconsistent_columns(self):
+        self.rows[2] = (Cell('Product 1'), Cell('Category A'))
+        with self.assertRaisesMessage(ParserError, 'Row 3 has 2 columns, expected 5'):
+            self.get_batches(self.rows)
+
+
+class ParserSalesXlsxTestSheets(TestCase):
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.path = str(Path(self.dir.name) / 'FileName.xlsx')
+        wb = Workbook()
+        wb.active.title = 'Store A'
+        for title in ('Store A', 'Store B'):
+            ws = wb[title] if title in wb.sheetnames else wb.create_sheet(title)
+            ws.append(['Product', 'Category', 'Sold', 'Cost', 'Total'])
+            ws.append([f'Product {title}', 'Category A', 2, 'R$ 4,70', 'R$ 9,40'])
+        wb.save(self.path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_sheet_names(self):
+        self.assertEqual(['Store A', 'Store B'], ParserSalesXlsx(self.path).sheet_names())
+
+    def test_active_sheet(self):
+        self.assertEqual(['Product Store A'], [row.product for row in ParserSalesXlsx(self.path).iter_rows()])
+
+    def test_sheet(self):
+        """Must read the chosen sheet"""
+        parser = ParserSalesXlsx(self.path, sheet='Store B')
+        self.assertEqual(['Product Store B'], [row.product for row in parser.iter_rows()])
+        self.assertEqual(1, parser.count_rows())
+
+    def test_sheet_not_found(self):
+        parser = ParserSalesXlsx(self.path, sheet='Store C')
+        with self.assertRaisesMessage(ParserError, 'Sheet Store C not found'):
+            list(parser.iter_rows())
+        self.assertIsNone(parser.count_rows())
@@ -0,0 +1,230 @@
+from datetime import date
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from unittest import skipUnless
+
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+
+from salesmanagement.importer.factories import SalesImportFileFactory
+from salesmanagement.importer.models import SalesImportFile
+from salesmanagement.importer.parser import ColumnBatch, HEADER, ParserSalesXlsx, SaleRow
+from salesmanagement.importer.pgcopy import COPY_STAGING, CopySalesImporter, can_copy_sales
+from salesmanagement.importer.tasks import import_sales_task, merge_sales_chunks_task
+from salesmanagement.importer.tests import mock_storage
+from salesmanagement.manager.factories import CompanyFactory, ProductCategoryFactory, ProductFactory
+from salesmanagement.manager.models import (MonthlySales, Product, ProductCategory, ProductCurrentSale,
+                                            ProductsSale)
+
+
+class CanCopySalesTest(TestCase):
+    def test_sqlite(self):
+        """Must fall back to the ORM on databases without COPY"""
+        with patch('salesmanagement.importer.pgcopy.connection') as connection:
+            connection.vendor = 'sqlite'
+            self.assertFalse(can_copy_sales(10 ** 6))
+
+    @override_settings(IMPORT_COPY_MIN_ROWS=1000)
+    def test_postgresql(self):
+        with patch('salesmanagement.importer.pgcopy.connection') as connection:
+            connection.vendor = 'postgresql'
+            self.assertTrue(can_copy_sales(1000))
+            self.assertFalse(can_copy_sales(999))
+            self.assertFalse(can_copy_sales(None))
+
+    @override_settings(IMPORT_COPY_MIN_ROWS=0)
+    def test_disabled(self):
+        with patch('salesmanagement.importer.pgcopy.connection') as connection:
+            connection.vendor = 'postgresql'
+            self.assertFalse(can_copy_sales(10 ** 6))
+
+
+class CopySalesImporterTest(TestCase):
+    def setUp(self):
+        self.importer = CopySalesImporter(CompanyFactory.create(), date(2018, 7, 1))
+        self.sales = [SaleRow('Product, Low', 'Category A', 9, Decimal('4.70'), Decimal('47.30')),
+                      SaleRow('Product High', 'Category B', 5, Decimal('3.20'), Decimal('107.50'))]
+        self.connection_patcher = patch('salesmanagement.importer.pgcopy.connection')
+
+    def copy(self, batch):
+        with self.connection_patcher as connection:
+            self.importer.copy_batch(batch)
+        cursor = connection.cursor.return_value.__enter__.return_value
+        sql, buffer = cursor.copy_expert.call_args[0]
+        return sql, buffer.read()
+
+    def test_copy_rows(self):
+        """Must stream the rows as CSV"""
+        sql, content = self.copy(self.sales)
+        self.assertEqual(COPY_STAGING, sql)
+        self.assertEqual('"Product, Low",Category A,9,4.70,47.30\r\nProduct High,Category B,5,3.20,107.50\r\n', content)
+
+    def test_copy_columns(self):
+        """Must stream a ColumnBatch like the rows"""
+        batch = ColumnBatch(HEADER, [list(column) for column in zip(*self.sales)])
+        self.assertEqual(self.copy(self.sales), self.copy(batch))
+
+    def test_merge(self):
+        """Must merge with a statement for each table, formatted with their names"""
+        with self.connection_patcher as connection:
+            self.importer.merge()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        statements = [call[0][0] for call in cursor.execute.call_args_list]
+
+        self.assertEqual(6, len(statements))
+        self.assertIn('INSERT INTO manager_productcategory', statements[0])
+        self.assertIn('INSERT INTO manager_product_company', statements[3])
+        self.assertIn('sold = ps.sold + EXCLUDED.sold', statements[4])
+        self.assertEqual('DROP TABLE import_sales_staging', statements[5])
+        for statement in statements:
+            self.assertNotIn('{', statement)
+
+    def test_merge_conflicts(self):
+        """Must insert with ON CONFLICT so concurrent imports don't fail or duplicate rows"""
+        with self.connection_patcher as connection:
+            self.importer.merge()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        statements = [call[0][0] for call in cursor.execute.call_args_list]
+
+        for statement in statements[:2] + statements[3:5]:
+            self.assertIn('ON CONFLICT', statement)
+        self.assertIn('ON CONFLICT (company_id, product_id, sale_month) DO UPDATE', statements[4])
+
+    def test_merge_replace(self):
+        with self.connection_patcher as connection:
+            self.importer.merge(replace=True)
+        cursor = connection.cursor.return_value.__enter__.return_value
+        statements = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertIn('DELETE FROM manager_productssale', statements[-3])
+        self.assertIn('sold = EXCLUDED.sold', statements[-2])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'COPY needs PostgreSQL, set DATABASE_URL to a PostgreSQL database')
+class CopySalesImporterPostgresTest(TestCase):
+    """Runs the statements on the database"""
+
+    def setUp(self):
+        self.company = CompanyFactory.create()
+        self.month = date(2018, 7, 1)
+        self.sales = [SaleRow('Product, Low', 'Category A', 9, Decimal('4.70'), Decimal('47.30')),
+                      SaleRow('Product High', 'Category B', 5, Decimal('3.20'), Decimal('107.50')),
+                      SaleRow('Product, Low', 'Category A', 1, Decimal('5.00'), Decimal('5.00'))]
+
+    def copy(self, sales, replace=False):
+        importer = CopySalesImporter(self.company, self.month)
+        with transaction.atomic():
+            importer.create_staging()
+            importer.copy_batch(sales)
+            importer.merge(replace=replace)
+
+    def get_sales(self):
+        q = ProductsSale.objects.filter(company=self.company, sale_month=self.month).order_by('product__name')
+        return [(s.product.name, s.product.category.name, s.sold, s.cost.amount, s.total.amount) for s in q]
+
+    def test_merge(self):
+        """Must save the products sale summed by product keeping the cost of the first row"""
+        self.copy(self.sales)
+        expected = [('Product High', 'Category B', 5, Decimal('3.20'), Decimal('107.50')),
+                    ('Product, Low', 'Category A', 10, Decimal('4.70'), Decimal('52.30'))]
+        self.assertEqual(expected, self.get_sales())
+        self.assertEqual(2, self.company.product_set.count())
+
+    def test_add(self):
+        self.copy(self.sales)
+        self.copy(self.sales[:1])
+        self.assertEqual([5, 19], [sold for name, category, sold, cost, total in self.get_sales()])
+
+    def test_replace(self):
+        self.copy(self.sales)
+        self.copy([SaleRow('Product High', 'Category B', 7, Decimal('3.20'), Decimal('22.40'))], replace=True)
+        self.assertEqual([('Product High', 'Category B', 7, Decimal('3.20'), Decimal('22.40'))], self.get_sales())
+
+    def test_monthly_and_current_sales(self):
+        """Must refresh the month sums and the current sales of the company"""
+        self.copy(self.sales)
+        monthly = MonthlySales.objects.filter(company=self.company).order_by('category__name')
+        self.assertEqual([('Category A', 1, 10), ('Category B', 1, 5)],
+                         [(m.category.name, m.products, m.sold) for m in monthly])
+        self.assertEqual(2, ProductCurrentSale.objects.filter(company=self.company).count())
+
+    def test_existing_products(self):
+        """Must reuse the categories and products already saved"""
+        ProductFactory.create(name='Product High', category=ProductCategoryFactory.create(name='Category B'))
+        self.copy(self.sales)
+        self.assertEqual((2, 2), (ProductCategory.objects.count(), Product.objects.count()))
+
+
+@override_settings(IMPORT_CHUNK_SIZE=2, IMPORT_BATCH_SIZE=2)
+class ImportSalesTaskCopyTest(TestCase):
+    def setUp(self):
+        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+        with mock_storage('sales_imported_files/FileName.xlsx'), task_patcher:
+            self.sale_file = SalesImportFileFactory.create(company__name='Company Name')
+
+        with patch('salesmanagement.importer.tasks.can_copy_sales', return_value=True), \
+                patch('salesmanagement.importer.tasks.chord') as self.chord_mock, \
+                patch.object(ParserSalesXlsx, 'count_rows', return_value=3):
+            import_sales_task(self.sale_file.pk)
+
+        self.import_batch_id = str(self.sale_file.import_batch_id)
+        self.chunks = [{'rows': 2, 'errors': 0, 'sales': [['Category A', 'Product 0', 2, '4.70', '9.40']]},
+                       {'rows': 1, 'errors': 0, 'sales': [['Category A', 'Product 1', 1, '4.70', '4.70'],
+                                                          ['Category A', 'Product 2', 1, '4.70', '4.70']]}]
+
+    def merge(self):
+        with patch('salesmanagement.importer.tasks.can_copy_sales', return_value=True), \
+                patch('salesmanagement.importer.tasks.CopySalesImporter') as importer_mock, \
+                patch('salesmanagement.importer.models.notify'):
+            merge_sales_chunks_task(self.chunks, self.sale_file.pk, import_batch_id=self.import_batch_id)
+        return importer_mock
+
+    def test_split_in_chunks(self):
+        """Must parse big files in chunks, like on other databases, so each task fits in the time limit"""
+        chunks = self.chord_mock.call_args[0][0]
+        self.assertEqual([(0, 2), (2, 4)], [tuple(chunk.args[1:]) for chunk in chunks])
+
+    def test_copy(self):
+        """Must load the merged sales of the chunks with COPY"""
+        importer = self.merge().return_value
+        importer.create_staging.assert_called_once_with()
+        batches = [call[0][0] for call in importer.copy_batch.call_args_list]
+        self.assertEqual([2, 1], [len(batch) for batch in batches])
+        self.assertEqual(SaleRow('Product 0', 'Category A', 2, Decimal('4.70'), Decimal('9.40')), batches[0][0])
+        importer.merge.assert_called_once_with(replace=False)
+
+    def test_copy_replace(self):
+        SalesImportFile.objects.filter(pk=self.sale_file.pk).update(replace_mode=True)
+        self.merge().return_value.merge.assert_called_once_with(replace=True)
+
+    def test_imported(self):
+        self.merge()
+        sale_file = SalesImportFile.objects.get(pk=self.sale_file.pk)
+        self.assertEqual((SalesImportFile.IMPORTED, 3), (sale_file.status, sale_file.imported_rows))
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY needs PostgreSQL, set DATABASE_URL to a PostgreSQL database')
+    def test_copy_postgresql(self):
+        with patch('salesmanagement.importer.tasks.can_copy_sales', return_value=True), \
+                patch('salesmanagement.importer.models.notify'):
+            merge_sales_chunks_task(self.chunks, self.sale_file.pk, import_batch_id=self.import_batch_id)
+
+        sales = ProductsSale.objects.filter(company=self.sale_file.company).order_by('product__name')
+        self.assertEqual([2, 1, 1], [sale.sold for sale in sales])
+        self.assertEqual(3, SalesImportFile.objects.get(pk=self.sale_file.pk).imported_rows)
+
+    def test_redelivered(self):
+        """Must not import the file again when the tasks run again after the COPY was committed"""
+        self.merge()
+        importer_mock = self.merge()
+        with patch('salesmanagement.importer.tasks.can_copy_sales', return_value=True), \
+                patch('salesmanagement.importer.tasks.CopySalesImporter') as task_importer_mock, \
+                patch('salesmanagement.importer.tasks.chord') as chord_mock, \
+                patch.object(ParserSalesXlsx, 'count_rows', return_value=3), \
+                patch('salesmanagement.importer.models.notify'):
+            import_sales_task(self.sale_file.pk, self.import_batch_id)
+
+        importer_mock.assert_not_called()
+        task_importer_mock.assert_not_called()
+        chord_mock.assert_not_called()
+        self.assertFalse(ProductsSale.objects.exists())
+        self.assertEqual(3, SalesImportFile.objects.get(pk=self.sale_file.pk).imported_rows)
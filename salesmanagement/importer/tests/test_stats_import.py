@@ -0,0 +1,90 @@
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from salesmanagement.importer.factories import SalesImportFileFactory
+from salesmanagement.importer.models import SalesImportFile
+from salesmanagement.importer.stats import ImportStats
+from salesmanagement.importer.tests import mock_storage
+
+
+class ImportStatsTest(TestCase):
+    def setUp(self):
+        self.stats = ImportStats()
+
+    def test_stages(self):
+        expected = ('upload', 'queue', 'open', 'parse', 'lookup', 'write', 'notify')
+        self.assertEqual(expected, tuple(self.stats.durations))
+
+    def test_add(self):
+        self.stats.add('parse', 1.5)
+        self.stats.add('parse', 1)
+        self.assertEqual(2.5, self.stats.durations['parse'])
+
+    def test_measure(self):
+        with patch('salesmanagement.importer.stats.time.perf_counter', side_effect=[10, 12.5]):
+            with self.stats.measure('write'):
+                pass
+        self.assertEqual(2.5, self.stats.durations['write'])
+
+    def test_iterate(self):
+        """Must yield every item measuring the time to produce them"""
+        with patch('salesmanagement.importer.stats.time.perf_counter', side_effect=[0, 1, 1, 3, 3, 4]):
+            items = list(self.stats.iterate('parse', [1, 2]))
+        self.assertEqual([1, 2], items)
+        self.assertEqual(4, self.stats.durations['parse'])
+
+    def test_peak_memory(self):
+        """Must measure the growth of the memory peak since the stats were created"""
+        with patch('salesmanagement.importer.stats.reset_peak_memory', return_value=True) as reset_mock, \
+                patch('salesmanagement.importer.stats.read_memory_status', side_effect=[1000, 5000]) as read_mock:
+            self.assertEqual(4000, ImportStats(memory=True).peak_memory())
+        reset_mock.assert_called_once_with()
+        self.assertEqual(['VmRSS', 'VmHWM'], [call[0][0] for call in read_mock.call_args_list])
+
+    def test_peak_memory_not_measured(self):
+        self.assertIsNone(self.stats.peak_memory())
+
+    def test_peak_memory_not_reset(self):
+        """Must not measure the memory when the peak can't be reset"""
+        with patch('salesmanagement.importer.stats.reset_peak_memory', return_value=False):
+            self.assertIsNone(ImportStats(memory=True).peak_memory())
+
+
+class SalesImportFileStatsTest(TestCase):
+    def setUp(self):
+        with mock_storage('sales_imported_files/FileName.xlsx'), \
+                patch('salesmanagement.importer.tasks.import_sales_task.apply_async'):
+            self.obj = SalesImportFileFactory.create()
+
+        self.stats = ImportStats()
+        for stage in ('open', 'parse', 'lookup', 'write'):
+            self.stats.add(stage, 0.5)
+
+    def test_queued_at(self):
+        """Must record when the file was sent to the queue"""
+        self.assertIsNotNone(self.obj.queued_at)
+
+    def test_add_stats(self):
+        """Must sum the durations of every run"""
+        self.obj.add_stats(self.stats)
+        self.obj.add_stats(self.stats)
+        obj = SalesImportFile.objects.get(pk=self.obj.pk)
+        self.assertEqual((1, 1, 1, 1), (obj.open_time, obj.parse_time, obj.lookup_time, obj.write_time))
+
+    def test_rows_per_second(self):
+        """Must divide the imported rows by the time spent opening, parsing and saving them"""
+        self.obj.checkpoint(100)
+        self.obj.add_stats(self.stats)
+        self.assertEqual(50, SalesImportFile.objects.get(pk=self.obj.pk).rows_per_second)
+
+    def test_peak_memory(self):
+        """Must keep the biggest peak of the runs"""
+        with patch.object(ImportStats, 'peak_memory', side_effect=[4000, 3000]):
+            self.obj.add_stats(self.stats)
+            self.obj.add_stats(self.stats)
+        self.assertEqual(4000, SalesImportFile.objects.get(pk=self.obj.pk).peak_memory)
+
+    def test_without_peak_memory(self):
+        self.obj.add_stats(self.stats)
+        self.assertEqual(0, SalesImportFile.objects.get(pk=self.obj.pk).peak_memory)
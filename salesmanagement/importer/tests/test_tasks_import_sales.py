@@ -1,19 +1,22 @@
 import pytest
 
 from datetime import date
+from decimal import Decimal
+from uuid import uuid4
 from unittest.mock import patch, MagicMock
 
-from django.test import TestCase
+from celery.exceptions import Retry
+from django.test import TestCase, override_settings
 from djmoney.money import Money
 from django.utils.translation import gettext as _
 
 from salesmanagement.importer.factories import SalesImportFileFactory
-from salesmanagement.importer.tests import mock_storage
+from salesmanagement.importer.tests import StreamStorage, get_temporary_xlsx_file, mock_storage
 from salesmanagement.manager.factories import CompanyFactory
 from salesmanagement.importer.models import SalesImportFile
-from salesmanagement.importer.parser import ParserSalesXlsx
-from salesmanagement.importer.tasks import import_sales_task
-from salesmanagement.manager.models import Product, ProductCategory, ProductsSale
+from salesmanagement.importer.parser import ParserSalesXlsx, ParserError, RowError, SaleRow, get_parser
+from salesmanagement.importer.tasks import import_sales_task, aggregate_sales_chunk_task, merge_sales_chunks_task
+from salesmanagement.manager.models import MonthlySales, Product, ProductCategory, ProductsSale
 
 pytestmark = pytest.mark.django_db
 
@@ -23,20 +26,21 @@ class ImportSalesTaskSuccessTest(TestCase):
     def setUpClass(cls):
         super().setUpClass()
         parsed_xlsx = [
-            {'product': 'Product Low', 'category': 'Category A', 'sold': 9, 'cost': Money(4.7, 'BRL'),
-             'total': Money(47.3, 'BRL')},
-            {'product': 'Product Low', 'category': 'Category A', 'sold': 7, 'cost': Money(5.70, 'BRL'),
-             'total': Money(90.30, 'BRL')},
-            {'product': 'Product High', 'category': 'Category B', 'sold': 5, 'cost': Money(3.2, 'BRL'),
-             'total': Money(107.5, 'BRL')}
+            SaleRow(product='Product Low', category='Category A', sold=9, cost=Decimal('4.7'),
+                    total=Decimal('47.3')),
+            SaleRow(product='Product Low', category='Category A', sold=7, cost=Decimal('5.70'),
+                    total=Decimal('90.30')),
+            SaleRow(product='Product High', category='Category B', sold=5, cost=Decimal('3.2'),
+                    total=Decimal('107.5'))
         ]
 
-        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.delay')
-        patcher_parser = patch.object(ParserSalesXlsx, 'as_data', return_value=parsed_xlsx)
+        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+        patcher_parser = patch.object(ParserSalesXlsx, 'iter_rows', return_value=(row for row in parsed_xlsx))
+        patcher_rows = patch.object(ParserSalesXlsx, 'count_rows', return_value=None)
         patcher_storage = mock_storage('sales_imported_files/FileName.xlsx')
         notify_patcher = patch("salesmanagement.importer.models.notify", return_value=MagicMock(send=MagicMock()))
 
-        with patcher_storage, patcher_parser, task_patcher, notify_patcher:
+        with patcher_storage, patcher_rows, patcher_parser, task_patcher, notify_patcher:
             cls.sale_file = SalesImportFileFactory.create(company__name='Company Name')
             import_sales_task(cls.sale_file.pk)
 
@@ -64,27 +68,34 @@ class ImportSalesTaskSuccessTest(TestCase):
 
     def test_products_sale_sold_count(self):
         """Must sum sold count if have repeated products"""
-        products = [('Product Low', 16), ('Product High', 5)]
-        sales = [(sale.product.name, sale.sold) for sale in ProductsSale.objects.all()]
+        products = [('Product High', 5), ('Product Low', 16)]
+        sales = [(sale.product.name, sale.sold) for sale in ProductsSale.objects.order_by('product__name')]
         self.assertEqual(products, sales)
 
     def test_products_sale_total_count(self):
         """Must sum total count if have repeated products"""
-        products = [('Product Low', Money(137.60, 'BRL')), ('Product High', Money(107.5, 'BRL'))]
-        sales = [(sale.product.name, sale.total) for sale in ProductsSale.objects.all()]
+        products = [('Product High', Money(107.5, 'BRL')), ('Product Low', Money(137.60, 'BRL'))]
+        sales = [(sale.product.name, sale.total) for sale in ProductsSale.objects.order_by('product__name')]
         self.assertEqual(products, sales)
 
+    def test_monthly_sales(self):
+        """Must sum the sales of each category of the month"""
+        categories = [('Category A', 1, 16, Money(137.60, 'BRL')), ('Category B', 1, 5, Money(107.5, 'BRL'))]
+        summed = [(m.category.name, m.products, m.sold, m.total) for m in MonthlySales.objects.order_by('pk')]
+        self.assertEqual(categories, summed)
+
 
 class ImportSalesTaskFailTest(TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
-        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.delay')
-        patcher_parser = patch.object(ParserSalesXlsx, 'as_data', return_value=[])
+        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+        patcher_parser = patch.object(ParserSalesXlsx, 'iter_rows', return_value=(row for row in []))
+        patcher_rows = patch.object(ParserSalesXlsx, 'count_rows', return_value=None)
         patcher_storage = mock_storage('sales_imported_files/FileName.xlsx')
         notify_patcher = patch("salesmanagement.importer.models.notify", return_value=MagicMock(send=MagicMock()))
 
-        with patcher_storage, patcher_parser, task_patcher, notify_patcher:
+        with patcher_storage, patcher_rows, patcher_parser, task_patcher, notify_patcher:
             cls.sale_file = SalesImportFileFactory.create(company__name='Company Name')
             import_sales_task(cls.sale_file.pk)
 
@@ -92,3 +103,612 @@ class ImportSalesTaskFailTest(TestCase):
         """Must set status field to ERROR"""
         self.sale_file = SalesImportFile.objects.get(pk=self.sale_file.pk)
         self.assertEqual(SalesImportFile.ERROR, self.sale_file.status)
+
+
+class ImportSalesTaskInvalidRowTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        def parsed_xlsx():
+            yield SaleRow(product='Product Low', category='Category A', sold=9, cost=Decimal('4.7'),
+                          total=Decimal('47.3'))
+            raise ParserError('Row 3 has invalid values')
+
+        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+        patcher_parser = patch.object(ParserSalesXlsx, 'iter_rows', return_value=parsed_xlsx())
+        patcher_rows = patch.object(ParserSalesXlsx, 'count_rows', return_value=None)
+        patcher_storage = mock_storage('sales_imported_files/FileName.xlsx')
+        notify_patcher = patch("salesmanagement.importer.models.notify", return_value=MagicMock(send=MagicMock()))
+
+        with patcher_storage, patcher_rows, patcher_parser, task_patcher, notify_patcher:
+            cls.sale_file = SalesImportFileFactory.create(company__name='Company Name')
+            import_sales_task(cls.sale_file.pk)
+
+    def test_status_error(self):
+        """Must set status field to ERROR"""
+        self.sale_file = SalesImportFile.objects.get(pk=self.sale_file.pk)
+        self.assertEqual(SalesImportFile.ERROR, self.sale_file.status)
+
+    def test_rollback_rows_already_saved(self):
+        """Must not keep the rows saved before the invalid one"""
+        self.assertFalse(ProductsSale.objects.exists())
+
+
+class ImportSalesTaskRowErrorsTest(TestCase):
+    def setUp(self):
+        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+        patcher_storage = mock_storage('sales_imported_files/FileName.xlsx')
+        self.notify_patcher = patch("salesmanagement.importer.models.notify")
+        self.rows_patcher = patch.object(ParserSalesXlsx, 'count_rows', return_value=4)
+        with patcher_storage, task_patcher:
+            self.sale_file = SalesImportFileFactory.create(company__name='Company Name')
+
+    def run_task(self, skip_invalid_rows=False):
+        def iter_values(first_row, last_row):
+            yield ('Product', 'Category', 'Sold', 'Cost', 'Total')
+            yield ('Product Low', 'Category A', 9, 'R$ 4,70', 'R$ 47,30')
+            yield ('Product Bad', 'Category A', 'a', 'R$ 4,70', 'R$ 47,30')
+            yield ('Product Short', 'Category A')
+            yield ('Product High', 'Category B', 5, 'R$ 3,20', 'R$ 107,50')
+
+        SalesImportFile.objects.filter(pk=self.sale_file.pk).update(skip_invalid_rows=skip_invalid_rows)
+        with self.notify_patcher as notify_mock, self.rows_patcher:
+            with patch.object(ParserSalesXlsx, 'iter_values', side_effect=iter_values):
+                import_sales_task(self.sale_file.pk)
+
+        self.notify_mock = notify_mock
+        return SalesImportFile.objects.get(pk=self.sale_file.pk)
+
+    def test_fail(self):
+        """Must fail without saving the valid rows"""
+        self.assertEqual(SalesImportFile.ERROR, self.run_task().status)
+        self.assertFalse(ProductsSale.objects.exists())
+
+    def test_errors(self):
+        """Must record every invalid row"""
+        expected = "Linha 3, coluna 3: valor inválido 'a' em sold\nLinha 4: tem 2 colunas, deveria ter 5\n"
+        self.assertEqual(expected, self.run_task().import_errors)
+
+    def test_notify_errors(self):
+        """Must send the invalid rows in the notification description"""
+        sale_file = self.run_task()
+        self.assertEqual(sale_file.import_errors, self.notify_mock.send.call_args[1]['description'])
+
+    @override_settings(IMPORT_MAX_ERRORS=1)
+    def test_max_errors(self):
+        """Must stop at the limit of errors"""
+        self.assertEqual("Linha 3, coluna 3: valor inválido 'a' em sold\n", self.run_task().import_errors)
+
+    @override_settings(IMPORT_MAX_ERRORS=1)
+    def test_max_errors_skip_invalid_rows(self):
+        """Must import the valid rows after the limit of errors, keeping only the errors up to it"""
+        sale_file = self.run_task(skip_invalid_rows=True)
+        self.assertEqual(SalesImportFile.IMPORTED, sale_file.status)
+        self.assertEqual(2, sale_file.imported_rows)
+        self.assertEqual("Linha 3, coluna 3: valor inválido 'a' em sold\n", sale_file.import_errors)
+
+    def test_skip_invalid_rows(self):
+        """Must import the valid rows and record the invalid ones"""
+        sale_file = self.run_task(skip_invalid_rows=True)
+        self.assertEqual(SalesImportFile.IMPORTED, sale_file.status)
+        self.assertEqual(2, sale_file.imported_rows)
+        products = [s.product.name for s in ProductsSale.objects.order_by('product__name')]
+        self.assertEqual(['Product High', 'Product Low'], products)
+        self.assertEqual(2, len(sale_file.import_errors.splitlines()))
+
+    @override_settings(IMPORT_BATCH_SIZE=1, IMPORT_SLICE_TIME=-1)
+    def test_resume_after_invalid_rows(self):
+        """Must go on after the invalid rows skipped by the committed batches, not after the imported rows"""
+        values = [('Product', 'Category', 'Sold', 'Cost', 'Total'),
+                  ('Product A', 'Category A', 1, 'R$ 4,70', 'R$ 4,70'),
+                  ('Product Bad', 'Category A', 'a', 'R$ 4,70', 'R$ 4,70'),
+                  ('Product C', 'Category A', 1, 'R$ 4,70', 'R$ 4,70'),
+                  ('Product D', 'Category A', 1, 'R$ 4,70', 'R$ 4,70')]
+
+        def iter_values(first_row, last_row):
+            yield from values[first_row - 1:last_row]
+
+        SalesImportFile.objects.filter(pk=self.sale_file.pk).update(skip_invalid_rows=True)
+        with self.notify_patcher, self.rows_patcher, patch.object(ParserSalesXlsx, 'iter_values', side_effect=iter_values):
+            for retry in range(len(values)):
+                try:
+                    import_sales_task(self.sale_file.pk)
+                    break
+                except Retry:
+                    pass
+
+        sale_file = SalesImportFile.objects.get(pk=self.sale_file.pk)
+        self.assertEqual(SalesImportFile.IMPORTED, sale_file.status)
+        self.assertEqual(3, sale_file.imported_rows)
+        self.assertEqual(4, sale_file.resume_row)
+        sales = [(s.product.name, s.sold) for s in ProductsSale.objects.order_by('pk')]
+        self.assertEqual([('Product A', 1), ('Product C', 1), ('Product D', 1)], sales)
+        self.assertEqual(1, len(sale_file.import_errors.splitlines()))
+
+    @override_settings(IMPORT_COLUMNAR=True)
+    def test_skip_invalid_rows_columnar(self):
+        """Must skip the invalid rows when parsing by column too"""
+        self.assertEqual(2, self.run_task(skip_invalid_rows=True).imported_rows)
+
+
+@override_settings(IMPORT_CHUNK_SIZE=50)
+class ImportSalesTaskChunksTest(TestCase):
+    def setUp(self):
+        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+        patcher_rows = patch.object(ParserSalesXlsx, 'count_rows', return_value=120)
+        patcher_storage = mock_storage('sales_imported_files/FileName.xlsx')
+        chord_patcher = patch('salesmanagement.importer.tasks.chord')
+
+        with patcher_storage, patcher_rows, task_patcher, chord_patcher as chord_mock:
+            self.chord_mock = chord_mock
+            self.sale_file = SalesImportFileFactory.create(company__name='Company Name')
+            import_sales_task(self.sale_file.pk)
+
+    def test_split_rows_in_chunks(self):
+        """Must create a subtask for each rows range"""
+        chunks = self.chord_mock.call_args[0][0]
+        ranges = [tuple(chunk.args) for chunk in chunks]
+        expected = [(self.sale_file.pk, 0, 50), (self.sale_file.pk, 50, 100), (self.sale_file.pk, 100, 150)]
+        self.assertEqual(expected, ranges)
+
+    def test_merge_callback(self):
+        """Must merge the chunks with merge_sales_chunks_task"""
+        callback = self.chord_mock.return_value.call_args[0][0]
+        self.assertEqual('salesmanagement.importer.tasks.merge_sales_chunks_task', callback.task)
+        self.assertEqual((self.sale_file.pk,), tuple(callback.args))
+
+    def test_import_batch_id(self):
+        """Must pass the import run of the file to the chunks and the callback"""
+        import_batch_id = str(self.sale_file.import_batch_id)
+        chunks = self.chord_mock.call_args[0][0]
+        self.assertEqual({import_batch_id}, {chunk.kwargs['import_batch_id'] for chunk in chunks})
+        callback = self.chord_mock.return_value.call_args[0][0]
+        self.assertEqual(import_batch_id, callback.kwargs['import_batch_id'])
+
+    def test_redelivered_after_merge(self):
+        """Must not import the file again when the task runs again after the chunks were merged"""
+        import_batch_id = str(self.sale_file.import_batch_id)
+        chunks = [{'rows': 2, 'sales': [['Category A', 'Product Low', 9, '4.70', '47.30']]}]
+        sales = [SaleRow('Product Low', 'Category A', 9, Decimal('4.70'), Decimal('47.30'))] * 2
+        with patch('salesmanagement.importer.models.notify'), \
+                patch.object(ParserSalesXlsx, 'count_rows', return_value=120), \
+                patch.object(ParserSalesXlsx, 'iter_rows', return_value=(row for row in sales)):
+            merge_sales_chunks_task(chunks, self.sale_file.pk, import_batch_id=import_batch_id)
+            import_sales_task(self.sale_file.pk, import_batch_id)
+
+        sale_file = SalesImportFile.objects.get(pk=self.sale_file.pk)
+        self.assertEqual((SalesImportFile.IMPORTED, 2), (sale_file.status, sale_file.imported_rows))
+        self.assertEqual(9, ProductsSale.objects.get().sold)
+
+    def test_keep_processing(self):
+        """Must not change the status until the chunks are merged"""
+        self.sale_file = SalesImportFile.objects.get(pk=self.sale_file.pk)
+        self.assertEqual(SalesImportFile.PROCESSING, self.sale_file.status)
+
+
+@override_settings(IMPORT_CHUNK_SIZE=50)
+class ImportSalesTaskSheetsTest(TestCase):
+    def setUp(self):
+        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+        patcher_storage = mock_storage('sales_imported_files/FileName.xlsx')
+        patcher_names = patch.object(ParserSalesXlsx, 'sheet_names', return_value=['Store A', 'Store B'])
+        patcher_rows = patch.object(ParserSalesXlsx, 'count_rows', side_effect=[20, 60])
+        chord_patcher = patch('salesmanagement.importer.tasks.chord')
+
+        with patcher_storage, patcher_names, patcher_rows, task_patcher, chord_patcher as chord_mock:
+            self.chord_mock = chord_mock
+            self.sale_file = SalesImportFileFactory.create(company__name='Company Name', sheets='*')
+            import_sales_task(self.sale_file.pk)
+
+    def test_split_sheets_in_chunks(self):
+        """Must create a subtask for each rows range of each sheet"""
+        chunks = self.chord_mock.call_args[0][0]
+        ranges = [tuple(chunk.args) + (chunk.kwargs['sheet'],) for chunk in chunks]
+        pk = self.sale_file.pk
+        expected = [(pk, 0, 50, 'Store A'), (pk, 0, 50, 'Store B'), (pk, 50, 100, 'Store B')]
+        self.assertEqual(expected, ranges)
+
+    def test_total_rows(self):
+        """Must sum the rows of every sheet"""
+        self.assertEqual(80, SalesImportFile.objects.get(pk=self.sale_file.pk).total_rows)
+
+
+class AggregateSalesChunkTaskTest(TestCase):
+    def setUp(self):
+        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+        patcher_storage = mock_storage('sales_imported_files/FileName.xlsx')
+        with patcher_storage, task_patcher:
+            self.sale_file = SalesImportFileFactory.create(company__name='Company Name')
+
+    def test_aggregated_chunk(self):
+        """Must return the rows count and the sales aggregated by product"""
+        parsed_xlsx = [
+            SaleRow(product='Product Low', category='Category A', sold=9, cost=Decimal('4.70'),
+                    total=Decimal('47.30')),
+            SaleRow(product='Product Low', category='Category A', sold=7, cost=Decimal('5.70'),
+                    total=Decimal('90.30')),
+        ]
+        with patch.object(ParserSalesXlsx, 'iter_rows', return_value=(row for row in parsed_xlsx)) as mock:
+            result = aggregate_sales_chunk_task(self.sale_file.pk, 50, 100)
+
+        mock.assert_called_once_with(50, 100)
+        expected = {'rows': 2, 'sales': [['Category A', 'Product Low', 16, '4.70', '137.60']], 'errors': 0}
+        self.assertEqual(expected, result)
+
+    def test_progress(self):
+        """Must advance the progress of the file before the chunks are merged"""
+        self.sale_file.set_total_rows(4)
+        sales = [SaleRow('Product Low', 'Category A', 9, Decimal('4.70'), Decimal('47.30'))] * 2
+        with patch.object(ParserSalesXlsx, 'iter_rows', return_value=(row for row in sales)):
+            aggregate_sales_chunk_task(self.sale_file.pk, 0, 2)
+
+        self.assertEqual(25, SalesImportFile.objects.get(pk=self.sale_file.pk).progress)
+
+    def test_sheet_chunk(self):
+        """Must read the rows of the chunk sheet"""
+        with patch.object(ParserSalesXlsx, 'iter_rows', return_value=(row for row in [])):
+            with patch('salesmanagement.importer.tasks.get_parser', wraps=get_parser) as mock:
+                aggregate_sales_chunk_task(self.sale_file.pk, 0, 50, sheet='Store B')
+
+        self.assertEqual('Store B', mock.call_args[1]['sheet'])
+
+    def test_invalid_chunk(self):
+        """Must return None when the rows range is invalid"""
+        with patch.object(ParserSalesXlsx, 'iter_rows', side_effect=ParserError):
+            self.assertIsNone(aggregate_sales_chunk_task(self.sale_file.pk, 0, 50))
+
+    def test_invalid_rows(self):
+        """Must record the invalid rows and leave the sales out when they aren't skipped"""
+        def iter_rows(parser, start, stop):
+            parser.errors.append(RowError(52, 3, "valor inválido 'a' em sold"))
+            parser.errors_count += 1
+            yield SaleRow('Product Low', 'Category A', 9, Decimal('4.70'), Decimal('47.30'))
+
+        with patch.object(ParserSalesXlsx, 'iter_rows', autospec=True, side_effect=iter_rows):
+            result = aggregate_sales_chunk_task(self.sale_file.pk, 50, 100)
+
+        self.assertEqual({'rows': 1, 'sales': [], 'errors': 1}, result)
+        sale_file = SalesImportFile.objects.get(pk=self.sale_file.pk)
+        self.assertEqual("Linha 52, coluna 3: valor inválido 'a' em sold\n", sale_file.import_errors)
+
+
+class MergeSalesChunksTaskTest(TestCase):
+    def setUp(self):
+        self.task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+        self.patcher_storage = mock_storage('sales_imported_files/FileName.xlsx')
+        self.notify_patcher = patch("salesmanagement.importer.models.notify")
+        with self.patcher_storage, self.task_patcher:
+            self.sale_file = SalesImportFileFactory.create(company__name='Company Name')
+
+    def merge(self, chunks):
+        with self.notify_patcher:
+            merge_sales_chunks_task(chunks, self.sale_file.pk)
+        return SalesImportFile.objects.get(pk=self.sale_file.pk)
+
+    def test_merge(self):
+        """Must save the sales summed across the chunks keeping the first cost"""
+        chunks = [
+            {'rows': 2, 'sales': [['Category A', 'Product Low', 16, '4.70', '137.60']]},
+            {'rows': 2, 'sales': [['Category B', 'Product High', 5, '3.20', '107.50'],
+                                  ['Category A', 'Product Low', 1, '5.00', '5.00']]},
+        ]
+        sale_file = self.merge(chunks)
+
+        self.assertEqual(SalesImportFile.IMPORTED, sale_file.status)
+        sales = [(s.product.name, s.sold, s.cost, s.total) for s in ProductsSale.objects.order_by('product__name')]
+        expected = [('Product High', 5, Money('3.20', 'BRL'), Money('107.50', 'BRL')),
+                    ('Product Low', 17, Money('4.70', 'BRL'), Money('142.60', 'BRL'))]
+        self.assertEqual(expected, sales)
+
+    def test_invalid_chunk(self):
+        """Must set status to ERROR when a chunk is invalid"""
+        chunks = [{'rows': 2, 'sales': [['Category A', 'Product Low', 16, '4.70', '137.60']]}, None]
+        self.assertEqual(SalesImportFile.ERROR, self.merge(chunks).status)
+        self.assertFalse(ProductsSale.objects.exists())
+
+    def test_invalid_rows(self):
+        """Must set status to ERROR when a chunk has invalid rows"""
+        chunks = [{'rows': 2, 'sales': [], 'errors': 1}]
+        self.assertEqual(SalesImportFile.ERROR, self.merge(chunks).status)
+
+    def test_skip_invalid_rows(self):
+        """Must save the valid rows when the invalid ones are skipped"""
+        SalesImportFile.objects.filter(pk=self.sale_file.pk).update(skip_invalid_rows=True)
+        chunks = [{'rows': 2, 'sales': [['Category A', 'Product Low', 16, '4.70', '137.60']], 'errors': 1}]
+        self.assertEqual(SalesImportFile.IMPORTED, self.merge(chunks).status)
+        self.assertEqual(16, ProductsSale.objects.get().sold)
+
+    def test_empty_file(self):
+        """Must set status to ERROR when the chunks have no rows"""
+        self.assertEqual(SalesImportFile.ERROR, self.merge([{'rows': 0, 'sales': []}]).status)
+
+    def test_checkpoint(self):
+        """Must record the rows of every chunk"""
+        chunks = [{'rows': 2, 'sales': [['Category A', 'Product Low', 16, '4.70', '137.60']]}] * 2
+        self.assertEqual(4, self.merge(chunks).imported_rows)
+
+    def test_merge_once(self):
+        """Must not save the chunks again when the callback is retried"""
+        chunks = [{'rows': 2, 'sales': [['Category A', 'Product Low', 16, '4.70', '137.60']]}]
+        self.merge(chunks)
+        self.merge(chunks)
+        self.assertEqual(16, ProductsSale.objects.get().sold)
+
+
+class ImportSalesTaskCheckpointTest(TestCase):
+    def setUp(self):
+        self.sales = [SaleRow(product=f'Product {i}', category='Category A', sold=1, cost=Decimal('4.70'),
+                              total=Decimal('4.70')) for i in range(3)]
+        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+        patcher_storage = mock_storage('sales_imported_files/FileName.xlsx')
+        self.notify_patcher = patch("salesmanagement.importer.models.notify")
+        self.rows_patcher = patch.object(ParserSalesXlsx, 'count_rows', return_value=3)
+        with patcher_storage, task_patcher:
+            self.sale_file = SalesImportFileFactory.create(company__name='Company Name')
+
+    def run_task(self, rows):
+        with self.notify_patcher, self.rows_patcher, patch.object(ParserSalesXlsx, 'iter_rows') as mock:
+            mock.return_value = (row for row in rows)
+            try:
+                import_sales_task(self.sale_file.pk)
+            finally:
+                self.sale_file = SalesImportFile.objects.get(pk=self.sale_file.pk)
+        return mock
+
+    @override_settings(IMPORT_BATCH_SIZE=2)
+    def test_checkpoint(self):
+        """Must record every row committed"""
+        self.run_task(iter(self.sales))
+        self.assertEqual(3, self.sale_file.imported_rows)
+
+    @override_settings(IMPORT_BATCH_SIZE=2)
+    def test_progress(self):
+        """Must record the total rows and the parsed rows"""
+        self.run_task(iter(self.sales))
+        self.assertEqual(3, self.sale_file.total_rows)
+        self.assertEqual(3, self.sale_file.parsed_rows)
+
+    def test_parsed_rows_on_resume(self):
+        """Must not count twice the rows parsed after the checkpoint"""
+        self.sale_file.add_parsed_rows(3)
+        self.sale_file.checkpoint(2, resume_row=2)
+        self.run_task(iter(self.sales[2:]))
+        self.assertEqual(3, self.sale_file.parsed_rows)
+
+    def test_stats(self):
+        """Must record the stages durations of the import"""
+        self.run_task(iter(self.sales))
+        self.assertGreater(self.sale_file.queue_time, 0)
+        self.assertGreater(self.sale_file.parse_time, 0)
+        self.assertGreater(self.sale_file.write_time, 0)
+        self.assertGreater(self.sale_file.rows_per_second, 0)
+
+    def test_import_batch_id(self):
+        """Must have an import batch id since the file was sent"""
+        self.assertIsNotNone(self.sale_file.import_batch_id)
+
+    def test_resume_from_checkpoint(self):
+        """Must read only the rows after the checkpoint"""
+        self.sale_file.checkpoint(2, resume_row=2)
+        mock = self.run_task(iter(self.sales[2:]))
+        mock.assert_called_once_with(2, None)
+        self.assertEqual(3, self.sale_file.imported_rows)
+        self.assertEqual(SalesImportFile.IMPORTED, self.sale_file.status)
+
+    @override_settings(IMPORT_BATCH_SIZE=2, IMPORT_COLUMNAR=True)
+    def test_columnar(self):
+        """Must import the file parsed by column"""
+        values = [('Product', 'Category', 'Sold', 'Cost', 'Total')]
+        values += [(f'Product {i}', 'Category A', '1', 'R$ 4,70', 'R$ 4,70') for i in range(3)]
+        with self.notify_patcher, self.rows_patcher, patch.object(ParserSalesXlsx, 'iter_values') as mock:
+            mock.return_value = (row for row in values)
+            import_sales_task(self.sale_file.pk)
+
+        self.sale_file = SalesImportFile.objects.get(pk=self.sale_file.pk)
+        self.assertEqual(3, self.sale_file.imported_rows)
+        self.assertEqual(3, ProductsSale.objects.count())
+
+    @override_settings(IMPORT_BATCH_SIZE=2, IMPORT_SLICE_TIME=-1)
+    def test_time_slice(self):
+        """Must commit the batch and retry to go on in a new task when the slice time is over"""
+        with self.assertRaises(Retry):
+            self.run_task(iter(self.sales))
+
+        self.assertEqual(2, self.sale_file.imported_rows)
+        self.assertEqual(2, ProductsSale.objects.count())
+        self.assertEqual(SalesImportFile.PROCESSING, self.sale_file.status)
+
+    @override_settings(IMPORT_BATCH_SIZE=1)
+    def test_discard_committed_rows_on_error(self):
+        """Must delete the sales committed before an invalid row"""
+        def rows():
+            yield self.sales[0]
+            raise ParserError('Row 3 has invalid values')
+
+        self.run_task(rows())
+        self.assertFalse(ProductsSale.objects.exists())
+        self.assertFalse(MonthlySales.objects.exists())
+        self.assertEqual(0, self.sale_file.imported_rows)
+        self.assertEqual(SalesImportFile.ERROR, self.sale_file.status)
+
+
+class ImportSalesTaskReplaceTest(TestCase):
+    def setUp(self):
+        self.sales = [SaleRow(product=f'Product {i}', category='Category A', sold=1, cost=Decimal('4.70'),
+                              total=Decimal('4.70')) for i in range(3)]
+        self.task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+        self.patcher_storage = mock_storage('sales_imported_files/FileName.xlsx')
+        self.notify_patcher = patch("salesmanagement.importer.models.notify")
+        with self.patcher_storage, self.task_patcher:
+            self.sale_file = SalesImportFileFactory.create(company__name='Company Name')
+        self.run_task(self.sales)
+
+        with self.patcher_storage, self.task_patcher:
+            self.sale_file.file = 'sales_imported_files/FileNameFixed.xlsx'
+            self.sale_file.save()
+
+    def run_task(self, rows):
+        with self.notify_patcher, patch.object(ParserSalesXlsx, 'count_rows', return_value=len(rows)), \
+                patch.object(ParserSalesXlsx, 'iter_rows', return_value=(row for row in rows)):
+            import_sales_task(self.sale_file.pk)
+        self.sale_file = SalesImportFile.objects.get(pk=self.sale_file.pk)
+
+    def test_replace(self):
+        """Must make the month sales equal to the new file"""
+        fixed = [self.sales[0]._replace(sold=3), self.sales[2],
+                 SaleRow(product='Product 3', category='Category A', sold=1, cost=Decimal('4.70'),
+                         total=Decimal('4.70'))]
+        self.run_task(fixed)
+
+        sales = list(ProductsSale.objects.order_by('product__name').values_list('product__name', 'sold'))
+        self.assertEqual([('Product 0', 3), ('Product 2', 1), ('Product 3', 1)], sales)
+        self.assertEqual(3, self.sale_file.imported_rows)
+        self.assertEqual(SalesImportFile.IMPORTED, self.sale_file.status)
+
+    def test_keep_unchanged_rows(self):
+        """Must not rewrite the products sale that didn't change"""
+        modified = dict(ProductsSale.objects.values_list('pk', 'modified'))
+        self.run_task(self.sales)
+        self.assertEqual(modified, dict(ProductsSale.objects.values_list('pk', 'modified')))
+
+    def test_keep_sales_on_invalid_file(self):
+        """Must keep the previous file sales when the new file is invalid"""
+        def rows():
+            yield self.sales[0]
+            raise ParserError('Row 3 has invalid values')
+
+        with self.notify_patcher, patch.object(ParserSalesXlsx, 'count_rows', return_value=2), \
+                patch.object(ParserSalesXlsx, 'iter_rows', return_value=rows()):
+            import_sales_task(self.sale_file.pk)
+
+        self.assertEqual(3, ProductsSale.objects.count())
+        self.assertEqual(SalesImportFile.ERROR, SalesImportFile.objects.get(pk=self.sale_file.pk).status)
+
+    def test_keep_sales_on_empty_file(self):
+        """Must keep the previous file sales when the new file has no sales"""
+        self.run_task([])
+        self.assertEqual(3, ProductsSale.objects.count())
+        self.assertEqual(SalesImportFile.ERROR, self.sale_file.status)
+
+    def test_merge_chunks(self):
+        """Must replace the sales with the merged chunks"""
+        chunks = [{'rows': 1, 'sales': [['Category A', 'Product 1', 7, '4.70', '32.90']]}]
+        with self.notify_patcher:
+            merge_sales_chunks_task(chunks, self.sale_file.pk)
+
+        sales = list(ProductsSale.objects.values_list('product__name', 'sold'))
+        self.assertEqual([('Product 1', 7)], sales)
+
+
+class ImportSalesTaskStorageTest(TestCase):
+    """The file is read through its storage, here one without paths whose files can't seek"""
+
+    def setUp(self):
+        self.storage = StreamStorage()
+        field = SalesImportFile._meta.get_field('file')
+        self.storage_patcher = patch.object(field, 'storage', self.storage)
+        self.notify_patcher = patch("salesmanagement.importer.models.notify")
+        self.task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+
+    def create(self, name, data=None):
+        data = get_temporary_xlsx_file(name).read() if data is None else data
+        with self.storage_patcher, self.task_patcher:
+            return SalesImportFileFactory.create(company__name='Company Name', file__data=data, file__filename=name)
+
+    def run_task(self, sale_file):
+        with self.storage_patcher, self.notify_patcher:
+            import_sales_task(sale_file.pk)
+        return SalesImportFile.objects.get(pk=sale_file.pk)
+
+    def test_xlsx(self):
+        sale_file = self.run_task(self.create('FileName.xlsx'))
+        self.assertEqual(SalesImportFile.IMPORTED, sale_file.status)
+        products = [s.product.name for s in ProductsSale.objects.order_by('product__name')]
+        self.assertEqual(['Product High', 'Product Low'], products)
+
+    def test_csv(self):
+        content = b'Product;Category;Sold;Cost;Total\nProduct Low;Category A;9;R$ 4,70;R$ 47,30\n'
+        sale_file = self.run_task(self.create('FileName.csv', content))
+        self.assertEqual(1, sale_file.imported_rows)
+
+    def test_chunk(self):
+        sale_file = self.create('FileName.xlsx')
+        with self.storage_patcher:
+            result = aggregate_sales_chunk_task(sale_file.pk, 1, 2)
+        self.assertEqual([['Category B', 'Product High', 5, '3.20', '107.50']], result['sales'])
+
+    def test_no_path(self):
+        """Must not need the file path"""
+        sale_file = self.create('FileName.xlsx')
+        with self.assertRaises(NotImplementedError):
+            sale_file.file.path
+
+
+class ImportSalesTaskReplacedTest(TestCase):
+    """The file is replaced while a task still runs the import of the previous one"""
+
+    def setUp(self):
+        parsed_xlsx = [
+            SaleRow(product='Product Low', category='Category A', sold=9, cost=Decimal('4.7'), total=Decimal('47.3')),
+            SaleRow(product='Product High', category='Category B', sold=5, cost=Decimal('3.2'), total=Decimal('107.5'))
+        ]
+        self.parser_patcher = patch.object(ParserSalesXlsx, 'iter_rows',
+                                           side_effect=lambda *a: (row for row in parsed_xlsx))
+        self.rows_patcher = patch.object(ParserSalesXlsx, 'count_rows', return_value=2)
+        self.notify_patcher = patch("salesmanagement.importer.models.notify")
+        with mock_storage('sales_imported_files/FileName.xlsx'), \
+                patch('salesmanagement.importer.tasks.import_sales_task.apply_async'):
+            self.sale_file = SalesImportFileFactory.create(company__name='Company Name')
+        self.import_batch_id = str(self.sale_file.import_batch_id)
+
+    def replace(self, *args):
+        SalesImportFile.objects.filter(pk=self.sale_file.pk).update(import_batch_id=uuid4())
+
+    def get_sale_file(self):
+        return SalesImportFile.objects.get(pk=self.sale_file.pk)
+
+    def test_stale_task(self):
+        """Must not import a file replaced before the task ran"""
+        self.replace()
+        with self.parser_patcher as parser_mock, self.rows_patcher, self.notify_patcher:
+            import_sales_task(self.sale_file.pk, self.import_batch_id)
+
+        parser_mock.assert_not_called()
+        self.assertEqual(SalesImportFile.PROCESSING, self.get_sale_file().status)
+
+    def test_replaced_while_importing(self):
+        """Must roll back the batch being written and stop without changing the file"""
+        import_batch = patch('salesmanagement.importer.bulk.BulkSalesImporter.import_batch', autospec=True,
+                             side_effect=self.replace)
+        with self.parser_patcher, self.rows_patcher, self.notify_patcher as notify_mock, import_batch:
+            import_sales_task(self.sale_file.pk, self.import_batch_id)
+
+        sale_file = self.get_sale_file()
+        self.assertEqual(SalesImportFile.PROCESSING, sale_file.status)
+        self.assertEqual((0, 0), (sale_file.imported_rows, sale_file.resume_row))
+        notify_mock.send.assert_not_called()
+
+    def test_current_task(self):
+        """Must import the file of the import run"""
+        with self.parser_patcher, self.rows_patcher, self.notify_patcher:
+            import_sales_task(self.sale_file.pk, self.import_batch_id)
+        self.assertEqual(SalesImportFile.IMPORTED, self.get_sale_file().status)
+
+    def test_stale_chunk(self):
+        """Must not parse the chunk of a replaced file"""
+        self.replace()
+        with self.parser_patcher as parser_mock:
+            result = aggregate_sales_chunk_task(self.sale_file.pk, 0, 50, import_batch_id=self.import_batch_id)
+        self.assertIsNone(result)
+        parser_mock.assert_not_called()
+
+    def test_stale_merge(self):
+        """Must not save the chunks of a replaced file"""
+        self.replace()
+        chunks = [{'rows': 1, 'sales': [['Category A', 'Product Low', 9, '4.70', '47.30']]}]
+        with self.notify_patcher:
+            merge_sales_chunks_task(chunks, self.sale_file.pk, import_batch_id=self.import_batch_id)
+
+        self.assertFalse(ProductsSale.objects.exists())
+        self.assertEqual(SalesImportFile.PROCESSING, self.get_sale_file().status)
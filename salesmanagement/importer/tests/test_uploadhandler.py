@@ -0,0 +1,111 @@
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import SkipFile, StopFutureHandlers, StopUpload
+from django.test import TestCase, override_settings
+
+from salesmanagement.importer.uploadhandler import (ImportMemoryUploadHandler, ImportTemporaryUploadHandler,
+                                                    MemoryHashUploadHandler, TemporaryHashUploadHandler, file_sha256)
+
+
+class HashUploadHandlerTest(TestCase):
+    def setUp(self):
+        self.content = b'sales content' * 100
+        self.expected = hashlib.sha256(self.content).hexdigest()
+
+    def upload(self, handler, chunk_size=64):
+        try:
+            handler.new_file('file', 'FileName.xlsx', 'application/octet-stream', len(self.content))
+        except StopFutureHandlers:
+            pass
+        stream = BytesIO(self.content)
+        for start in range(0, len(self.content), chunk_size):
+            handler.receive_data_chunk(stream.read(chunk_size), start)
+        return handler.file_complete(len(self.content))
+
+    def test_memory(self):
+        handler = MemoryHashUploadHandler()
+        handler.handle_raw_input(None, {}, len(self.content), None)
+        self.assertEqual(self.expected, self.upload(handler).sha256)
+
+    def test_temporary(self):
+        file = self.upload(TemporaryHashUploadHandler())
+        self.assertEqual(self.expected, file.sha256)
+        file.close()
+
+    def test_not_kept_chunks(self):
+        """Must not hash the chunks passed to the next handler"""
+        handler = MemoryHashUploadHandler()
+        handler.handle_raw_input(None, {}, 10 * 1024 * 1024, None)
+        self.assertIsNone(self.upload(handler))
+        self.assertEqual(hashlib.sha256().hexdigest(), handler.sha256.hexdigest())
+
+
+class ImportUploadHandlerTest(TestCase):
+    def setUp(self):
+        self.content = b'PK\x03\x04' + b'sales content' * 100
+
+    def upload(self, handler, file_name='FileName.xlsx', chunk_size=64):
+        try:
+            handler.new_file('file', file_name, 'application/octet-stream', len(self.content))
+        except StopFutureHandlers:
+            pass
+        for start in range(0, len(self.content), chunk_size):
+            handler.receive_data_chunk(self.content[start:start + chunk_size], start)
+        return handler.file_complete(len(self.content))
+
+    def test_valid(self):
+        handler = ImportMemoryUploadHandler()
+        handler.handle_raw_input(None, {}, len(self.content), None)
+        file = self.upload(handler)
+        self.assertEqual(hashlib.sha256(self.content).hexdigest(), file.sha256)
+        self.assertIsNone(handler.error)
+
+    def test_signature(self):
+        """Must skip a xlsx file that isn't a zip archive on its first chunk"""
+        self.content = b'sales content' * 100
+        handler = ImportTemporaryUploadHandler()
+        with self.assertRaises(SkipFile):
+            self.upload(handler)
+        self.assertEqual('O arquivo não é uma planilha xlsx válida', handler.error)
+        self.assertEqual(64, handler.received)
+
+    def test_text_file_signature(self):
+        """Must not check the first bytes of text files"""
+        self.content = b'sales content' * 100
+        file = self.upload(ImportTemporaryUploadHandler(), 'FileName.csv')
+        self.assertEqual(len(self.content), file.size)
+        file.close()
+
+    @override_settings(IMPORT_UPLOAD_MAX_SIZE=1000)
+    def test_max_size(self):
+        """Must stop the upload, leaving the rest of the request unread, once the file is over the limit"""
+        handler = ImportTemporaryUploadHandler()
+        with self.assertRaises(StopUpload) as cm:
+            self.upload(handler)
+        self.assertTrue(cm.exception.connection_reset)
+        self.assertEqual(1024, handler.received)
+
+    @override_settings(IMPORT_UPLOAD_MAX_SIZE=1000)
+    def test_max_content_length(self):
+        """Must stop the upload before receiving the file when the request is bigger than the limit"""
+        handler = ImportMemoryUploadHandler()
+        handler.handle_raw_input(None, {}, len(self.content), None)
+        with self.assertRaises(StopUpload):
+            handler.new_file('file', 'FileName.xlsx', 'application/octet-stream', len(self.content))
+        self.assertEqual(0, handler.received)
+
+
+class FileSha256Test(TestCase):
+    def test_hashed_upload(self):
+        """Must use the hash computed by the upload handler"""
+        file = ContentFile(b'data')
+        file.sha256 = 'hash'
+        self.assertEqual('hash', file_sha256(file))
+
+    def test_compute(self):
+        """Must read the file when it wasn't hashed on upload"""
+        file = ContentFile(b'data')
+        self.assertEqual(hashlib.sha256(b'data').hexdigest(), file_sha256(file))
+        self.assertEqual(b'data', file.read())
@@ -4,16 +4,20 @@ from unittest.mock import patch
 
 from django.contrib.messages import get_messages
 from django.shortcuts import resolve_url as r
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase, override_settings
 
 from salesmanagement.core.factories import RandomUserFactory
 from salesmanagement.importer.factories import SalesImportFileFactory
 from salesmanagement.manager.factories import CompanyFactory
 from salesmanagement.importer.forms import SalesImportForm
 from salesmanagement.importer.models import SalesImportFile
-from salesmanagement.importer.tests import get_temporary_text_file, mock_storage
+from salesmanagement.importer.uploadhandler import ImportMemoryUploadHandler, ImportTemporaryUploadHandler
+from salesmanagement.importer.tests import SALES_ROWS, get_temporary_text_file, get_temporary_xlsx_file, mock_storage
 from salesmanagement.manager.models import Company
 
+User = get_user_model()
+
 
 class SalesImportViewGetValid(TestCase):
     def setUp(self):
@@ -33,11 +37,12 @@ class SalesImportViewGetValid(TestCase):
         """Html must contain specific input tags"""
         tags = (('<form', 1),
                 ('enctype="multipart/form-data"', 1),
-                ('<input', 6),
+                ('<input', 8),
                 ('type="hidden"', 1),
-                ('type="text"', 1),
+                ('type="text"', 2),
                 ('type="date"', 1),
                 ('type="file"', 1),
+                ('type="checkbox"', 1),
                 ('type="submit"', 1))
 
         for text, count in tags:
@@ -70,9 +75,9 @@ class SalesImportViewPostValid(TestCase):
         self.client.login(username=user.username, password='pass')
         file_path = Path('sales_imported_files/FileName.xlsx')
         data = dict(user=user.pk, company='Company Name', month='01/07/2018',
-                    file=get_temporary_text_file(file_path.name))
+                    file=get_temporary_xlsx_file(file_path.name))
 
-        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.delay')
+        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
         with mock_storage(file_path.as_posix()), task_patcher:
             self.response = self.client.post(r('importer:sales-import'), data)
 
@@ -151,7 +156,7 @@ class SalesImportViewPostInvalidExtension(TestCase):
         """Must show a message with valid extensions"""
         form = self.response.context['form']
         error_message = form.errors['file'][0]
-        valid_extensions = ['xlsx']
+        valid_extensions = ['xlsx', 'csv', 'tsv']
 
         for ext in valid_extensions:
             with self.subTest():
@@ -163,11 +168,11 @@ class SalesImportViewPostInvalidMounth(TestCase):
         user = RandomUserFactory(password='pass')
         company = CompanyFactory.create(name='Company Name')
         month = date(day=1, month=7, year=2018)
-        file = get_temporary_text_file("FileName.xlsx")
+        file = get_temporary_xlsx_file("FileName.xlsx")
         data = dict(user=user.pk, company='Company Name', month='01/07/2018', file=file)
 
         self.client.login(username=user.username, password='pass')
-        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.delay')
+        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
         storage_partcher = mock_storage('sales_imported_files/FileName.xlsx')
 
         with storage_partcher, task_patcher:
@@ -195,3 +200,144 @@ class SalesImportViewPostInvalidMounth(TestCase):
         form = self.response.context['form']
         expected = form.errors['__all__'][0]
         self.assertEqual('O arquivo do mês de Julho de 2018 já foi importado para Company Name', expected)
+
+    def test_any_day_of_the_month(self):
+        """Must find the imported month whatever the day chosen in the form"""
+        for month, imported in (('31/07/2018', True), ('30/06/2018', False), ('01/08/2018', False)):
+            with self.subTest(month=month):
+                data = dict(user=self.obj.user.pk, company='Company Name', month=month)
+                form = SalesImportForm(data, {'file': get_temporary_xlsx_file('Other.xlsx')})
+                self.assertEqual(imported, '__all__' in form.errors)
+
+
+class SalesImportViewPostDuplicatedFile(TestCase):
+    def setUp(self):
+        user = RandomUserFactory(password='pass')
+        self.client.login(username=user.username, password='pass')
+        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+
+        # the same workbook, a new one would have other timestamps
+        file = get_temporary_xlsx_file('FileName.xlsx')
+        with mock_storage('sales_imported_files/FileName.xlsx'), task_patcher as task_mock:
+            for month in ('01/07/2018', '01/08/2018'):
+                file.seek(0)
+                data = dict(user=user.pk, company='Company Name', month=month, file=file)
+                self.response = self.client.post(r('importer:sales-import'), data)
+            self.task_mock = task_mock
+
+    def test_post(self):
+        """Invalid POST should not redirect"""
+        self.assertEqual(200, self.response.status_code)
+
+    def test_not_import_again(self):
+        """Must not store or import the file again"""
+        self.assertEqual(1, SalesImportFile.objects.count())
+        self.task_mock.assert_called_once()
+
+    def test_form_has_duplicated_error(self):
+        """Must show which import already has the file"""
+        form = self.response.context['form']
+        expected = 'Este arquivo já foi enviado: Registro de vendas de Company Name do mês de Julho de 2018'
+        self.assertEqual(expected, form.errors['file'][0])
+
+
+class SalesImportViewPostInvalidLayout(TestCase):
+    def setUp(self):
+        user = RandomUserFactory(password='pass')
+        self.client.login(username=user.username, password='pass')
+        self.data = dict(user=user.pk, company='Company Name', month='01/07/2018')
+        self.task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+
+    def post(self, file, **data):
+        with mock_storage('sales_imported_files/FileName.xlsx'), self.task_patcher as task_mock:
+            response = self.client.post(r('importer:sales-import'), dict(self.data, file=file, **data))
+
+        task_mock.assert_not_called()
+        self.assertFalse(SalesImportFile.objects.exists())
+        return response.context['form'].errors['file'][0]
+
+    def test_invalid_value(self):
+        """Must show the first invalid row without storing or queueing the file"""
+        rows = [['Product', 'Category', 'Sold', 'Cost', 'Total'], ['Product Low', 'Category A', 'a', 'R$ 4,70', 'R$ 1']]
+        expected = "O arquivo não tem o formato esperado: Linha 2, coluna 3: valor inválido 'a' em sold"
+        self.assertEqual(expected, self.post(get_temporary_xlsx_file('FileName.xlsx', rows)))
+
+    def test_invalid_value_after_valid_row(self):
+        """Must check the first rows after a valid one too"""
+        rows = SALES_ROWS + [['Product Bad', 'Category A', 'x', 'R$ 4,70', 'R$ 1']]
+        expected = "O arquivo não tem o formato esperado: Linha 4, coluna 3: valor inválido 'x' em sold"
+        self.assertEqual(expected, self.post(get_temporary_xlsx_file('FileName.xlsx', rows)))
+
+    def test_skip_invalid_rows(self):
+        """Must accept a file with invalid first rows when they are skipped"""
+        rows = [SALES_ROWS[0], ['Product Bad', 'Category A', 'x', 'R$ 4,70', 'R$ 1']] + SALES_ROWS[1:]
+        with mock_storage('sales_imported_files/FileName.xlsx'), self.task_patcher as task_mock:
+            self.client.post(r('importer:sales-import'),
+                             dict(self.data, file=get_temporary_xlsx_file('FileName.xlsx', rows), skip_invalid_rows='on'))
+
+        task_mock.assert_called_once()
+
+    def test_skip_invalid_rows_without_valid_rows(self):
+        """Must reject a file without valid first rows even when the invalid ones are skipped"""
+        rows = [SALES_ROWS[0], ['Product Bad', 'Category A', 'x', 'R$ 4,70', 'R$ 1']]
+        expected = "O arquivo não tem o formato esperado: Linha 2, coluna 3: valor inválido 'x' em sold"
+        self.assertEqual(expected, self.post(get_temporary_xlsx_file('FileName.xlsx', rows), skip_invalid_rows='on'))
+
+    def test_inconsistent_columns(self):
+        rows = [['Product', 'Category', 'Sold'], ['Product Low', 'Category A', 9]]
+        expected = 'O arquivo não tem o formato esperado: Linha 1: tem 3 colunas, deveria ter 5'
+        self.assertEqual(expected, self.post(get_temporary_xlsx_file('FileName.xlsx', rows)))
+
+    def test_no_sales(self):
+        rows = [['Product', 'Category', 'Sold', 'Cost', 'Total']]
+        self.assertEqual('O arquivo não tem vendas', self.post(get_temporary_xlsx_file('FileName.xlsx', rows)))
+
+    def test_not_a_workbook(self):
+        """Must reject the file by its first bytes while it's uploaded"""
+        self.assertEqual('O arquivo não é uma planilha xlsx válida',
+                         self.post(get_temporary_text_file('FileName.xlsx')))
+
+    def test_unreadable_workbook(self):
+        file = get_temporary_text_file('FileName.xlsx', 'PK\x03\x04 not a workbook')
+        self.assertEqual('O arquivo não pôde ser lido', self.post(file))
+
+    @override_settings(IMPORT_UPLOAD_MAX_SIZE=1024)
+    def test_max_size(self):
+        """Must reject files bigger than the limit while they're uploaded"""
+        file = get_temporary_text_file('FileName.csv', 'x' * 2048)
+        self.assertEqual('O arquivo excede o tamanho máximo de 1,0\xa0KB', self.post(file))
+
+    def test_upload_handlers(self):
+        """Must hash and validate the file with the import upload handlers"""
+        with mock_storage('sales_imported_files/FileName.xlsx'), self.task_patcher:
+            response = self.client.post(r('importer:sales-import'),
+                                        dict(self.data, file=get_temporary_xlsx_file('FileName.xlsx')))
+
+        handlers = [type(handler) for handler in response.wsgi_request.upload_handlers]
+        self.assertEqual([ImportMemoryUploadHandler, ImportTemporaryUploadHandler], handlers)
+
+    def test_csrf(self):
+        """Must check the csrf token after the upload handlers are set"""
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(User.objects.get())
+        response = client.post(r('importer:sales-import'), dict(self.data, file=get_temporary_xlsx_file('FileName.xlsx')))
+        self.assertEqual(403, response.status_code)
+
+    def test_csv(self):
+        file = get_temporary_text_file('FileName.csv', 'Product;Category;Sold;Cost;Total\nProduct Low;Category A;9\n')
+        expected = 'O arquivo não tem o formato esperado: Linha 2: tem 3 colunas, deveria ter 5'
+        self.assertEqual(expected, self.post(file))
+
+    def test_sheet_not_found(self):
+        file = get_temporary_xlsx_file('FileName.xlsx', sheets=['Store A'])
+        self.assertEqual('A planilha Store B não existe no arquivo', self.post(file, sheets='Store A, Store B'))
+
+    @override_settings(IMPORT_CHECK_ROWS=1)
+    def test_check_first_rows_only(self):
+        """Must leave the rows after the first ones to the import"""
+        rows = SALES_ROWS + [['Product Bad', 'Category A', 'a', 'R$ 4,70', 'R$ 1']]
+        with mock_storage('sales_imported_files/FileName.xlsx'), self.task_patcher as task_mock:
+            self.client.post(r('importer:sales-import'),
+                             dict(self.data, file=get_temporary_xlsx_file('FileName.xlsx', rows)))
+
+        task_mock.assert_called_once()
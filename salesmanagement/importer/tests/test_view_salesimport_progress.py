@@ -0,0 +1,74 @@
+from unittest.mock import patch
+
+from django.shortcuts import resolve_url as r
+from django.test import TestCase
+
+from salesmanagement.core.factories import RandomUserFactory
+from salesmanagement.importer.factories import SalesImportFileFactory
+from salesmanagement.importer.models import SalesImportFile
+from salesmanagement.importer.tests import mock_storage
+
+
+class SalesImportProgressViewTest(TestCase):
+    def setUp(self):
+        self.user = RandomUserFactory(password='pass')
+        self.client.login(username=self.user.username, password='pass')
+        task_patcher = patch('salesmanagement.importer.tasks.import_sales_task.apply_async')
+        with mock_storage('sales_imported_files/FileName.xlsx'), task_patcher:
+            self.obj = SalesImportFileFactory.create(user=self.user)
+
+        self.obj.set_total_rows(200)
+        self.obj.add_parsed_rows(100)
+        self.obj.checkpoint(50)
+        self.response = self.client.get(r('importer:sales-import-progress', self.obj.pk))
+
+    def test_get(self):
+        self.assertEqual(200, self.response.status_code)
+
+    def test_json(self):
+        expected = {'status': 'PROCESSING', 'parsed_rows': 100, 'imported_rows': 50, 'total_rows': 200,
+                    'progress': 37}
+        self.assertEqual(expected, self.response.json())
+
+    def test_other_user_file(self):
+        """Must not show the progress of files sent by other users"""
+        user = RandomUserFactory(password='pass')
+        self.client.login(username=user.username, password='pass')
+        response = self.client.get(r('importer:sales-import-progress', self.obj.pk))
+        self.assertEqual(404, response.status_code)
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(r('importer:sales-import-progress', self.obj.pk))
+        self.assertEqual(302, response.status_code)
+
+
+class SalesImportFileProgressTest(TestCase):
+    def setUp(self):
+        with mock_storage('sales_imported_files/FileName.xlsx'), \
+                patch('salesmanagement.importer.tasks.import_sales_task.apply_async'):
+            self.obj = SalesImportFileFactory.create()
+
+    def test_unknown_total(self):
+        self.assertEqual(0, self.obj.progress)
+
+    def test_percent(self):
+        self.obj.set_total_rows(3)
+        self.obj.add_parsed_rows(1)
+        self.obj.checkpoint(1)
+        self.assertEqual(33, self.obj.progress)
+
+    def test_parsed(self):
+        """Must go on while a chunked file is parsed, its rows are imported only at the end"""
+        self.obj.set_total_rows(4)
+        self.obj.add_parsed_rows(2)
+        self.assertEqual(25, self.obj.progress)
+        self.obj.add_parsed_rows(2)
+        self.assertEqual(50, self.obj.progress)
+        self.obj.checkpoint(4)
+        self.assertEqual(100, self.obj.progress)
+
+    def test_imported(self):
+        """Must be complete when the file was imported"""
+        self.obj.status = SalesImportFile.IMPORTED
+        self.assertEqual(100, self.obj.progress)
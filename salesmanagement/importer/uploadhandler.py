@@ -0,0 +1,102 @@
+import hashlib
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadhandler import MemoryFileUploadHandler, SkipFile, StopUpload, TemporaryFileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from django.utils.translation import gettext as _
+
+
+def file_sha256(file):
+    """Returns the sha256 of the file content, computed by the upload handlers when they received it"""
+    file_hash = getattr(file, 'sha256', None)
+    if file_hash is not None:
+        return file_hash
+
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk.encode() if isinstance(chunk, str) else chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+class HashUploadMixin:
+    """Computes the sha256 of the uploaded file while it's received, avoiding reading it again"""
+
+    def new_file(self, *args, **kwargs):
+        # the memory handler raises StopFutureHandlers from new_file when it keeps the file
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        raw_data_left = super().receive_data_chunk(raw_data, start)
+        if raw_data_left is None:
+            # the chunk was kept by this handler, the next handlers won't see it
+            self.sha256.update(raw_data)
+
+        return raw_data_left
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+
+        return file
+
+
+class MemoryHashUploadHandler(HashUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class TemporaryHashUploadHandler(HashUploadMixin, TemporaryFileUploadHandler):
+    pass
+
+
+class ImportUploadMixin(HashUploadMixin):
+    """Rejects sales files with a wrong type or size while they're received, besides hashing them"""
+    # first bytes of the files by extension, xlsx files are zip archives
+    signatures = {'.xlsx': b'PK\x03\x04'}
+    content_length = None
+    error = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.content_length = content_length
+        return super().handle_raw_input(input_data, META, content_length, boundary, encoding)
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        self.received = 0
+        self.signature = self.signatures.get(Path(file_name).suffix.lower())
+        if self.content_length and self.content_length > settings.IMPORT_UPLOAD_MAX_SIZE:
+            # the whole request is bigger than the limit, the file can't be smaller than it by much
+            self.field_name = field_name
+            self.reject_size()
+        super().new_file(field_name, file_name, *args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.IMPORT_UPLOAD_MAX_SIZE:
+            self.reject_size()
+        if start == 0 and self.signature and not raw_data.startswith(self.signature):
+            self.reject(_('O arquivo não é uma planilha xlsx válida'))
+
+        return super().receive_data_chunk(raw_data, start)
+
+    def reject_size(self):
+        # SkipFile would still read the file until its end, the fields after it are lost instead
+        self.reject(_(f'O arquivo excede o tamanho máximo de {filesizeformat(settings.IMPORT_UPLOAD_MAX_SIZE)}'),
+                    StopUpload(connection_reset=True))
+
+    def reject(self, message, exception=None):
+        self.error = message
+        errors = getattr(self.request, 'upload_errors', None)
+        if errors is not None:
+            errors[self.field_name] = message
+        raise exception or SkipFile(message)
+
+
+class ImportMemoryUploadHandler(ImportUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class ImportTemporaryUploadHandler(ImportUploadMixin, TemporaryFileUploadHandler):
+    pass
@@ -1,8 +1,9 @@
 from django.urls import path
 
-from salesmanagement.importer.views import SalesImportView
+from salesmanagement.importer.views import SalesImportView, SalesImportProgressView
 
 app_name = 'importer'
 urlpatterns = [
     path('import/', SalesImportView.as_view(), name='sales-import'),
+    path('import/<int:pk>/progress/', SalesImportProgressView.as_view(), name='sales-import-progress'),
 ]
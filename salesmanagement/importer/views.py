@@ -1,13 +1,19 @@
 from django.contrib.auth.decorators import login_required
 from django.contrib.messages.views import SuccessMessageMixin
+from django.http import JsonResponse
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.views.generic import CreateView
+from django.views.generic.detail import BaseDetailView
 
 from salesmanagement.importer.forms import SalesImportForm
 from salesmanagement.importer.models import SalesImportFile
+from salesmanagement.importer.stats import ImportStats
+from salesmanagement.importer.uploadhandler import ImportMemoryUploadHandler, ImportTemporaryUploadHandler
 
 
+@method_decorator(csrf_exempt, name='dispatch')
 @method_decorator(login_required, name='dispatch')
 class SalesImportView(SuccessMessageMixin, CreateView):
     model = SalesImportFile
@@ -15,3 +21,39 @@ class SalesImportView(SuccessMessageMixin, CreateView):
     template_name = 'importer/salesimport_form.html'
     success_url = reverse_lazy('importer:sales-import')
     success_message = "Arquivo adicionado! Assim que for importado você será notificado."
+
+    def dispatch(self, request, *args, **kwargs):
+        # the upload handlers can't be changed once the csrf check reads the request body, so it's
+        # done here after them
+        request.upload_handlers = [ImportMemoryUploadHandler(request), ImportTemporaryUploadHandler(request)]
+        request.upload_errors = {}
+        return csrf_protect(super().dispatch)(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['upload_errors'] = self.request.upload_errors
+        return kwargs
+
+    def form_valid(self, form):
+        # the request body was already received, the upload stage is storing the file
+        stats = ImportStats()
+        with stats.measure('upload'):
+            response = super().form_valid(form)
+
+        self.object.add_stats(stats)
+        return response
+
+
+@method_decorator(login_required, name='dispatch')
+class SalesImportProgressView(BaseDetailView):
+    """Import progress of a file sent by the user, as JSON to be polled by the UI"""
+    model = SalesImportFile
+    fields = ('status', 'parsed_rows', 'imported_rows', 'total_rows')
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user)
+
+    def render_to_response(self, context):
+        data = {field: getattr(self.object, field) for field in self.fields}
+        data['progress'] = self.object.progress
+        return JsonResponse(data)
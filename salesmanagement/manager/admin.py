@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.admin.views.main import ChangeList
-from django.db.models import Sum
+from django.db.models import OuterRef, Subquery, Sum
 from django.urls import reverse
 from django.utils import formats
 from django.utils.http import urlencode
@@ -8,7 +8,8 @@ from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 
 from salesmanagement.manager.inlines import ProductSalesInline
-from salesmanagement.manager.models import Company, Product, ProductCategory, ProductsSale
+from salesmanagement.manager.models import (Company, MonthlySales, Product, ProductCategory, ProductCurrentSale,
+                                            ProductsSale, money_or_empty)
 
 admin.site.site_header = _('Administração')
 
@@ -71,7 +72,7 @@ class ModelAdminCompanyFilter(admin.ModelAdmin):
 class CompanyAdmin(admin.ModelAdmin):
     fields = ('name', 'products_count', 'sold_products', 'best_seller', 'related_links')
     readonly_fields = ('products_count', 'sold_products', 'best_seller', 'related_links')
-    fields_related_links = ('related_link_products', 'related_link_sales')
+    fields_related_links = ('related_link_products', 'related_link_sales', 'related_link_monthly_sales')
     date_hierarchy = 'created'
 
     class Media:
@@ -87,7 +88,7 @@ class CompanyAdmin(admin.ModelAdmin):
     products_count.short_description = _('quantidade de produtos')
 
     def sold_products(self, obj):
-        q = obj.productssale_set.all().aggregate(sold_count=Sum('sold'))
+        q = obj.monthlysales_set.all().aggregate(sold_count=Sum('sold'))
         return q['sold_count'] or 0
 
     sold_products.short_description = _('total de produtos vendidos')
@@ -119,6 +120,9 @@ class CompanyAdmin(admin.ModelAdmin):
     def related_link_sales(self, obj):
         return self.admin_link(obj, 'productssale', 'changelist', _('Vendas'), disable_company=True)
 
+    def related_link_monthly_sales(self, obj):
+        return self.admin_link(obj, 'monthlysales', 'changelist', _('Vendas do mês'), disable_company=True)
+
     @staticmethod
     def admin_link(obj, model, view, text, disable_company=False, class_='list_filter_link', args=None):
         filters = f'company__id__exact={obj.pk}'
@@ -156,28 +160,29 @@ class ProductAdmin(ModelAdminCompanyFilter):
     class Media:
         js = ('js/list_filter_collapse.js',)
 
+    def get_queryset(self, request):
+        """Reads the current cost and price with the products, of the filtered company when there is one"""
+        q = super().get_queryset(request)
+        current = ProductCurrentSale.objects.filter(product=OuterRef('pk')).order_by('-sale_month', '-pk')
+        company_id = self.get_company_id()
+        if company_id:
+            current = current.filter(company=company_id)
+
+        return q.annotate(current_cost_amount=Subquery(current.values('cost')[:1]),
+                          current_price_amount=Subquery(current.values('price')[:1]))
+
     def current_cost(self, obj):
-        """Get last manufacturing cost in the month"""
-        q = self.get_productssale_for_company(obj).last()
-        return getattr(q, 'cost', '')
+        """Get last manufacturing cost"""
+        return money_or_empty(obj.current_cost_amount)
 
     current_cost.short_description = _('custo atual')
 
     def current_price(self, obj):
-        """Get last sale price in the month"""
-        q = self.get_productssale_for_company(obj).last()
-        return getattr(q, 'price', '')
+        """Get last sale price"""
+        return money_or_empty(obj.current_price_amount)
 
     current_price.short_description = _('preço de venda atual')
 
-    def get_productssale_for_company(self, obj):
-        company_id = self.get_company_id()
-        q = obj.productssale_set.all()
-        if company_id:
-            q = q.filter(company=company_id)
-
-        return q
-
 
 @admin.register(ProductsSale)
 class ProductsSaleAdmin(ModelAdminCompanyFilter):
@@ -209,3 +214,35 @@ class ProductsSaleAdmin(ModelAdminCompanyFilter):
 
     def has_add_permission(self, request):
         return False
+
+
+@admin.register(MonthlySales)
+class MonthlySalesAdmin(ModelAdminCompanyFilter):
+    list_display = ('company', 'category', 'month_year', 'products', 'sold', 'cost', 'price', 'total')
+    readonly_fields = list_display
+    list_filter = ('company', 'category')
+    list_display_links = None
+    list_select_related = ('company', 'category')
+    search_fields = ('company__name', 'category__name', 'sale_month')
+
+    class Media:
+        js = ('js/list_filter_collapse.js',)
+
+    def month_year(self, obj):
+        month_year = formats.date_format(obj.sale_month, format="YEAR_MONTH_FORMAT", use_l10n=True)
+        return month_year
+
+    month_year.short_description = _('mês')
+
+    def cost(self, obj):
+        return obj.cost
+
+    cost.short_description = _('preço de custo médio')
+
+    def price(self, obj):
+        return obj.price
+
+    price.short_description = _('preço de venda médio')
+
+    def has_add_permission(self, request):
+        return False
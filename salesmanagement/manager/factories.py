@@ -18,6 +18,8 @@ class ProductCategoryFactory(DjangoModelFactory):
     class Meta:
         model = ProductCategory
 
+    name = factory.Sequence(lambda n: "category %d" % n)
+
 
 @factory.django.mute_signals(signals.pre_save, signals.post_save)
 class ProductFactory(DjangoModelFactory):
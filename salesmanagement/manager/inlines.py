@@ -1,10 +1,11 @@
 from django.contrib import admin
+from django.db.models import OuterRef, Subquery
 from django.urls import reverse
 from django.utils import formats
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 
-from salesmanagement.manager.models import ProductsSale, Product
+from salesmanagement.manager.models import ProductCurrentSale, ProductsSale, Product, money_or_empty
 
 
 class CompanyProductsInline(admin.TabularInline):
@@ -36,19 +37,23 @@ class CompanyProductsInline(admin.TabularInline):
     month.short_description = _('mês')
 
     def current_cost(self, obj):
-        """Get last manufacturing cost in the month"""
-        last_sale = obj.product.productssale_set.last()
-        return getattr(last_sale, 'cost', '')
+        """Get last manufacturing cost of the product in the company"""
+        return money_or_empty(obj.current_cost_amount)
 
     current_cost.short_description = _('custo atual')
 
     def current_price(self, obj):
-        """Get last sale price in the month"""
-        last_sale = obj.product.productssale_set.last()
-        return getattr(last_sale, 'price', '')
+        """Get last sale price of the product in the company"""
+        return money_or_empty(obj.current_price_amount)
 
     current_price.short_description = _('preço de venda atual')
 
+    def get_queryset(self, request):
+        q = super().get_queryset(request).select_related('product__category')
+        current = ProductCurrentSale.objects.filter(company=OuterRef('company'), product=OuterRef('product'))
+        return q.annotate(current_cost_amount=Subquery(current.values('cost')[:1]),
+                          current_price_amount=Subquery(current.values('price')[:1]))
+
     def has_add_permission(self, request):
         return False
 
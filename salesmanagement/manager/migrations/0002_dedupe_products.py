@@ -0,0 +1,53 @@
+from django.db import migrations
+from django.db.models import Count, Min, Sum
+
+
+def duplicated(queryset, *fields):
+    """Yields the values of the fields that are repeated and the ids of their rows, the first id is kept"""
+    repeated = queryset.values(*fields).annotate(count=Count('id'), first=Min('id')).filter(count__gt=1)
+    for values in repeated.order_by():
+        first = values.pop('first')
+        values.pop('count')
+        ids = queryset.filter(**values).exclude(id=first).values_list('id', flat=True)
+        yield first, list(ids)
+
+
+def merge_duplicates(apps, schema_editor):
+    """Merges the repeated categories, products and products sale before they become unique
+
+    The products of a repeated category move to the first one, then a repeated product moves its
+    companies and sales to the first one, and the repeated products sale of a company month have
+    their sold and total added to the first one, like the imports do.
+    """
+    ProductCategory = apps.get_model('manager', 'ProductCategory')
+    Product = apps.get_model('manager', 'Product')
+    ProductsSale = apps.get_model('manager', 'ProductsSale')
+    CompanyProduct = Product.company.through
+
+    for first, ids in duplicated(ProductCategory.objects.all(), 'name'):
+        Product.objects.filter(category_id__in=ids).update(category_id=first)
+        ProductCategory.objects.filter(id__in=ids).delete()
+
+    for first, ids in duplicated(Product.objects.all(), 'name', 'category_id'):
+        linked = set(CompanyProduct.objects.filter(product_id=first).values_list('company_id', flat=True))
+        companies = set(CompanyProduct.objects.filter(product_id__in=ids).values_list('company_id', flat=True))
+        CompanyProduct.objects.bulk_create(CompanyProduct(product_id=first, company_id=company_id)
+                                           for company_id in companies - linked)
+        ProductsSale.objects.filter(product_id__in=ids).update(product_id=first)
+        Product.objects.filter(id__in=ids).delete()
+
+    for first, ids in duplicated(ProductsSale.objects.all(), 'company_id', 'product_id', 'sale_month'):
+        sums = ProductsSale.objects.filter(id__in=[first] + ids).aggregate(sold=Sum('sold'), total=Sum('total'))
+        ProductsSale.objects.filter(id=first).update(**sums)
+        ProductsSale.objects.filter(id__in=ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
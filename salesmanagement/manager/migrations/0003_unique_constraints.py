@@ -0,0 +1,26 @@
+# Generated by Django 2.0.13 on 2026-10-18 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0002_dedupe_products'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productcategory',
+            name='name',
+            field=models.CharField(max_length=80, unique=True, verbose_name='nome'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='product',
+            unique_together={('name', 'category')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='productssale',
+            unique_together={('company', 'product', 'sale_month')},
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.0.13 on 2026-10-18 07:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0003_unique_constraints'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productssale',
+            index=models.Index(fields=['company', 'sale_month'], name='productssale_company_month_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productssale',
+            index=models.Index(fields=['product', 'company'], name='productssale_product_comp_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+
+
+def fill_monthly_sales(apps, schema_editor):
+    """Sums the products sale already imported by company, month and category"""
+    ProductsSale = apps.get_model('manager', 'ProductsSale')
+    MonthlySales = apps.get_model('manager', 'MonthlySales')
+
+    q = (ProductsSale.objects.values('company_id', 'sale_month', 'product__category_id')
+         .annotate(products=Count('id'), sold=Sum('sold'), costs=Sum('cost'), total=Sum('total')).order_by())
+    MonthlySales.objects.bulk_create(
+        MonthlySales(company_id=row['company_id'], sale_month=row['sale_month'],
+                     category_id=row['product__category_id'], products=row['products'], sold=row['sold'],
+                     costs=row['costs'], total=row['total'])
+        for row in q
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0005_monthly_sales'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_monthly_sales, migrations.RunPython.noop),
+    ]
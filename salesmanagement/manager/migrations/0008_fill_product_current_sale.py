@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+def fill_product_current_sale(apps, schema_editor):
+    """Stores the cost and price of the latest products sale of each product of each company"""
+    ProductsSale = apps.get_model('manager', 'ProductsSale')
+    ProductCurrentSale = apps.get_model('manager', 'ProductCurrentSale')
+
+    latest = {}
+    q = ProductsSale.objects.order_by('sale_month', 'pk').values_list(
+        'company_id', 'product_id', 'sale_month', 'cost', 'sold', 'total')
+    for company_id, product_id, sale_month, cost, sold, total in q.iterator():
+        latest[company_id, product_id] = (sale_month, cost, total / sold if sold else 0)
+
+    ProductCurrentSale.objects.bulk_create(
+        ProductCurrentSale(company_id=company_id, product_id=product_id, sale_month=sale_month, cost=cost, price=price)
+        for (company_id, product_id), (sale_month, cost, price) in latest.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0007_product_current_sale'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_product_current_sale, migrations.RunPython.noop),
+    ]
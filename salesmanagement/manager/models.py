@@ -6,6 +6,11 @@ from djmoney.models.fields import MoneyField
 from djmoney.money import Money
 
 
+def money_or_empty(amount):
+    """Converts an amount annotated on a queryset to Money, or '' when there is none"""
+    return Money(amount, 'BRL') if amount is not None else ''
+
+
 class Company(TimeStampedModel):
     name = models.CharField(_('nome da empresa'), max_length=150, unique=True)
 
@@ -18,7 +23,7 @@ class Company(TimeStampedModel):
 
 
 class ProductCategory(TimeStampedModel):
-    name = models.CharField(_('nome'), max_length=80)
+    name = models.CharField(_('nome'), max_length=80, unique=True)
 
     class Meta:
         verbose_name = 'categoria de produto'
@@ -36,6 +41,7 @@ class Product(TimeStampedModel):
     class Meta:
         verbose_name = 'produto'
         verbose_name_plural = 'produtos'
+        unique_together = ('name', 'category')
 
     def __str__(self):
         return self.name
@@ -52,6 +58,13 @@ class ProductsSale(TimeStampedModel):
     class Meta:
         verbose_name = 'vendas'
         verbose_name_plural = 'vendas'
+        # concurrent imports add to the same products sale instead of creating another one
+        unique_together = ('company', 'product', 'sale_month')
+        # the sales are read by company month (admin filters and imports) and by product of a company
+        indexes = [
+            models.Index(fields=['company', 'sale_month'], name='productssale_company_month_idx'),
+            models.Index(fields=['product', 'company'], name='productssale_product_comp_idx'),
+        ]
 
     def __str__(self):
         month_year = formats.date_format(self.sale_month, format="YEAR_MONTH_FORMAT", use_l10n=True)
@@ -64,3 +77,56 @@ class ProductsSale(TimeStampedModel):
         if not sold:
             return 0
         return Money(self.total.amount/sold, 'BRL')
+
+
+class MonthlySales(TimeStampedModel):
+    """Sales of a company month summed by category, kept up to date by the imports"""
+    company = models.ForeignKey(Company, verbose_name=_('empresa'), on_delete=models.CASCADE)
+    category = models.ForeignKey(ProductCategory, verbose_name=_('categoria'), on_delete=models.CASCADE)
+    sale_month = models.DateField(_('mês de venda'))
+    products = models.IntegerField(_('produtos vendidos'))
+    sold = models.IntegerField(_('unidades vendidas'))
+    costs = MoneyField(_('soma dos preços de custo'), max_digits=14, decimal_places=2, default_currency='BRL')
+    total = MoneyField(_('total da venda'), max_digits=14, decimal_places=2, default_currency='BRL')
+
+    class Meta:
+        verbose_name = 'vendas do mês'
+        verbose_name_plural = 'vendas do mês'
+        unique_together = ('company', 'sale_month', 'category')
+
+    def __str__(self):
+        month_year = formats.date_format(self.sale_month, format="YEAR_MONTH_FORMAT", use_l10n=True)
+        return f'[{self.company}]Vendas de {self.category} em {month_year}'
+
+    @property
+    def cost(self):
+        """Average cost of the products"""
+        if not self.products:
+            return 0
+        return Money(self.costs.amount/self.products, 'BRL')
+
+    @property
+    def price(self):
+        """Average sale price"""
+        sold = self.sold
+        if not sold:
+            return 0
+        return Money(self.total.amount/sold, 'BRL')
+
+
+class ProductCurrentSale(TimeStampedModel):
+    """Cost and sale price of the latest products sale of a product in a company"""
+    company = models.ForeignKey(Company, verbose_name=_('empresa'), on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, verbose_name=_('produto'), on_delete=models.CASCADE)
+    sale_month = models.DateField(_('mês de venda'))
+    cost = MoneyField(_('custo atual'), max_digits=14, decimal_places=2, default_currency='BRL')
+    price = MoneyField(_('preço de venda atual'), max_digits=14, decimal_places=2, default_currency='BRL')
+
+    class Meta:
+        verbose_name = 'venda atual do produto'
+        verbose_name_plural = 'vendas atuais dos produtos'
+        unique_together = ('company', 'product')
+
+    def __str__(self):
+        month_year = formats.date_format(self.sale_month, format="YEAR_MONTH_FORMAT", use_l10n=True)
+        return f'[{self.company}]Venda atual de {self.product} em {month_year}'
@@ -6,6 +6,7 @@ from django.contrib import admin
 from django.test import TestCase
 from djmoney.money import Money
 
+from salesmanagement.importer.bulk import refresh_monthly_sales
 from salesmanagement.manager.admin import CompanyAdmin
 from salesmanagement.manager.factories import CompanyFactory, ProductFactory, ProductsSaleFactory
 from salesmanagement.manager.models import Company
@@ -99,6 +100,13 @@ class CompanyAdminTest(TestCase):
         """related_link_sales must be installed"""
         self.assertIn('related_link_sales', self.admin.fields_related_links)
 
+    def test_related_link_monthly_sales_result(self):
+        """Must return link to monthly sales list filter, filtered by company"""
+        links = self.admin.related_link_monthly_sales(self.company)
+        matchs = self.match_related_links(links)
+        self.assertTrue(matchs)
+        self.assertIn('monthlysales', matchs[0])
+
     def test_related_link_sales_result(self):
         """Must return link to sales list filter, filtered by company"""
         links = self.admin.related_link_sales(self.company)
@@ -128,6 +136,8 @@ class CompanyAdminTest(TestCase):
         self.sales = []
         for params in sales_data:
             self.sales.append(ProductsSaleFactory(company=self.company, **params))
+        for month in (month_june, month_july):
+            refresh_monthly_sales(self.company, month)
 
     def match_related_links(self, links):
         regex = fr'<a class="list_filter_link" href="(.*)\?company__id__exact={self.company.pk}' \
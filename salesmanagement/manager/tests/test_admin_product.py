@@ -5,6 +5,7 @@ from django.contrib import admin
 from django.test import TestCase
 from djmoney.money import Money
 
+from salesmanagement.importer.bulk import refresh_current_sales
 from salesmanagement.manager.admin import ProductAdmin
 from salesmanagement.manager.factories import CompanyFactory, ProductFactory, ProductsSaleFactory
 from salesmanagement.manager.inlines import ProductSalesInline
@@ -35,20 +36,35 @@ class ProductAdminTest(TestCase):
         """Must return current product cost"""
         self.add_products_and_sales()
         self.admin.request = MagicMock(GET={})
-        self.assertEqual(Money(4.5, 'BRL'), self.admin.current_cost(self.product))
+        self.assertEqual(Money(4.5, 'BRL'), self.admin.current_cost(self.get_product()))
 
     def test_current_cost_result_filtered_by_company_changelist(self):
         """Must return current product cost filtered by company in change list view"""
         self.add_products_and_sales()
         self.admin.request = MagicMock(GET={'company__id__exact': self.companies[0].pk})
-        self.assertEqual(Money(3.5, 'BRL'), self.admin.current_cost(self.product))
+        self.assertEqual(Money(3.5, 'BRL'), self.admin.current_cost(self.get_product()))
 
     def test_current_cost_result_filtered_by_company_change_view(self):
         """Must return current product cost filtered by company in change view"""
         self.add_products_and_sales()
         get_data = dict(_changelist_filters=f'company__id__exact={self.companies[0].pk}')
         self.admin.request = MagicMock(GET=get_data)
-        self.assertEqual(Money(3.5, 'BRL'), self.admin.current_cost(self.product))
+        self.assertEqual(Money(3.5, 'BRL'), self.admin.current_cost(self.get_product()))
+
+    def test_current_without_sales(self):
+        self.admin.request = MagicMock(GET={})
+        self.assertEqual('', self.admin.current_cost(self.get_product()))
+        self.assertEqual('', self.admin.current_price(self.get_product()))
+
+    def test_current_single_query(self):
+        """Must read the current cost and price of every product with the products"""
+        ProductFactory.create_batch(3, companies=self.companies)
+        self.add_products_and_sales()
+        self.admin.request = MagicMock(GET={'company__id__exact': self.companies[0].pk})
+        with self.assertNumQueries(1):
+            for product in self.admin.get_queryset(self.admin.request):
+                self.admin.current_cost(product)
+                self.admin.current_price(product)
 
     def test_current_price_field(self):
         """current_price must be installed"""
@@ -60,20 +76,20 @@ class ProductAdminTest(TestCase):
         """Must return current product price"""
         self.add_products_and_sales()
         self.admin.request = MagicMock(GET={})
-        self.assertEqual(Money(15, 'BRL'), self.admin.current_price(self.product))
+        self.assertEqual(Money(15, 'BRL'), self.admin.current_price(self.get_product()))
 
     def test_current_price_result_filtered_by_company_changelist(self):
         """Must return current product price filtered by company in change list view"""
         self.add_products_and_sales()
         self.admin.request = MagicMock(GET={'company__id__exact': self.companies[0].pk})
-        self.assertEqual(Money(5, 'BRL'), self.admin.current_price(self.product))
+        self.assertEqual(Money(5, 'BRL'), self.admin.current_price(self.get_product()))
 
     def test_current_price_result_filtered_by_company_change_view(self):
         """Must return current product price filtered by company in change view"""
         self.add_products_and_sales()
         get_data = dict(_changelist_filters=f'company__id__exact={self.companies[0].pk}')
         self.admin.request = MagicMock(GET=get_data)
-        self.assertEqual(Money(5, 'BRL'), self.admin.current_price(self.product))
+        self.assertEqual(Money(5, 'BRL'), self.admin.current_price(self.get_product()))
 
     def test_queryset_filtered_by_company(self):
         """Must return only products from company filter"""
@@ -94,7 +110,7 @@ class ProductAdminTest(TestCase):
         self.assertEqual(['name', 'category'], list_filter)
 
     def add_products_and_sales(self):
-        month_june = date(day=1, month=7, year=2018)
+        month_june = date(day=1, month=6, year=2018)
         month_july = date(day=1, month=7, year=2018)
         sales_data = (dict(company=self.companies[0], product=self.product, sold=5, cost=Money(3.5, 'BRL'),
                            total=Money(57.5, 'BRL'), sale_month=month_june),
@@ -107,3 +123,8 @@ class ProductAdminTest(TestCase):
         self.sales = []
         for params in sales_data:
             self.sales.append(ProductsSaleFactory(**params))
+        for company in self.companies:
+            refresh_current_sales(company)
+
+    def get_product(self):
+        return self.admin.get_queryset(self.admin.request).get(pk=self.product.pk)
@@ -0,0 +1,47 @@
+from datetime import date
+
+from django.db import IntegrityError
+from django.test import TestCase
+from djmoney.money import Money
+
+from salesmanagement.manager.models import Company, MonthlySales, ProductCategory
+
+
+class MonthlySalesModelTest(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name='Company name')
+        self.category = ProductCategory.objects.create(name='Category name')
+        self.obj = MonthlySales.objects.create(
+            company=self.company,
+            category=self.category,
+            sale_month=date(day=1, month=7, year=2018),
+            products=4,
+            sold=10,
+            costs=22.4,
+            total=150.5,
+        )
+
+    def test_create(self):
+        self.assertTrue(MonthlySales.objects.exists())
+
+    def test_cost(self):
+        """Must be the average cost of the products"""
+        self.assertEqual(Money(5.6, 'BRL'), self.obj.cost)
+
+    def test_price(self):
+        """Must be the average sale price"""
+        self.assertEqual(Money(15.05, 'BRL'), self.obj.price)
+
+    def test_no_sales(self):
+        obj = MonthlySales(products=0, sold=0, costs=0, total=0)
+        self.assertEqual(0, obj.cost)
+        self.assertEqual(0, obj.price)
+
+    def test_str(self):
+        self.assertEqual('[Company name]Vendas de Category name em Julho de 2018', str(self.obj))
+
+    def test_unique_by_category(self):
+        """Must have a single row by company, month and category"""
+        with self.assertRaises(IntegrityError):
+            MonthlySales.objects.create(company=self.company, category=self.category, sale_month=self.obj.sale_month,
+                                        products=1, sold=1, costs=1, total=1)
@@ -0,0 +1,32 @@
+from datetime import date
+
+from django.db import IntegrityError
+from django.test import TestCase
+
+from salesmanagement.manager.models import Company, Product, ProductCategory, ProductCurrentSale
+
+
+class ProductCurrentSaleModelTest(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name='Company name')
+        category = ProductCategory.objects.create(name='Category name')
+        self.product = Product.objects.create(name='Product name', category=category)
+        self.obj = ProductCurrentSale.objects.create(
+            company=self.company,
+            product=self.product,
+            sale_month=date(day=1, month=7, year=2018),
+            cost=5.6,
+            price=15.05,
+        )
+
+    def test_create(self):
+        self.assertTrue(ProductCurrentSale.objects.exists())
+
+    def test_str(self):
+        self.assertEqual('[Company name]Venda atual de Product name em Julho de 2018', str(self.obj))
+
+    def test_unique_by_company_product(self):
+        """Must have a single current sale by product of a company"""
+        with self.assertRaises(IntegrityError):
+            ProductCurrentSale.objects.create(company=self.company, product=self.product,
+                                              sale_month=date(day=1, month=8, year=2018), cost=1, price=1)
@@ -142,6 +142,32 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_TASK_TIME_LIMIT = 200
 
+# Rows parsed and written to the database at a time by the sales importer
+IMPORT_BATCH_SIZE = env.int('IMPORT_BATCH_SIZE', default=1000)
+# Files with more rows than it are split in chunks of it and parsed in parallel by the workers.
+# Each xlsx chunk reads the sheet again from its start, so N chunks cost about N / 2 full reads:
+# small chunks waste CPU and the last chunk of a file of millions of rows may reach the time limit
+IMPORT_CHUNK_SIZE = env.int('IMPORT_CHUNK_SIZE', default=200000)
+# On PostgreSQL, the merged chunks of files with at least this many rows are saved with COPY, 0 always uses the ORM
+IMPORT_COPY_MIN_ROWS = env.int('IMPORT_COPY_MIN_ROWS', default=50000)
+# Seconds an import runs before committing and going on in a new task, it must be lower than the time limit
+IMPORT_SLICE_TIME = env.int('IMPORT_SLICE_TIME', default=150)
+# Parse and aggregate the rows by column, faster for big files
+IMPORT_COLUMNAR = env.bool('IMPORT_COLUMNAR', default=False)
+# Sales files bigger than it (bytes) are rejected while they're uploaded
+IMPORT_UPLOAD_MAX_SIZE = env.int('IMPORT_UPLOAD_MAX_SIZE', default=50 * 1024 * 1024)
+# Rows checked by the upload form before the file is stored and queued
+IMPORT_CHECK_ROWS = env.int('IMPORT_CHECK_ROWS', default=20)
+# Invalid rows reported by an import before it stops reading the file
+IMPORT_MAX_ERRORS = env.int('IMPORT_MAX_ERRORS', default=100)
+# Files up to it (bytes) are imported by the express queue, bigger ones by the bulk queue
+IMPORT_EXPRESS_MAX_SIZE = env.int('IMPORT_EXPRESS_MAX_SIZE', default=5 * 1024 * 1024)
+
+FILE_UPLOAD_HANDLERS = [
+    'salesmanagement.importer.uploadhandler.MemoryHashUploadHandler',
+    'salesmanagement.importer.uploadhandler.TemporaryHashUploadHandler',
+]
+
 TEST_RUNNER = "salesmanagement.runner.PytestTestRunner"
 
 LOGIN_URL = 'login'